@@ -0,0 +1,185 @@
+"""
+ASGI serving mode: recognition runs on an asyncio event loop with the async
+Speech client instead of on job worker threads.
+
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT --workers 1     (Procfile.asgi)
+
+POST /upload is handled natively here; every other route is the unchanged
+Flask app from main.py mounted through a WSGI adapter, so pages, listings,
+live streaming, TTS and /jobs/<id> behave as under gunicorn. Upload jobs are
+tracked in main.job_queue's history, so clients poll /jobs/<id> as before.
+
+Thread mode (Procfile) vs async mode (Procfile.asgi)
+----------------------------------------------------
+Thread mode, gunicorn with 1 worker and 8 threads:
+  - every request holds one of the 8 threads until it returns;
+  - recognition runs on JOB_WORKERS (2) threads, each blocked for the whole
+    long_running_recognize call. At most JOB_WORKERS recordings are being
+    recognized at once, and JOB_MAX_PENDING (32) more can wait before uploads
+    get 503s. Throughput is bounded by JOB_WORKERS / recognition latency,
+    e.g. 2 / 5 s = 0.4 recordings/s however idle the CPU is;
+  - raising JOB_WORKERS buys concurrency at one thread (and its stack) per
+    recording waiting on the API.
+
+Async mode, uvicorn with 1 worker:
+  - a recording waiting on recognition is a coroutine waiting on a gRPC call,
+    not a thread. Up to ASYNC_MAX_INFLIGHT (1000) recordings are in flight at
+    once, so throughput is bounded by ASYNC_MAX_INFLIGHT / latency until the
+    Speech quota or the CPU for WAV preprocessing becomes the limit;
+  - preprocessing and file writes still block, so they run in the
+    default thread pool (asyncio.to_thread) and never stall the loop;
+  - the mounted Flask routes get WSGI_THREADS (8) threads, the same as the
+    thread mode. Live streaming sessions hold one each as they do under
+    gunicorn;
+  - memory: a queued job carries only the recording's filename. A running
+    job reads the audio when it starts and holds it until recognized, so
+    size ASYNC_MAX_INFLIGHT to RAM / typical upload size.
+
+To compare them on the same machine, run each Procfile with
+USE_FAKE_CLIENTS=1 FAKE_LATENCY=5 and send concurrent uploads with any HTTP
+load tool while watching stt_app_jobs_pending, stt_app_async_jobs_inflight
+and stt_app_stage_seconds{stage="recognize"} on /metrics.
+"""
+import asyncio
+import contextlib
+import os
+import time
+
+from a2wsgi import WSGIMiddleware
+from google.cloud import speech
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+import fakes
+import main
+from chunking import shift_words, stitch
+from clients import ClientRegistry, ClientUnavailable
+from ids import new_id
+from ingest import MultipartUpload, UploadError
+from jobs import AsyncJobRunner, QueueFull
+from resilience import AIMDLimit, Backend, deadline
+
+ASYNC_MAX_INFLIGHT = int(os.environ.get('ASYNC_MAX_INFLIGHT', 1000))
+WSGI_THREADS = int(os.environ.get('WSGI_THREADS', 8))  # threads for the mounted Flask routes
+
+# grpc.aio clients bind to the event loop they are first used on, so they get
+# their own registry and are only created from inside the loop
+async_clients = ClientRegistry()
+if os.environ.get('USE_FAKE_CLIENTS'):
+    async_clients.register('speech', fakes.FakeSpeechAsyncClient)
+else:
+    async_clients.register('speech', speech.SpeechAsyncClient)
+stt_async_client = async_clients.lazy('speech')
+
+# calls from the loop are limited separately, their limit can grow towards ASYNC_MAX_INFLIGHT,
+# but share the speech circuit breaker with the thread-mode routes
+speech_async_backend = Backend('speech_async', timeout=main.JOB_DEADLINE, breaker=main.speech_backend.breaker,
+                               limit=AIMDLimit(main.BACKEND_CONCURRENCY, max_limit=ASYNC_MAX_INFLIGHT))
+main.backends.append(speech_async_backend)
+main.metrics.gauge_callback('backend_speech_async', 'speech_async calls, concurrency limit and circuit',
+                            speech_async_backend.stats)
+
+
+async def recognize_speech_async(input_audio):
+    """Async counterpart of main.recognize_speech, chunks are recognized concurrently."""
+    chunks = await asyncio.to_thread(main.chunked_recognizer.split, input_audio)
+    if chunks is not None:
+        with main.metrics.timer('recognize_chunked'):
+            responses = await asyncio.gather(*(
+                speech_async_backend.call_async(
+                    lambda timeout, wav=wav: stt_async_client.recognize(
+                        config=main.recognition_config, audio=speech.RecognitionAudio(content=wav),
+                        timeout=timeout))
+                for offset, wav in chunks))
+        return stitch((offset, response.results) for (offset, wav), response in zip(chunks, responses))
+
+    audio = speech.RecognitionAudio(content=input_audio)
+
+    async def long_running(timeout):
+        operation = await stt_async_client.long_running_recognize(config=main.recognition_config, audio=audio,
+                                                                  timeout=timeout)
+        return await operation.result(timeout=timeout)
+
+    with main.metrics.timer('recognize'):
+        response = await speech_async_backend.call_async(long_running)
+    return stitch([(0.0, response.results)])
+
+
+async def process_recording_async(filename, audio_data):
+    """Async counterpart of main.process_recording."""
+    if audio_data is None:
+        audio_data = await asyncio.to_thread(main.read_recording, filename)
+    audio_data, lead_in = await asyncio.to_thread(main.prepare_audio, filename, audio_data)
+    with deadline(main.JOB_DEADLINE):
+        text, words = await recognize_speech_async(audio_data)
+    words = shift_words(words, lead_in)
+    return await asyncio.to_thread(main.store_transcript, filename, text, words)
+
+
+job_runner = AsyncJobRunner(main.job_queue, process_recording_async, max_inflight=ASYNC_MAX_INFLIGHT,
+                            max_retries=main.JOB_MAX_RETRIES, backoff=main.JOB_RETRY_BACKOFF)
+main.metrics.gauge_callback('async_jobs_inflight', 'Recognition jobs running on the event loop',
+                            lambda: job_runner.inflight)
+
+
+def count_response(response, started):
+    """The Flask request hooks don't see native routes, so record the same metrics here."""
+    main.metrics.observe('request_seconds', time.perf_counter() - started,
+                         'HTTP request latency by endpoint', endpoint='upload_audio')
+    main.metrics.inc('responses_total', 1, 'HTTP responses by endpoint and status',
+                     endpoint='upload_audio', status=response.status_code)
+    return response
+
+
+async def upload_audio(request):
+    started = time.perf_counter()
+    if int(request.headers.get('content-length') or 0) > main.app.config['MAX_CONTENT_LENGTH']:
+        return count_response(JSONResponse({'error': 'Upload too large'}, 413), started)
+    filename = new_id() + '.wav'
+    file_path = main.stt_store.new_path(filename)
+    try:
+        # parsed as the body arrives, request.form() would spool it to a temporary file first
+        with main.metrics.timer('save'), MultipartUpload(request.headers.get('content-type'), 'audio_data',
+                                                         file_path, main.MAX_UPLOAD_BYTES,
+                                                         validate=main.VALIDATE_WAV_HEADER) as upload:
+            async for chunk in request.stream():
+                if chunk:
+                    await asyncio.to_thread(upload.feed, chunk)
+            upload.feed(b'')  # end of body
+            upload.finish()
+    except UploadError as e:
+        print(f"Rejecting upload: {e}")
+        return count_response(JSONResponse({'error': str(e)}, e.status), started)
+
+    try:
+        job = job_runner.submit(filename)
+    except QueueFull as e:
+        print(f"Rejecting upload, too many jobs in flight: {e}")
+        main.stt_store.delete(filename)
+        return count_response(JSONResponse({'error': 'Server busy, try again later'}, 503,
+                                           headers={'Retry-After': '5'}), started)
+    main.changes.publish('stt', filename)
+
+    return count_response(JSONResponse({'job_id': job.id, 'filename': filename,
+                                        'status_url': f"/jobs/{job.id}"}, 202), started)
+
+
+def warm_up():
+    try:
+        async_clients.get('speech')
+    except ClientUnavailable as e:
+        print(f"Async client warm-up failed: {e}")
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    main.start_background()  # only when serving, see main.start_background
+    asyncio.get_running_loop().call_later(main.CLIENT_WARMUP_DELAY, warm_up)
+    yield
+
+
+app = Starlette(routes=[
+    Route('/upload', upload_audio, methods=['POST']),
+    Mount('/', app=WSGIMiddleware(main.app, workers=WSGI_THREADS)),
+], lifespan=lifespan)
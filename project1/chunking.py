@@ -0,0 +1,119 @@
+"""
+Chunked recognition for long recordings.
+
+Long WAVs are cut at the quietest point near every max_chunk_seconds, the
+chunks are recognized in parallel on a bounded pool, and the transcripts are
+stitched back together in time order using the word time offsets the
+recognizer returns (shifted by each chunk's start time).
+"""
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from preprocess import WavDecodeError, decode_wav, downmix, encode_wav
+
+FRAME_SECONDS = 0.02
+
+
+def _seconds(offset):
+    # word offsets are datetime.timedelta from the client library
+    return offset.total_seconds() if hasattr(offset, 'total_seconds') else float(offset or 0)
+
+
+def split_points(mono, rate, max_chunk_seconds, search_seconds):
+    """Sample offsets that split mono into chunks no longer than max_chunk_seconds."""
+    frame = max(int(rate * FRAME_SECONDS), 1)
+    count = len(mono) // frame
+    energy = np.mean(mono[:count * frame].reshape(count, frame).astype(np.float64) ** 2, axis=1)
+    max_frames = max(int(max_chunk_seconds / FRAME_SECONDS), 1)
+    search_frames = max(int(search_seconds / FRAME_SECONDS), 1)
+
+    bounds = [0]
+    start = 0
+    while count - start > max_frames:
+        # quietest frame in the last search_seconds up to the hard limit, never at
+        # start itself so every chunk moves forward
+        window_start = max(start + max_frames - search_frames, start + 1)
+        window = energy[window_start:start + max_frames + 1]
+        cut = window_start + int(np.argmin(window))
+        bounds.append(cut * frame)
+        start = cut
+    bounds.append(len(mono))
+    return bounds
+
+
+def stitch(chunk_results):
+    """
+    Joins [(start_seconds, results)] of recognized chunks into (transcript,
+    words), with the words shifted into recording time and in time order.
+    """
+    segments = []
+    for offset, results in chunk_results:
+        start = offset
+        for result in results:
+            if not result.alternatives:
+                continue
+            alternative = result.alternatives[0]
+            words = [(w.word, offset + _seconds(w.start_time), offset + _seconds(w.end_time),
+                      getattr(w, 'confidence', 0.0)) for w in alternative.words]
+            # a result without words stays after the one before it
+            start = words[0][1] if words else start
+            segments.append((start, alternative.transcript, words))
+
+    segments.sort(key=lambda segment: segment[0])
+    transcript = ''.join(text + '\n' for start, text, words in segments)
+    words = [word for start, text, segment_words in segments for word in segment_words]
+    return transcript, words
+
+
+def shift_words(words, seconds):
+    """words moved seconds later, e.g. by the silence preprocessing trimmed off the front."""
+    if not seconds:
+        return words
+    return [(word, start + seconds, end + seconds, confidence) for word, start, end, confidence in words]
+
+
+class ChunkedRecognizer:
+    """
+    recognize_chunk(wav_bytes) must return the recognizer results for one
+    chunk (objects with .alternatives[0].transcript and .words).
+    """
+
+    def __init__(self, recognize_chunk, workers=4, min_seconds=60, max_chunk_seconds=50,
+                 search_seconds=10):
+        if search_seconds >= max_chunk_seconds:
+            raise ValueError("search_seconds (%s) must be shorter than max_chunk_seconds (%s)"
+                             % (search_seconds, max_chunk_seconds))
+        self.recognize_chunk = recognize_chunk
+        self.min_seconds = min_seconds
+        self.max_chunk_seconds = max_chunk_seconds
+        self.search_seconds = search_seconds
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stt-chunk')
+
+    def split(self, audio_bytes):
+        """Returns [(start_seconds, wav_bytes)] or None if the audio is short or undecodable."""
+        try:
+            samples, rate = decode_wav(audio_bytes)
+        except (WavDecodeError, ValueError):
+            return None
+        if len(samples) / rate <= self.min_seconds:
+            return None
+        mono = downmix(samples)
+        bounds = split_points(mono, rate, self.max_chunk_seconds, self.search_seconds)
+        return [(start / rate, encode_wav(mono[start:end], rate))
+                for start, end in zip(bounds, bounds[1:]) if end > start]
+
+    def recognize(self, audio_bytes):
+        """
+        Returns (transcript, words) for long audio, or None when the audio should
+        go through the normal single-request path. words is a list of
+        (word, start_seconds, end_seconds, confidence) in recording time.
+        """
+        chunks = self.split(audio_bytes)
+        if chunks is None:
+            return None
+        # each chunk runs in a copy of the caller's context, so it keeps the job's deadline
+        futures = [(offset, self._pool.submit(contextvars.copy_context().run, self.recognize_chunk, wav))
+                   for offset, wav in chunks]
+        return stitch((offset, future.result()) for offset, future in futures)
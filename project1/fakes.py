@@ -0,0 +1,214 @@
+"""
+Local stand-ins for the Google Cloud clients so the app can run and be
+load-tested offline. Enable with USE_FAKE_CLIENTS=1. FakeSpeechAsyncClient
+stands in for SpeechAsyncClient in the ASGI mode (see asgi.py), FakeS3Client
+for an S3/MinIO archive with STORAGE_BACKEND=s3, keeping the objects under
+FAKE_S3_FOLDER.
+
+Every call sleeps for a latency drawn from FAKE_LATENCY_DIST (fixed, uniform,
+exponential or lognormal, all with mean FAKE_LATENCY) and then fails with
+probability FAKE_ERROR_RATE. A call given a timeout shorter than its latency
+sleeps for the timeout and raises TimeoutError, as a gRPC deadline would.
+
+FAKE_BROWNOUT=<period>,<length>,<slowdown>,<error rate> injects a recurring
+brownout: for the first <length> seconds of every <period>, calls take
+<slowdown> times as long and fail with <error rate> instead (e.g. 60,20,10,0.5).
+
+FAKE_STREAM_REPLAY can point at a JSON list of recorded streaming results,
+e.g. [{"transcript": "hello", "is_final": false}, ...], which the fake
+streaming_recognize replays one per received audio chunk.
+"""
+import asyncio
+import io
+import json
+import math
+import os
+import random
+import struct
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+
+FAKE_LATENCY = float(os.environ.get('FAKE_LATENCY', 0.5))  # mean seconds per call
+FAKE_LATENCY_DIST = os.environ.get('FAKE_LATENCY_DIST', 'fixed')
+FAKE_ERROR_RATE = float(os.environ.get('FAKE_ERROR_RATE', 0.0))  # 0.0 - 1.0
+FAKE_STREAM_REPLAY = os.environ.get('FAKE_STREAM_REPLAY')
+FAKE_BROWNOUT = os.environ.get('FAKE_BROWNOUT')
+# extra recognition latency per second of audio, 0.1 = ten times faster than real time
+FAKE_SECONDS_PER_AUDIO_SECOND = float(os.environ.get('FAKE_SECONDS_PER_AUDIO_SECOND', 0.0))
+BYTES_PER_AUDIO_SECOND = 32000  # 16 kHz 16-bit mono
+FAKE_S3_FOLDER = os.environ.get('FAKE_S3_FOLDER', 'uploads/fake_s3')
+
+
+def _latency():
+    if FAKE_LATENCY <= 0:
+        return 0.0
+    if FAKE_LATENCY_DIST == 'uniform':
+        return random.uniform(0, 2 * FAKE_LATENCY)
+    if FAKE_LATENCY_DIST == 'exponential':
+        return random.expovariate(1 / FAKE_LATENCY)
+    if FAKE_LATENCY_DIST == 'lognormal':
+        # sigma 1 gives a long tail, mu chosen so the mean stays FAKE_LATENCY
+        return random.lognormvariate(math.log(FAKE_LATENCY) - 0.5, 1.0)
+    return FAKE_LATENCY
+
+
+_STARTED = time.monotonic()
+
+
+def _faults():
+    """(latency multiplier, error rate) right now, see FAKE_BROWNOUT."""
+    if FAKE_BROWNOUT:
+        period, length, slowdown, error_rate = (float(value) for value in FAKE_BROWNOUT.split(','))
+        if (time.monotonic() - _STARTED) % period < length:
+            return slowdown, error_rate
+    return 1.0, FAKE_ERROR_RATE
+
+
+def _simulate_call(audio_seconds=0.0, timeout=None):
+    slowdown, error_rate = _faults()
+    delay = (_latency() + audio_seconds * FAKE_SECONDS_PER_AUDIO_SECOND) * slowdown
+    if timeout is not None and delay > timeout:
+        time.sleep(max(timeout, 0))
+        raise TimeoutError("Fake backend call timed out")
+    time.sleep(delay)
+    if random.random() < error_rate:
+        raise RuntimeError("Injected fake backend error")
+
+
+async def _simulate_call_async(audio_seconds=0.0):
+    slowdown, error_rate = _faults()
+    await asyncio.sleep((_latency() + audio_seconds * FAKE_SECONDS_PER_AUDIO_SECOND) * slowdown)
+    if random.random() < error_rate:
+        raise RuntimeError("Injected fake backend error")
+
+
+def _recognize_response(size):
+    # one word per second of audio so the time offsets are realistic
+    seconds = size / BYTES_PER_AUDIO_SECOND
+    words = [SimpleNamespace(word=f"w{i}", start_time=timedelta(seconds=i),
+                             end_time=timedelta(seconds=i + 0.5), confidence=0.9)
+             for i in range(int(seconds))]
+    alternative = SimpleNamespace(transcript=f"fake transcript of {size} bytes", words=words,
+                                  confidence=0.9)
+    return SimpleNamespace(results=[SimpleNamespace(alternatives=[alternative])])
+
+
+class _FakeOperation:
+    def __init__(self, response):
+        self._response = response
+
+    def result(self, timeout=None):
+        return self._response
+
+
+class _FakeAsyncOperation:
+    def __init__(self, response):
+        self._response = response
+
+    async def result(self, timeout=None):
+        return self._response
+
+
+class FakeSpeechClient:
+    def recognize(self, config=None, audio=None, timeout=None):
+        size = len(audio.content) if audio is not None else 0
+        _simulate_call(size / BYTES_PER_AUDIO_SECOND, timeout)
+        return _recognize_response(size)
+
+    def long_running_recognize(self, config=None, audio=None, timeout=None):
+        return _FakeOperation(self.recognize(config, audio, timeout))
+
+    def streaming_recognize(self, config=None, requests=()):
+        if FAKE_STREAM_REPLAY:
+            with open(FAKE_STREAM_REPLAY) as f:
+                recorded = json.load(f)
+        else:
+            recorded = None
+        position = 0
+        received = 0
+        for request in requests:
+            received += len(request.audio_content)
+            if recorded is not None:
+                if position < len(recorded):
+                    yield _streaming_response(**recorded[position])
+                    position += 1
+            else:
+                yield _streaming_response(f"fake partial after {received} bytes", False)
+        if recorded is not None:
+            for item in recorded[position:]:
+                yield _streaming_response(**item)
+        else:
+            _simulate_call()
+            yield _streaming_response(f"fake transcript of {received} bytes", True)
+
+
+class FakeSpeechAsyncClient:
+    # timeouts are left to the caller's asyncio.wait_for
+    async def recognize(self, config=None, audio=None, timeout=None):
+        size = len(audio.content) if audio is not None else 0
+        await _simulate_call_async(size / BYTES_PER_AUDIO_SECOND)
+        return _recognize_response(size)
+
+    async def long_running_recognize(self, config=None, audio=None, timeout=None):
+        return _FakeAsyncOperation(await self.recognize(config, audio))
+
+
+class FakeTextToSpeechClient:
+    def synthesize_speech(self, input=None, voice=None, audio_config=None, timeout=None):
+        _simulate_call(timeout=timeout)
+        # silent LINEAR16 wav, roughly as long as the text would take to read
+        frames = 16000 * max(len(input.text) // 15, 1)
+        header = b'RIFF' + struct.pack('<I', 36 + frames * 2) + b'WAVEfmt ' + \
+            struct.pack('<IHHIIHH', 16, 1, 1, 16000, 32000, 2, 16) + b'data' + struct.pack('<I', frames * 2)
+        return SimpleNamespace(audio_content=header + bytes(frames * 2))
+
+
+def _streaming_response(transcript, is_final):
+    alternative = SimpleNamespace(transcript=transcript, words=[])
+    return SimpleNamespace(results=[SimpleNamespace(alternatives=[alternative], is_final=is_final)])
+
+
+class _FakeS3Error(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.response = {'Error': {'Code': code, 'Message': message}}  # as on botocore's ClientError
+
+
+class FakeS3Client:
+    """S3 subset used by storage.S3Backend, objects are files under <folder>/<bucket>/<key>."""
+
+    def __init__(self, folder=None):
+        self.folder = folder or FAKE_S3_FOLDER
+
+    def _path(self, bucket, key):
+        return os.path.join(self.folder, bucket, *key.split('/'))
+
+    def put_object(self, Bucket=None, Key=None, Body=b''):
+        _simulate_call()
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(Body)
+        os.replace(path + '.tmp', path)
+        return {}
+
+    def get_object(self, Bucket=None, Key=None, Range=None):
+        _simulate_call()
+        try:
+            with open(self._path(Bucket, Key), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            raise _FakeS3Error('NoSuchKey', f"The specified key does not exist: {Key}") from None
+        if Range:
+            start, _, end = Range[len('bytes='):].partition('-')
+            data = data[int(start):int(end) + 1 if end else None]
+        return {'Body': io.BytesIO(data), 'ContentLength': len(data)}
+
+    def delete_object(self, Bucket=None, Key=None):
+        _simulate_call()
+        try:
+            os.remove(self._path(Bucket, Key))
+        except FileNotFoundError:
+            pass
+        return {}
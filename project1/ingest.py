@@ -0,0 +1,210 @@
+"""
+Single-pass upload ingestion: the request body is read once in chunks and
+written straight to the recording's file, instead of the form parser spooling
+it to a temporary file, file.save() copying that and the handler reading the
+whole file back. The job is given the file's name, not its bytes.
+"""
+import os
+import struct
+
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+CHUNK_SIZE = 64 * 1024
+MAX_HEADER_BYTES = 64 * 1024  # give up looking for the fmt chunk after this
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+# what MediaRecorder produces (WebM in Chrome, Ogg in Firefox); static/script.js
+# posts it as recorded_audio.wav, so these are let through without a fmt chunk
+RECORDER_CONTAINERS = {b'\x1a\x45\xdf\xa3': 'webm', b'OggS': 'ogg'}
+
+
+class WavHeaderValidator:
+    """
+    Checks the RIFF/WAVE header as bytes arrive, without waiting for the whole
+    file. WebM and Ogg uploads from the browser recorder are accepted too.
+    """
+
+    def __init__(self):
+        self._header = bytearray()
+        self.done = False
+        self.info = None  # {'container', 'audio_format', 'channels', 'sample_rate', 'bits_per_sample'}
+
+    def feed(self, chunk):
+        if self.done:
+            return
+        self._header += chunk[:MAX_HEADER_BYTES - len(self._header)]
+        header = self._header
+        container = RECORDER_CONTAINERS.get(bytes(header[0:4])) if len(header) >= 4 else None
+        if container:
+            self.info = {'container': container}
+            self.done = True
+            self._header = None
+            return
+        if len(header) >= 12 and (header[0:4] != b'RIFF' or header[8:12] != b'WAVE'):
+            raise UploadError("Not a WAV, WebM or Ogg file", 415)
+
+        # walk the sub-chunks until the fmt chunk is complete
+        offset = 12
+        while offset + 8 <= len(header):
+            chunk_id = bytes(header[offset:offset + 4])
+            chunk_len = struct.unpack('<I', header[offset + 4:offset + 8])[0]
+            if chunk_id == b'fmt ':
+                if chunk_len < 16:
+                    raise UploadError("Invalid WAV fmt chunk", 415)
+                if offset + 8 + 16 > len(header):
+                    break
+                audio_format, channels, sample_rate, _, _, bits = struct.unpack(
+                    '<HHIIHH', header[offset + 8:offset + 24])
+                if channels == 0 or sample_rate == 0:
+                    raise UploadError("Invalid WAV format (no channels or sample rate)", 415)
+                self.info = {
+                    'container': 'wav',
+                    'audio_format': audio_format,
+                    'channels': channels,
+                    'sample_rate': sample_rate,
+                    'bits_per_sample': bits,
+                }
+                self.done = True
+                self._header = None
+                return
+            offset += 8 + chunk_len + (chunk_len & 1)
+
+        if len(header) >= MAX_HEADER_BYTES:
+            raise UploadError("WAV fmt chunk not found", 415)
+
+    def finish(self):
+        if not self.done:
+            raise UploadError("Truncated audio header", 415)
+        return self.info
+
+
+class UploadWriter:
+    """
+    Writes an upload to path chunk by chunk, checking its size and header as it
+    goes. With keep=True the chunks are also kept, and data holds the whole
+    upload after finish(), for handlers that process it in the request.
+    """
+
+    def __init__(self, path, max_bytes, validate=True, keep=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.validator = WavHeaderValidator() if validate else None
+        self.total = 0
+        self.data = None
+        self._kept = [] if keep else None
+        self._out = open(path, 'wb')
+
+    def write(self, chunk):
+        self.total += len(chunk)
+        if self.total > self.max_bytes:
+            raise UploadError(f"Upload exceeds {self.max_bytes} bytes", 413)
+        if self.validator:
+            self.validator.feed(chunk)
+        self._out.write(chunk)
+        if self._kept is not None:
+            self._kept.append(chunk)
+
+    def finish(self):
+        self._out.close()
+        if self.total == 0:
+            raise UploadError("Empty upload")
+        if self._kept is not None:
+            self.data = b''.join(self._kept)
+            self._kept = None
+        return self.validator.finish() if self.validator else None
+
+    def remove(self):
+        self._out.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class MultipartUpload:
+    """
+    Streams one file field of a multipart/form-data body to path as the body
+    is read, so the upload is neither spooled to a temporary file first nor
+    held in memory. Use it as a context manager: unless finish() succeeded,
+    leaving the block removes the partial file, whatever the exception
+    (including the client disconnecting).
+
+        with MultipartUpload(content_type, 'audio_data', path, max_bytes) as upload:
+            upload.read_from(stream)
+            wav_info = upload.finish()
+
+    Async servers call feed() with each chunk of the body and b'' at the end
+    instead of read_from(). With keep=True, data holds the field's bytes after
+    finish(), so a handler that needs them does not read the file back.
+    """
+
+    def __init__(self, content_type, field, path, max_bytes, validate=True, keep=False):
+        mimetype, options = parse_options_header(content_type or '')
+        boundary = options.get('boundary')
+        if mimetype != 'multipart/form-data' or not boundary:
+            raise UploadError("Expected a multipart/form-data upload")
+        self.field = field
+        self.path = path
+        self.max_bytes = max_bytes
+        self.validate = validate
+        self.keep = keep
+        self.filename = None
+        self.data = None
+        self._decoder = MultipartDecoder(boundary.encode())  # the body size is capped in feed()
+        self._writer = None  # an UploadWriter once the field's part starts
+        self._in_field = False
+        self._body_bytes = 0
+        self._finished = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def read_from(self, stream, chunk_size=CHUNK_SIZE):
+        while True:
+            data = stream.read(chunk_size)
+            self.feed(data)
+            if not data:
+                return
+
+    def feed(self, data):
+        self._body_bytes += len(data)
+        if self._body_bytes > self.max_bytes + MAX_HEADER_BYTES:
+            raise UploadError(f"Upload exceeds {self.max_bytes} bytes", 413)
+        try:
+            self._decoder.receive_data(data or None)
+            event = self._decoder.next_event()
+            while not isinstance(event, (NeedData, Epilogue)):
+                if isinstance(event, File) and event.name == self.field and self._writer is None:
+                    self.filename = event.filename
+                    self._writer = UploadWriter(self.path, self.max_bytes, self.validate, self.keep)
+                    self._in_field = True
+                elif isinstance(event, (Field, File)):
+                    self._in_field = False  # other fields are parsed and dropped
+                elif isinstance(event, Data) and self._in_field:
+                    self._writer.write(event.data)
+                event = self._decoder.next_event()
+        except ValueError:
+            raise UploadError("Malformed multipart upload")
+
+    def finish(self):
+        """Returns the WAV info, see WavHeaderValidator. Raises UploadError if the field was missing."""
+        if self._writer is None or not self.filename:
+            raise UploadError("No audio data")
+        info = self._writer.finish()
+        self.data = self._writer.data
+        self._finished = True
+        return info
+
+    def close(self):
+        if self._writer is not None and not self._finished:
+            self._writer.remove()
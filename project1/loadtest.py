@@ -0,0 +1,206 @@
+"""
+Offline load test of the app against the fake Google clients (see fakes.py).
+
+    python loadtest.py [--sizes 10 1000 10000 100000] [--threads 8] [--duration 10]
+                       [--mix upload=1,list=5,index=2,tts=1]
+                       [--latency 0.5] [--latency-dist lognormal] [--error-rate 0.01]
+
+For every directory size a scratch directory is seeded with that many
+processed recordings and the app is imported there in a child process with
+USE_FAKE_CLIENTS=1. --threads clients then send a weighted mix of requests
+through the Flask test client for --duration seconds:
+
+    upload  POST /upload with a short noise WAV (queued for recognition)
+    list    GET /api/recordings, walking the pages with next_cursor
+    index   GET /
+    tts     POST /upload_text with one of a few phrases (so the TTS cache gets hits)
+
+Reports throughput and p50/p95/p99 latency per request type, and how long
+get_stt_files takes for the first page and for the whole listing.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from ids import IdAllocator, path_for
+from preprocess import encode_wav
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PHRASES = [
+    "Hello, how are you today?",
+    "Your order has been shipped.",
+    "Please hold while we connect your call.",
+    "The meeting has been moved to three o'clock.",
+    "Thank you for your patience.",
+]
+
+
+def seed(folder, count):
+    """Writes count recordings with transcript sidecars, one second apart, in the sharded layout."""
+    os.makedirs(folder, exist_ok=True)
+    wav = encode_wav(np.zeros(1600, dtype=np.float32), 16000)
+    allocator = IdAllocator()
+    start = datetime(2024, 1, 1).timestamp()
+    for i in range(count):
+        filename = allocator.new_id(start + i) + '.wav'
+        with open(path_for(folder, filename, create=True), 'wb') as f:
+            f.write(wav)
+        with open(path_for(folder, filename + '.txt'), 'w') as f:
+            f.write(f"seeded transcript {i}\n")
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * pct / 100), len(values) - 1)]
+
+
+def timed(fn, repeat):
+    """Median seconds of repeat calls."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return percentile(times, 50)
+
+
+def noise_wav(seconds=2.0):
+    # random audio every time so nothing downstream can serve it from a cache
+    return encode_wav((np.random.default_rng().standard_normal(int(16000 * seconds)) * 0.1).astype(np.float32),
+                      16000)
+
+
+def client_loop(app, scenarios, weights, deadline, samples):
+    client = app.test_client()
+    cursor = None
+    while time.perf_counter() < deadline:
+        name = random.choices(scenarios, weights)[0]
+        start = time.perf_counter()
+        if name == 'upload':
+            response = client.post('/upload', data={'audio_data': (io.BytesIO(noise_wav()), 'audio.wav')},
+                                   content_type='multipart/form-data')
+        elif name == 'list':
+            response = client.get('/api/recordings', query_string={'kind': 'stt', 'cursor': cursor or ''})
+            if response.status_code == 200:
+                cursor = response.get_json()['next_cursor']
+        elif name == 'index':
+            response = client.get('/')
+        else:
+            response = client.post('/upload_text', data={'text': random.choice(PHRASES)})
+        samples.append((name, time.perf_counter() - start, response.status_code))
+
+
+def run_size(size, args):
+    """Runs inside the child process, in a scratch working directory."""
+    workdir = tempfile.mkdtemp(prefix=f'loadtest-{size}-')
+    try:
+        os.chdir(workdir)
+        start = time.perf_counter()
+        seed('uploads/stt', size)
+        seed_seconds = time.perf_counter() - start
+
+        sys.path.insert(0, HERE)
+        start = time.perf_counter()
+        import main
+        import_seconds = time.perf_counter() - start
+
+        page_seconds = timed(lambda: main.get_stt_files(limit=main.PAGE_SIZE + 1), 20)
+        full_seconds = timed(lambda: main.get_stt_files(), 3)
+
+        mix = dict((name, float(weight)) for name, weight in
+                   (item.split('=') for item in args.mix.split(',')))
+        samples = []  # list.append is atomic, shared by all client threads
+        deadline = time.perf_counter() + args.duration
+        threads = [threading.Thread(target=client_loop,
+                                    args=(main.app, list(mix), list(mix.values()), deadline, samples))
+                   for _ in range(args.threads)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+
+        report = {}
+        for name in mix:
+            latencies = [seconds for n, seconds, status in samples if n == name]
+            statuses = {}
+            for n, seconds, status in samples:
+                if n == name:
+                    statuses[status] = statuses.get(status, 0) + 1
+            report[name] = {'count': len(latencies), 'rps': len(latencies) / elapsed,
+                            'p50': percentile(latencies, 50), 'p95': percentile(latencies, 95),
+                            'p99': percentile(latencies, 99), 'statuses': statuses}
+        return {'size': size, 'seed_seconds': seed_seconds, 'import_seconds': import_seconds,
+                'page_seconds': page_seconds, 'full_seconds': full_seconds,
+                'rps': len(samples) / elapsed, 'jobs_pending': main.job_queue.pending(),
+                'scenarios': report}
+    finally:
+        os.chdir(HERE)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_report(result):
+    print(f"\n== {result['size']} recordings: seeded in {result['seed_seconds']:.1f}s, "
+          f"app import {result['import_seconds']:.2f}s")
+    print(f"get_stt_files: first page {result['page_seconds'] * 1000:.2f} ms, "
+          f"full listing {result['full_seconds'] * 1000:.1f} ms")
+    print(f"{'request':>8} {'count':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  statuses")
+    for name, stats in result['scenarios'].items():
+        print(f"{name:>8} {stats['count']:>7} {stats['rps']:>8.1f} {stats['p50'] * 1000:>8.1f} "
+              f"{stats['p95'] * 1000:>8.1f} {stats['p99'] * 1000:>8.1f}  {stats['statuses']}")
+    print(f"{'total':>8} {'':>7} {result['rps']:>8.1f}   ({result['jobs_pending']} jobs still pending)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 10000, 100000])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10, help="seconds of load per size")
+    parser.add_argument('--mix', default='upload=1,list=5,index=2,tts=1')
+    parser.add_argument('--latency', type=float, default=0.5, help="mean fake backend latency")
+    parser.add_argument('--latency-dist', default='lognormal',
+                        choices=['fixed', 'uniform', 'exponential', 'lognormal'])
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--run-size', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_size is not None:
+        result = run_size(args.run_size, args)
+        with open(args.result, 'w') as f:
+            json.dump(result, f)
+        return
+
+    # each size runs in its own process so the app and its index start fresh
+    env = dict(os.environ, USE_FAKE_CLIENTS='1', CLIENT_WARMUP_DELAY='0',
+               FAKE_LATENCY=str(args.latency), FAKE_LATENCY_DIST=args.latency_dist,
+               FAKE_ERROR_RATE=str(args.error_rate))
+    for size in args.sizes:
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+            result_path = f.name
+        try:
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--run-size', str(size),
+                            '--result', result_path] + sys.argv[1:], env=env, check=True,
+                           stdout=subprocess.DEVNULL)
+            with open(result_path) as f:
+                print_report(json.load(f))
+        finally:
+            os.remove(result_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,10 @@
-from datetime import datetime
+import time
+STARTUP_BEGAN = time.perf_counter()  # before the heavy imports, see STARTUP_SECONDS
 
-from flask import Flask, render_template, request, redirect, url_for, send_file, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, send_file, jsonify, Response, g
 from werkzeug.utils import secure_filename
 
+import math
 import os
 
 
@@ -10,104 +12,398 @@ import os
 from google.cloud import speech
 from google.cloud import texttospeech_v1
 
+import fakes
+from changes import ChangeLog
+from chunking import ChunkedRecognizer, shift_words, stitch
+from clients import ClientRegistry, ClientUnavailable
+from compaction import Compactor
+from ingest import MultipartUpload, UploadError
+from ids import new_id, newest
+from jobs import JobQueue, QueueFull
+from media import MediaServer
+from metrics import Metrics, RequestProfiler
+from preprocess import log_stats, preprocess
+from resilience import AIMDLimit, Backend, BackendUnavailable, deadline, reset_deadline, set_deadline
+from storage import STORAGE_BACKEND, TieredStore, open_archive, s3_client
+from streaming import StreamError, StreamManager
+from tts_cache import TTSCache, cache_key
+from word_store import WordStore
+
 app = Flask(__name__)
 
 # Configure upload folder
 STT_FOLDER = 'uploads/stt'
 TTS_FOLDER = 'uploads/tts'
 ALLOWED_EXTENSIONS = {'wav'}
+PAGE_SIZE = 20  # recordings rendered per page / infinite scroll batch
+MAX_PAGE_SIZE = 100
 app.config['STT_FOLDER'] = STT_FOLDER
 app.config['TTS_FOLDER'] = TTS_FOLDER
 
+# largest accepted recording, werkzeug rejects bigger request bodies with a 413
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 50 * 1024 * 1024))
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES + 64 * 1024  # room for multipart overhead
+# reject uploads that are not WAV or the browser recorder's WebM/Ogg, set VALIDATE_WAV_HEADER=0 to accept anything
+VALIDATE_WAV_HEADER = os.environ.get('VALIDATE_WAV_HEADER', '1') != '0'
+
 
 os.makedirs(STT_FOLDER, exist_ok=True)
 os.makedirs(TTS_FOLDER, exist_ok=True)
 
-stt_client=speech.SpeechClient()
-tts_client = texttospeech_v1.TextToSpeechClient()
-
-def recognize_speech(input_audio):
-  audio=speech.RecognitionAudio(content=input_audio)
-
-  config=speech.RecognitionConfig(
+# new and updated recordings, so pages fetch deltas instead of reloading
+changes = ChangeLog()
+
+# per-stage latency, error and in-flight metrics, scraped from /metrics
+metrics = Metrics(prefix='stt_app')
+# set PROFILE_SLOW_REQUESTS=<seconds> to keep cProfile dumps of requests slower than that
+PROFILE_SLOW_REQUESTS = float(os.environ.get('PROFILE_SLOW_REQUESTS', 0))
+PROFILE_FOLDER = 'uploads/profiles'
+profiler = RequestProfiler(PROFILE_FOLDER, PROFILE_SLOW_REQUESTS) if PROFILE_SLOW_REQUESTS else None
+
+# background recognition jobs
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_MAX_PENDING = int(os.environ.get('JOB_MAX_PENDING', 32))
+JOB_MAX_RETRIES = int(os.environ.get('JOB_MAX_RETRIES', 3))
+JOB_RETRY_BACKOFF = float(os.environ.get('JOB_RETRY_BACKOFF', 1.0))
+
+# cloud clients are created on first use and pre-warmed in the background after startup
+# set USE_FAKE_CLIENTS=1 to run offline against local fakes (see fakes.py)
+CLIENT_WARMUP_DELAY = float(os.environ.get('CLIENT_WARMUP_DELAY', 1.0))
+clients = ClientRegistry()
+if os.environ.get('USE_FAKE_CLIENTS'):
+    clients.register('speech', fakes.FakeSpeechClient)
+    clients.register('tts', fakes.FakeTextToSpeechClient)
+else:
+    clients.register('speech', speech.SpeechClient)
+    clients.register('tts', texttospeech_v1.TextToSpeechClient)
+stt_client = clients.lazy('speech')
+tts_client = clients.lazy('tts')
+
+# every speech and tts call goes through a Backend: an adaptive concurrency limit, a circuit breaker,
+# the request's or job's deadline and hedged retries, so a slow backend sheds load (see resilience.py)
+REQUEST_DEADLINE = float(os.environ.get('REQUEST_DEADLINE', 30))  # X-Request-Timeout can ask for less
+JOB_DEADLINE = float(os.environ.get('JOB_DEADLINE', 300))
+BACKEND_CONCURRENCY = int(os.environ.get('BACKEND_CONCURRENCY', 8))  # starting limit, it adapts from there
+speech_backend = Backend('speech', timeout=JOB_DEADLINE, limit=AIMDLimit(BACKEND_CONCURRENCY))
+tts_backend = Backend('tts', timeout=REQUEST_DEADLINE, limit=AIMDLimit(BACKEND_CONCURRENCY))
+backends = [speech_backend, tts_backend]
+
+# files are written to the folders above and moved to the archive once old, see storage.py
+# set STORAGE_BACKEND=s3 (S3_BUCKET, S3_ENDPOINT_URL) to archive to S3 or MinIO instead of a folder
+if STORAGE_BACKEND == 's3':
+    clients.register('s3', fakes.FakeS3Client if os.environ.get('USE_FAKE_CLIENTS') else s3_client)
+archive = open_archive(clients.lazy('s3'))
+STORAGE_CACHE_FOLDER = 'uploads/storage_cache'  # archived files fetched for reading
+STORAGE_CACHE_MAX_BYTES = int(os.environ.get('STORAGE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+stt_store = TieredStore(STT_FOLDER, archive, os.path.join(STORAGE_CACHE_FOLDER, 'stt'), STORAGE_CACHE_MAX_BYTES)
+tts_store = TieredStore(TTS_FOLDER, archive, os.path.join(STORAGE_CACHE_FOLDER, 'tts'), STORAGE_CACHE_MAX_BYTES)
+
+# per-recording word timings and confidences, served by /stt/<filename>/words
+word_store = WordStore(stt_store)
+
+# synthesized speech cache, keyed by text + voice settings
+TTS_CACHE_FOLDER = 'uploads/tts_cache'
+TTS_CACHE_MAX_BYTES = int(os.environ.get('TTS_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+TTS_CACHE_MEMORY_BYTES = int(os.environ.get('TTS_CACHE_MEMORY_BYTES', 16 * 1024 * 1024))
+tts_cache = TTSCache(TTS_CACHE_FOLDER, max_disk_bytes=TTS_CACHE_MAX_BYTES,
+                     max_memory_bytes=TTS_CACHE_MEMORY_BYTES)
+
+# audio/transcript serving with Range, ETags and long-lived caching (see media.py)
+# set MEDIA_TRANSCODE_FORMATS=opus,flac to also offer transcoded audio (needs ffmpeg)
+MEDIA_CACHE_FOLDER = 'uploads/media_cache'
+MEDIA_CACHE_MAX_BYTES = int(os.environ.get('MEDIA_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+MEDIA_TRANSCODE_FORMATS = [f.strip() for f in os.environ.get('MEDIA_TRANSCODE_FORMATS', '').split(',') if f.strip()]
+media = MediaServer(MEDIA_CACHE_FOLDER, MEDIA_TRANSCODE_FORMATS, max_cache_bytes=MEDIA_CACHE_MAX_BYTES)
+
+recognition_config=speech.RecognitionConfig(
   language_code="en-US",
   model="latest_long",
   audio_channel_count=1,
   enable_word_confidence=True,
   enable_word_time_offsets=True,
-  )
+)
+
+
+def recognize_chunk(input_audio):
+  # chunks are under a minute, so the synchronous API is fine and avoids operation polling
+  audio=speech.RecognitionAudio(content=input_audio)
+  # idempotent and short, so a straggler is hedged
+  return speech_backend.call(
+    lambda timeout: stt_client.recognize(config=recognition_config, audio=audio, timeout=timeout).results,
+    hedge=True)
+
+
+# recordings longer than CHUNK_MIN_SECONDS are split at silences and recognized in parallel
+CHUNK_MIN_SECONDS = float(os.environ.get('CHUNK_MIN_SECONDS', 60))
+CHUNK_MAX_SECONDS = float(os.environ.get('CHUNK_MAX_SECONDS', 50))
+# cuts are made at the quietest point in the last CHUNK_SEARCH_SECONDS of each chunk
+CHUNK_SEARCH_SECONDS = float(os.environ.get('CHUNK_SEARCH_SECONDS', 10))
+CHUNK_WORKERS = int(os.environ.get('CHUNK_WORKERS', 4))
+chunked_recognizer = ChunkedRecognizer(recognize_chunk, workers=CHUNK_WORKERS,
+                                       min_seconds=CHUNK_MIN_SECONDS,
+                                       max_chunk_seconds=CHUNK_MAX_SECONDS,
+                                       search_seconds=CHUNK_SEARCH_SECONDS)
+
+
+def recognize_speech(input_audio):
+  """Returns (transcript, words), words as [(word, start_seconds, end_seconds, confidence)]."""
+  with metrics.timer('recognize_chunked'):
+    chunked = chunked_recognizer.recognize(input_audio)
+  if chunked is not None:
+    return chunked
+
+  audio=speech.RecognitionAudio(content=input_audio)
+
+  def long_running(timeout):
+    operation=stt_client.long_running_recognize(config=recognition_config, audio=audio, timeout=timeout)
+
+    return operation.result(timeout=timeout)
+
+  with metrics.timer('recognize'):
+    response=speech_backend.call(long_running)
+
+  # the whole recording is one chunk starting at 0
+  return stitch([(0.0, response.results)])
+
+
+# audio clean-up before recognition, set PREPROCESS_AUDIO=0 to send uploads untouched
+PREPROCESS_AUDIO = os.environ.get('PREPROCESS_AUDIO', '1') != '0'
+PREPROCESS_LOG = 'uploads/preprocess_stats.jsonl'
+
+
+def prepare_audio(filename, audio_data):
+    """
+    Downmixes, resamples and trims the recording for recognition, logging what
+    it saved. Returns (audio, lead_in): lead_in is the seconds trimmed off the
+    front, to add back to word times so they match the stored recording.
+    """
+    if not PREPROCESS_AUDIO:
+        return audio_data, 0.0
+    with metrics.timer('preprocess'):
+        audio_data, stats = preprocess(audio_data)
+    if not stats:
+        return audio_data, 0.0
+    log_stats(PREPROCESS_LOG, filename, stats)
+    print(f"Preprocessed {filename}: saved {stats['bytes_saved']} bytes, {stats['seconds_saved']}s of audio")
+    return audio_data, stats['trim_start_seconds']
+
+
+def read_recording(filename):
+    """The bytes of a saved upload. Jobs carry only the name, so a full queue holds no audio."""
+    with metrics.timer('reread'), open(stt_store.path(filename), 'rb') as f:
+        return f.read()
+
+
+def process_recording(filename, audio_data=None):
+    """Runs recognition for a saved upload. Called from the job workers."""
+    if audio_data is None:
+        audio_data = read_recording(filename)
+
+    audio_data, lead_in = prepare_audio(filename, audio_data)
+    with deadline(JOB_DEADLINE):
+        text, words = recognize_speech(audio_data)
+    words = shift_words(words, lead_in)
+    return store_transcript(filename, text, words)
+
+
+def store_transcript(filename, text, words=None):
+    txt_filename = filename + '.txt'
+
+    try:
+        with metrics.timer('transcript_write'):
+            stt_store.write(txt_filename, text.encode('utf-8'))
+    except IOError as e:
+        print(f"Error saving transcript: {e}")
+
+    # live sessions have no word timings
+    if words is not None:
+        try:
+            with metrics.timer('words_write'):
+                word_store.write(filename, words)
+        except IOError as e:
+            print(f"Error saving word timings: {e}")
 
-  operation=stt_client.long_running_recognize(config=config, audio=audio)
+    changes.publish('stt', filename)
 
-  response=operation.result(timeout=90)
+    return {'transcript': txt_filename}
 
-  txt = ''
-  for result in response.results:
-    txt = txt + result.alternatives[0].transcript + '\n'
 
-  return txt
+job_queue = JobQueue(process_recording, workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING,
+                     max_retries=JOB_MAX_RETRIES, backoff=JOB_RETRY_BACKOFF)
+
+metrics.gauge_callback('jobs_pending', 'Recognition jobs waiting for a worker', job_queue.pending)
+metrics.gauge_callback('tts_cache', 'TTS cache counters', tts_cache.stats)
+for backend in backends:
+    metrics.gauge_callback(f'backend_{backend.name}', f'{backend.name} calls, concurrency limit and circuit',
+                           backend.stats)
+
+
+# live transcription: MediaRecorder chunks in, partial/final transcripts out over SSE
+MAX_STREAMS = int(os.environ.get('MAX_STREAMS', 4))
+
+streaming_config = speech.StreamingRecognitionConfig(
+    config=speech.RecognitionConfig(
+        encoding=speech.RecognitionConfig.AudioEncoding.WEBM_OPUS,
+        sample_rate_hertz=48000,
+        language_code="en-US",
+        model="latest_long",
+        audio_channel_count=1,
+    ),
+    interim_results=True,
+)
+
+
+def finish_stream(session):
+    """Saves the recording and transcript of a finished live session."""
+    filename = new_id() + '.wav'
+    stt_store.write(filename, session.audio())
+    result = store_transcript(filename, session.transcript())
+    return dict(result, filename=filename)
+
+
+stream_manager = StreamManager(stt_client, streaming_config,
+                               lambda chunk: speech.StreamingRecognizeRequest(audio_content=chunk),
+                               finish_stream, max_sessions=MAX_STREAMS, max_bytes=MAX_UPLOAD_BYTES)
 
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def get_stt_files():
-    files = []
-    for filename in os.listdir(STT_FOLDER):
-        if allowed_file(filename):
-            files.append(filename)
-    files.sort(reverse=True)
-    return files
+def list_files(folder, cursor=None, limit=None):
+    """Allowed files in folder newest first, starting after cursor when given."""
+    return newest(folder, allowed_file, cursor, limit)
+
+def get_stt_files(cursor=None, limit=None):
+    return list_files(STT_FOLDER, cursor, limit)
 
 
-def get_tts_files():
-    files = []
-    for filename in os.listdir(TTS_FOLDER):
-        if allowed_file(filename):
-            files.append(filename)
-    files.sort(reverse=True)
-    return files
+def get_tts_files(cursor=None, limit=None):
+    return list_files(TTS_FOLDER, cursor, limit)
+
+
+def paginate(files, limit):
+    """Splits a limit+1 sized fetch into (page, next_cursor)."""
+    if len(files) <= limit:
+        return files, None
+    page = files[:limit]
+    return page, page[-1]
 
 @app.route('/')
 def index():
-    stt_files = get_stt_files()
-    tts_files = get_tts_files()
-    return render_template('index.html', stt_files=stt_files, tts_files=tts_files)
+    since = changes.token()  # before listing, so nothing published meanwhile is missed
+    stt_files, stt_cursor = paginate(get_stt_files(limit=PAGE_SIZE + 1), PAGE_SIZE)
+    tts_files, tts_cursor = paginate(get_tts_files(limit=PAGE_SIZE + 1), PAGE_SIZE)
+    return render_template('index.html', stt_files=stt_files, tts_files=tts_files,
+                           stt_cursor=stt_cursor, tts_cursor=tts_cursor, since=since)
+
+@app.route('/api/recordings')
+def api_recordings():
+    if 'since' in request.args:
+        return recording_changes(request.args['since'])
+    kind = request.args.get('kind', 'stt')
+    cursor = request.args.get('cursor') or None
+    try:
+        limit = min(max(int(request.args.get('limit', PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+
+    if kind == 'stt':
+        files, next_cursor = paginate(get_stt_files(cursor, limit + 1), limit)
+    elif kind == 'tts':
+        files, next_cursor = paginate(get_tts_files(cursor, limit + 1), limit)
+    else:
+        return jsonify({'error': 'kind must be stt or tts'}), 400
+
+    return jsonify({'items': [{'filename': filename} for filename in files],
+                    'next_cursor': next_cursor})
+
+def recording_changes(since):
+    """The recordings published after the since token, or reset if the page has to reload."""
+    changed, token = changes.since(since)
+    if changed is None:
+        return jsonify({'reset': True, 'since': token})
+    items = []
+    for kind, filename in changed:
+        store = stt_store if kind == 'stt' else tts_store
+        item = {'kind': kind, 'filename': filename}
+        if not store.exists(filename):
+            item['removed'] = True
+        items.append(item)
+    return jsonify({'items': items, 'since': token})
 
 @app.route('/upload', methods=['POST'])
 def upload_audio():
-    if 'audio_data' not in request.files:
-        flash('No audio data')
-        return redirect(request.url)
-    file = request.files['audio_data']
-    if file.filename == '':
-        flash('No selected file')
-        return redirect(request.url)
-    if file:
-        filename = datetime.now().strftime("%Y%m%d-%I%M%S%p") + '.wav'
-        file_path = os.path.join(app.config['STT_FOLDER'], filename)
-        file.save(file_path)
-
-        f = open(file_path, 'rb')
-        audio_data = f.read()
-        f.close()
-
-        text = recognize_speech(audio_data)
-        txt_filename = filename + '.txt'
-        txt_filepath = os.path.join(app.config['STT_FOLDER'], txt_filename)
-
-        try:
-            with open(txt_filepath, 'w') as txt_file:
-                txt_file.write(text)
-        except IOError as e:
-            print(f"Error saving transcript: {e}")
-
-    return redirect('/') #success
+    filename = new_id() + '.wav'
+    file_path = stt_store.new_path(filename)
+    try:
+        # the body is parsed as it streams in, request.files would spool it first
+        with metrics.timer('save'), MultipartUpload(request.content_type, 'audio_data', file_path,
+                                                    MAX_UPLOAD_BYTES, validate=VALIDATE_WAV_HEADER) as upload:
+            upload.read_from(request.stream)
+            upload.finish()
+    except UploadError as e:
+        print(f"Rejecting upload: {e}")
+        return jsonify({'error': str(e)}), e.status
+
+    try:
+        job = job_queue.submit(filename)
+    except QueueFull as e:
+        print(f"Rejecting upload, job queue full: {e}")
+        stt_store.delete(filename)
+        return jsonify({'error': 'Server busy, try again later'}), 503, {'Retry-After': '5'}
+    changes.publish('stt', filename)
+
+    return jsonify({'job_id': job.id, 'filename': filename,
+                    'status_url': url_for('job_status', job_id=job.id)}), 202
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/stream', methods=['POST'])
+def stream_start():
+    try:
+        session = stream_manager.start()
+    except StreamError as e:
+        return jsonify({'error': str(e)}), e.status
+    return jsonify({'stream_id': session.id,
+                    'audio_url': url_for('stream_audio', stream_id=session.id),
+                    'end_url': url_for('stream_end', stream_id=session.id),
+                    'events_url': url_for('stream_events', stream_id=session.id)}), 201
+
+@app.route('/stream/<stream_id>/audio', methods=['POST'])
+def stream_audio(stream_id):
+    try:
+        stream_manager.get(stream_id).feed(request.get_data())
+    except StreamError as e:
+        return jsonify({'error': str(e)}), e.status
+    return '', 204
+
+@app.route('/stream/<stream_id>/end', methods=['POST'])
+def stream_end(stream_id):
+    try:
+        stream_manager.get(stream_id).close()
+    except StreamError as e:
+        return jsonify({'error': str(e)}), e.status
+    return '', 202
+
+@app.route('/stream/<stream_id>/events')
+def stream_events(stream_id):
+    try:
+        session = stream_manager.get(stream_id)
+    except StreamError as e:
+        return jsonify({'error': str(e)}), e.status
+    return Response(session.sse(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/upload/<filename>')
 def get_file(filename):
-    return send_file(filename)
+    # used to send_file() any path relative to the working directory
+    return media.send(stt_store, filename)
 
     
 @app.route('/upload_text', methods=['POST'])
@@ -118,9 +414,7 @@ def upload_text():
         return redirect('/')
 
     # generate filename
-    filename = datetime.now().strftime("%Y%m%d-%I%M%S%p") + '.wav'
-    audio_path = os.path.join(TTS_FOLDER, filename)
-    txt_path = os.path.join(TTS_FOLDER, f"{filename}.txt")
+    filename = new_id() + '.wav'
 
     # tts config
     synthesis_input = texttospeech_v1.SynthesisInput(text=text)
@@ -131,33 +425,168 @@ def upload_text():
         audio_encoding=texttospeech_v1.AudioEncoding.LINEAR16
     )
 
-    # call client to generate
-    response = tts_client.synthesize_speech(
-        input=synthesis_input,
-        voice=voice,
-        audio_config=audio_config
-    )
+    # call client to generate, unless the same text and voice were synthesized before
+    key = cache_key(text, voice.language_code, audio_config.audio_encoding, voice.name)
+    with metrics.timer('synthesize'):
+        audio_content = tts_cache.get_or_synthesize(key, lambda: tts_backend.call(
+            lambda timeout: tts_client.synthesize_speech(
+                input=synthesis_input,
+                voice=voice,
+                audio_config=audio_config,
+                timeout=timeout
+            ).audio_content, hedge=True))
 
     # save audio and text
-    with open(audio_path, 'wb') as audio_file:
-        audio_file.write(response.audio_content)
-    with open(txt_path, 'w') as txt_file:
-        txt_file.write(text)
-
+    with metrics.timer('tts_write'):
+        tts_store.write(filename, audio_content)
+        tts_store.write(f"{filename}.txt", text.encode('utf-8'))
+    changes.publish('tts', filename)
+
+    # the page posts with fetch and patches the list, a plain form post gets the page
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'filename': filename}), 201
     return redirect('/') #success
 
+@app.route('/tts_cache/stats')
+def tts_cache_stats():
+    return jsonify(tts_cache.stats())
+
+def request_deadline():
+    """REQUEST_DEADLINE, or less if the client sent X-Request-Timeout: <seconds>."""
+    try:
+        asked = float(request.headers.get('X-Request-Timeout', REQUEST_DEADLINE))
+    except ValueError:
+        asked = REQUEST_DEADLINE
+    return max(min(asked, REQUEST_DEADLINE), 0)
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    # backend calls made for this request give up when the client would have
+    g.deadline = set_deadline(request_deadline())
+    metrics.gauge_add('requests_in_flight', 1, 'HTTP requests being handled')
+    if profiler:
+        profiler.start()
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    if 'request_started' not in g:
+        return
+    reset_deadline(g.deadline)
+    endpoint = request.endpoint or 'unknown'
+    metrics.gauge_add('requests_in_flight', -1, 'HTTP requests being handled')
+    metrics.observe('request_seconds', time.perf_counter() - g.request_started,
+                    'HTTP request latency by endpoint', endpoint=endpoint)
+    if error is not None:
+        metrics.inc('request_errors_total', 1, 'HTTP requests that raised an exception', endpoint=endpoint)
+    if profiler:
+        profiler.stop(endpoint)
+
+@app.after_request
+def count_response(response):
+    metrics.inc('responses_total', 1, 'HTTP responses by endpoint and status',
+                endpoint=request.endpoint or 'unknown', status=response.status_code)
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/status')
+def status():
+    return jsonify({'startup_seconds': round(STARTUP_SECONDS, 3), 'clients': clients.status(),
+                    'backends': {backend.name: dict(backend.stats(), circuit=backend.breaker.state)
+                                 for backend in backends}})
+
+@app.errorhandler(ClientUnavailable)
+def client_unavailable(e):
+    return jsonify({'error': str(e)}), 503
+
+@app.errorhandler(BackendUnavailable)
+def backend_unavailable(e):
+    return jsonify({'error': str(e)}), e.status, {'Retry-After': str(e.retry_after)}
+
 @app.route('/script.js',methods=['GET'])
 def scripts_js():
     return send_file('./script.js')
 
 @app.route('/stt/<filename>')
 def stt_file(filename):
-    return send_from_directory(app.config['STT_FOLDER'], filename)
+    return media.send(stt_store, filename)
+
+@app.route('/stt/<filename>/words')
+def stt_words(filename):
+    """Words overlapping ?from=&to= (seconds, default the whole recording) with their timings."""
+    try:
+        start = float(request.args.get('from') or 0)
+        end = float(request.args['to']) if request.args.get('to') else None
+    except ValueError:
+        return jsonify({'error': 'from and to must be numbers of seconds'}), 400
+    if not math.isfinite(start) or (end is not None and not math.isfinite(end)):
+        return jsonify({'error': 'from and to must be finite numbers of seconds'}), 400
+    found = word_store.between(secure_filename(filename), start, end)
+    if found is None:
+        return jsonify({'error': 'No word timings for this recording'}), 404
+    words, duration = found
+    return jsonify({'words': words, 'duration': duration})
 
 @app.route('/tts/<filename>')
 def tts_file(filename):
-    return send_from_directory(app.config['TTS_FOLDER'], filename)
+    return media.send(tts_store, filename)
+
+@app.context_processor
+def media_sources():
+    return {'media_sources': media.sources()}
+
+
+# days older than COMPACT_AFTER_DAYS are moved to the archive, older than RETAIN_DAYS deleted (0 = never)
+COMPACT_AFTER_DAYS = int(os.environ.get('COMPACT_AFTER_DAYS', 30))
+RETAIN_DAYS = int(os.environ.get('RETAIN_DAYS', 0))
+COMPACT_INTERVAL = float(os.environ.get('COMPACT_INTERVAL', 3600))
+
+
+def expired(kind):
+    """Tells open pages that an expired recording is gone."""
+    def on_remove(name):
+        if allowed_file(name):
+            changes.publish(kind, name)
+    return on_remove
+
+
+compactors = [Compactor(stt_store, 'stt', COMPACT_AFTER_DAYS, RETAIN_DAYS, on_remove=expired('stt')),
+              Compactor(tts_store, 'tts', COMPACT_AFTER_DAYS, RETAIN_DAYS, on_remove=expired('tts'))]
+
+
+STARTUP_SECONDS = time.perf_counter() - STARTUP_BEGAN
+print(f"App loaded in {STARTUP_SECONDS * 1000:.0f} ms")
+
+
+_background_started = False
+
+
+def start_background():
+    """
+    Starts the job workers, client warm-up and the compactors. Only the server
+    entry points call this (serve(), asgi.py's lifespan, __main__): scripts
+    that import main must never run a second compactor on the same folder.
+    """
+    global _background_started
+    if _background_started:
+        return
+    _background_started = True
+    job_queue.start()
+    clients.warm_up(CLIENT_WARMUP_DELAY)
+    if COMPACT_AFTER_DAYS or RETAIN_DAYS:
+        for compactor in compactors:
+            compactor.start(COMPACT_INTERVAL)
+
+
+def serve():
+    """The app with its background threads running, for gunicorn 'main:serve()'."""
+    start_background()
+    return app
 
 
 if __name__ == '__main__':
+    start_background()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,159 @@
+"""
+Serving of recordings, synthesized audio and transcripts.
+
+Audio goes through werkzeug's send_file, which answers Range requests (206)
+and If-None-Match / If-Modified-Since (304) itself. MediaServer gives it a
+strong ETag built from the file's size and mtime, and because recordings and
+TTS output are written once under a timestamped name, a one-year immutable
+Cache-Control so browsers never revalidate them. Text (transcripts, metadata
+records) can be rewritten, so it is revalidated on every use, answered with a
+304 when unchanged and gzipped when the client accepts it.
+
+With ffmpeg on the PATH and formats enabled (e.g. MEDIA_TRANSCODE_FORMATS=opus,flac)
+audio can also be fetched as ?format=opus or ?format=flac. The transcoded file
+is cached under the source ETag, so each recording is transcoded once per
+version, and the cache is trimmed oldest first past max_cache_bytes.
+
+Files are looked up through a storage.TieredStore. A recording from an
+archived day comes back already transcoded (see compaction.py) and is sent
+in that format, under the same URL.
+"""
+import gzip
+import os
+import shutil
+import subprocess
+import threading
+
+from flask import Response, abort, request, send_file
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+GZIP_MIN_BYTES = 512  # smaller bodies don't shrink enough to be worth it
+AUDIO_EXTENSIONS = {'.wav'}
+TEXT_TYPES = {'.txt': 'text/plain', '.json': 'application/json'}
+
+# format -> (Content-Type, <source type> for the browser, ffmpeg arguments)
+FORMATS = {
+    'opus': ('audio/ogg', 'audio/ogg; codecs=opus', ['-c:a', 'libopus', '-b:a', '32k', '-f', 'ogg']),
+    'flac': ('audio/flac', 'audio/flac', ['-c:a', 'flac', '-f', 'flac']),
+}
+
+
+def file_etag(stat):
+    return f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+
+def send_text(body, mimetype, etag=None, last_modified=None):
+    """Sends text that may change: revalidated every time, gzipped when accepted."""
+    data = body.encode('utf-8') if isinstance(body, str) else body
+    compress = len(data) >= GZIP_MIN_BYTES and 'gzip' in request.accept_encodings
+    if etag is not None and compress:
+        etag += '-gz'  # a different representation needs a different strong validator
+
+    if etag is not None and request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        if compress:
+            data = gzip.compress(data, compresslevel=6)
+        response = Response(data, mimetype=mimetype)
+        if compress:
+            response.headers['Content-Encoding'] = 'gzip'
+    if etag is not None:
+        response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+class MediaServer:
+    def __init__(self, cache_folder, formats=(), max_cache_bytes=512 * 1024 * 1024, workers=2,
+                 timeout=120):
+        self.cache_folder = cache_folder
+        self.max_cache_bytes = max_cache_bytes
+        self.timeout = timeout
+        self.ffmpeg = shutil.which('ffmpeg') if formats else None
+        self.formats = [f for f in formats if f in FORMATS] if self.ffmpeg else []
+        if formats and not self.ffmpeg:
+            print("ffmpeg not found, audio transcoding disabled")
+        self._slots = threading.BoundedSemaphore(workers)  # concurrent ffmpeg processes
+        self._prune_lock = threading.Lock()
+        if self.formats:
+            os.makedirs(cache_folder, exist_ok=True)
+
+    def sources(self):
+        """[(format, <source> type)] the page can offer ahead of the original WAV."""
+        return [(f, FORMATS[f][1]) for f in self.formats]
+
+    def send(self, store, filename):
+        """Serves filename from store, picking audio or text handling from the extension."""
+        path = store.path(filename)
+        if path is None:
+            abort(404)
+        ext = os.path.splitext(filename)[1].lower()
+        if ext in AUDIO_EXTENSIONS:
+            return self.send_audio(path)
+        if ext in TEXT_TYPES:
+            return self.send_text_file(path, TEXT_TYPES[ext])
+        return send_file(os.path.abspath(path), etag=file_etag(os.stat(path)))
+
+    def send_audio(self, path):
+        stat = os.stat(path)
+        etag = file_etag(stat)
+        # archived recordings are stored as <name>.wav.<format>
+        stored = os.path.splitext(path)[1][1:]
+        mimetype = FORMATS[stored][0] if stored in FORMATS else None
+        fmt = request.args.get('format')
+        if fmt in self.formats and fmt != stored:
+            transcoded = self._transcode(path, etag, fmt)
+            if transcoded is not None:
+                path, etag, mimetype = transcoded, f"{etag}-{fmt}", FORMATS[fmt][0]
+        response = send_file(os.path.abspath(path), mimetype=mimetype, etag=etag,
+                             last_modified=stat.st_mtime, max_age=IMMUTABLE_MAX_AGE)
+        response.cache_control.immutable = True
+        return response
+
+    def send_text_file(self, path, mimetype):
+        stat = os.stat(path)
+        with open(path, 'rb') as f:
+            return send_text(f.read(), mimetype, file_etag(stat), stat.st_mtime)
+
+    def _transcode(self, path, etag, fmt):
+        """Path of the cached transcode (made now if missing), or None if ffmpeg failed."""
+        target = os.path.join(self.cache_folder, f"{os.path.basename(path)}.{etag}.{fmt}")
+        if os.path.exists(target):
+            return target
+        with self._slots:
+            if os.path.exists(target):  # another request made it while we waited
+                return target
+            tmp = f"{target}.{threading.get_ident()}.tmp"
+            try:
+                subprocess.run([self.ffmpeg, '-nostdin', '-loglevel', 'error', '-y', '-i', path]
+                               + FORMATS[fmt][2] + [tmp], check=True, timeout=self.timeout,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+                os.replace(tmp, target)
+            except (OSError, subprocess.SubprocessError) as e:
+                print(f"Transcoding {path} to {fmt} failed: {e}")
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                return None
+        self._prune(keep=target)
+        return target
+
+    def _prune(self, keep):
+        with self._prune_lock:
+            entries = []
+            for entry in os.scandir(self.cache_folder):
+                # never the file about to be sent, even if it alone is over the limit
+                if entry.is_file() and entry.path != keep and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for mtime, size, path in entries) + os.path.getsize(keep)
+            for mtime, size, path in sorted(entries):
+                if total <= self.max_cache_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
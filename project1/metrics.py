@@ -0,0 +1,155 @@
+"""
+Minimal Prometheus-style metrics: latency histograms, counters and gauges
+rendered in the text exposition format for a /metrics endpoint, plus a
+per-request cProfile hook that keeps profiles of slow requests.
+"""
+import cProfile
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# seconds, tuned for everything from a sidecar write to a long recognition
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _label_str(labels):
+    if not labels:
+        return ''
+    parts = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+class Metrics:
+    def __init__(self, prefix='app', buckets=DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._help = {}  # name -> (type, help)
+        self._counters = {}  # (name, labels) -> value
+        self._gauges = {}
+        self._histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+        self._callbacks = []  # (name, help, fn) for gauges computed at scrape time
+
+    def _key(self, name, kind, help_text, labels):
+        name = f"{self.prefix}_{name}"
+        self._help.setdefault(name, (kind, help_text))
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, amount=1, help_text='', **labels):
+        key = self._key(name, 'counter', help_text, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def gauge_add(self, name, amount, help_text='', **labels):
+        key = self._key(name, 'gauge', help_text, labels)
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + amount
+
+    def observe(self, name, value, help_text='', **labels):
+        key = self._key(name, 'histogram', help_text, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    hist[i] += 1
+            hist[-2] += value
+            hist[-1] += 1
+
+    def gauge_callback(self, name, help_text, fn):
+        """fn() returns a number, or a dict of {label value: number} for a 'key' label."""
+        self._callbacks.append((f"{self.prefix}_{name}", help_text, fn))
+
+    @contextmanager
+    def timer(self, stage):
+        """Times one pipeline stage: latency histogram, error counter and in-flight gauge."""
+        self.gauge_add('stage_in_flight', 1, 'Stages currently running', stage=stage)
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc('stage_errors_total', 1, 'Stages that raised an exception', stage=stage)
+            raise
+        finally:
+            self.observe('stage_seconds', time.perf_counter() - start, 'Time spent per pipeline stage',
+                         stage=stage)
+            self.gauge_add('stage_in_flight', -1, 'Stages currently running', stage=stage)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            families = {}
+            for (name, labels), value in self._counters.items():
+                families.setdefault(name, []).append(f"{name}{_label_str(labels)} {value}")
+            for (name, labels), value in self._gauges.items():
+                families.setdefault(name, []).append(f"{name}{_label_str(labels)} {value}")
+            for (name, labels), hist in self._histograms.items():
+                rows = families.setdefault(name, [])
+                for bound, count in zip(self.buckets, hist):
+                    rows.append(f"{name}_bucket{_label_str(labels + (('le', bound),))} {count}")
+                rows.append(f"{name}_bucket{_label_str(labels + (('le', '+Inf'),))} {hist[-1]}")
+                rows.append(f"{name}_sum{_label_str(labels)} {hist[-2]}")
+                rows.append(f"{name}_count{_label_str(labels)} {hist[-1]}")
+            for name in sorted(families):
+                kind, help_text = self._help[name]
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(families[name])
+
+        for name, help_text, fn in self._callbacks:
+            try:
+                value = fn()
+            except Exception as e:
+                print(f"Metric callback {name} failed: {e}")
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            if isinstance(value, dict):
+                for key, item in value.items():
+                    lines.append(f"{name}{_label_str((('key', key),))} {item}")
+            else:
+                lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+class RequestProfiler:
+    """
+    Profiles each request with cProfile and keeps the stats of requests that
+    take longer than threshold seconds, as .prof files readable with pstats
+    or snakeviz.
+    """
+
+    def __init__(self, folder, threshold=1.0):
+        self.folder = folder
+        self.threshold = threshold
+        self._local = threading.local()
+        os.makedirs(folder, exist_ok=True)
+
+    def start(self):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+ allows one active profiler per process, skip overlapping requests
+            self._local.profiler = None
+            return
+        self._local.profiler = profiler
+        self._local.started = time.perf_counter()
+
+    def stop(self, name):
+        profiler = getattr(self._local, 'profiler', None)
+        if profiler is None:
+            return
+        profiler.disable()
+        self._local.profiler = None
+        elapsed = time.perf_counter() - self._local.started
+        if elapsed >= self.threshold:
+            safe_name = ''.join(c if c.isalnum() else '_' for c in name)
+            path = os.path.join(self.folder, f"{time.strftime('%Y%m%d-%H%M%S')}_{safe_name}_{elapsed:.2f}s.prof")
+            profiler.dump_stats(path)
+            print(f"Slow request {name} took {elapsed:.2f}s, profile saved to {path}")
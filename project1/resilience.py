@@ -0,0 +1,399 @@
+"""
+Adaptive concurrency limits, circuit breakers, deadlines and hedged retries
+for the cloud calls, so a slow or failing backend sheds load instead of
+holding every request thread.
+
+Each backend (speech, tts, ...) gets a Backend and every call goes through
+backend.call(lambda timeout: client.method(..., timeout=timeout)):
+
+  - deadline: a request or job sets one with `with deadline(seconds):`. Calls
+    under it get the time left as their timeout and fail with
+    DeadlineExceeded once it has passed, calls outside one get the backend's
+    own timeout. The deadline is a context variable, so it follows the
+    request into the backend's threads (and chunking's, see chunking.py).
+  - circuit breaker: when at least failure_ratio of the last window_calls
+    calls failed (counting those within window seconds, and only once there
+    are min_calls of them), the backend opens and calls fail at once with
+    BackendUnavailable for open_seconds. Then a single probe is let through,
+    and its result closes or re-opens the circuit.
+  - AIMD limit: at most `limit` attempts are in flight. Each success faster
+    than latency_target raises it by 1/limit (about +1 per round trip) while
+    at least half of it is in use, a failure, timeout or slower call
+    multiplies it by backoff_ratio (at most once per cooldown). A call over the limit waits up to max_wait, never
+    past its deadline, and is then shed with BackendUnavailable.
+  - hedging: if an attempt hasn't answered by the p95 latency of recent
+    calls, a second one is sent when the limit has room and whichever
+    answers first wins. Only for idempotent calls (hedge=True).
+  - retries: an attempt that fails is retried after retry_backoff seconds,
+    up to max_retries times, while the deadline and the circuit allow.
+  - abandoned attempts: at the deadline the caller stops waiting and the
+    attempt's slot is given back as a failure, but its thread runs until the
+    client returns (callers should pass the timeout on so it does). At most
+    max_abandoned of those may be running before new calls are shed, so a
+    backend that ignores timeouts can't pile up threads.
+
+BackendUnavailable carries an HTTP status (503, 504 for DeadlineExceeded)
+and a retry_after, so routes can pass them on as they are. stress_resilience.py
+runs a Backend through a brownout of the fault-injecting fakes.
+"""
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from contextlib import contextmanager
+
+_deadline = contextvars.ContextVar('deadline', default=None)
+
+
+class BackendUnavailable(Exception):
+    status = 503
+
+    def __init__(self, message, retry_after=5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(BackendUnavailable):
+    status = 504
+
+
+def set_deadline(seconds):
+    """
+    Starts a deadline seconds from now (or keeps an enclosing one that is
+    sooner) and returns the token reset_deadline() ends it with, for code that
+    can't use `with deadline():`, like Flask's before/teardown_request.
+    """
+    at = time.monotonic() + seconds
+    outer = _deadline.get()
+    return _deadline.set(at if outer is None else min(at, outer))
+
+
+def reset_deadline(token):
+    _deadline.reset(token)
+
+
+@contextmanager
+def deadline(seconds):
+    """Calls inside must finish within seconds, or by an enclosing deadline if that is sooner."""
+    token = set_deadline(seconds)
+    try:
+        yield
+    finally:
+        reset_deadline(token)
+
+
+def remaining(default=None):
+    """Seconds left before the current deadline, default if there is none."""
+    at = _deadline.get()
+    return default if at is None else at - time.monotonic()
+
+
+class CircuitBreaker:
+    def __init__(self, failure_ratio=0.5, min_calls=10, window_calls=20, window=10.0, open_seconds=10.0):
+        self.failure_ratio = failure_ratio
+        self.min_calls = min_calls
+        self.window = window
+        self.open_seconds = open_seconds
+        self.state = 'closed'
+        self.opened_at = 0.0
+        # the most recent calls only, so a busy past can't outvote a failing present
+        self._outcomes = deque(maxlen=window_calls)  # (time, ok)
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True if a call may go ahead, claiming the probe when half-open."""
+        with self._lock:
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.open_seconds:
+                self.state = 'half_open'
+            if self.state == 'half_open':
+                if self._probing:
+                    return False
+                self._probing = True
+                return True
+            return self.state == 'closed'
+
+    def cancel(self):
+        """Gives back a probe claimed by allow() for a call that never reached the backend."""
+        with self._lock:
+            self._probing = False
+
+    def retry_after(self):
+        return max(1, round(self.open_seconds - (time.monotonic() - self.opened_at)))
+
+    def record(self, ok):
+        now = time.monotonic()
+        with self._lock:
+            if self.state == 'half_open':
+                self._probing = False
+                self._outcomes.clear()
+                self.state = 'closed' if ok else 'open'
+                self.opened_at = now
+                return
+            if self.state == 'open':
+                return  # attempts started before it opened
+            self._outcomes.append((now, ok))
+            while self._outcomes and now - self._outcomes[0][0] > self.window:
+                self._outcomes.popleft()
+            failures = sum(1 for at, outcome_ok in self._outcomes if not outcome_ok)
+            if len(self._outcomes) >= self.min_calls and failures >= self.failure_ratio * len(self._outcomes):
+                self.state = 'open'
+                self.opened_at = now
+
+
+class AIMDLimit:
+    def __init__(self, initial=8, min_limit=1, max_limit=64, backoff_ratio=0.5, latency_target=None,
+                 cooldown=1.0):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+        self.latency_target = latency_target  # None: only failures count as congestion
+        self.cooldown = cooldown
+        self.inflight = 0
+        self._decreased_at = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout):
+        """Takes a slot, waiting up to timeout seconds for one. False if none came free."""
+        end = time.monotonic() + max(timeout, 0)
+        with self._cond:
+            while self.inflight >= int(self.limit):
+                left = end - time.monotonic()
+                if left <= 0:
+                    return False
+                self._cond.wait(left)
+            self.inflight += 1
+            return True
+
+    def cancel(self):
+        """Gives back a slot taken by acquire() for an attempt that never started, as neither outcome."""
+        with self._cond:
+            self.inflight -= 1
+            self._cond.notify()
+
+    def release(self, ok, latency):
+        with self._cond:
+            self.inflight -= 1
+            if ok and (self.latency_target is None or latency <= self.latency_target):
+                # a limit that isn't being used proves nothing, so it only grows while it is
+                if (self.inflight + 1) * 2 >= self.limit:
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            elif time.monotonic() - self._decreased_at >= self.cooldown:
+                self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+                self._decreased_at = time.monotonic()
+            self._cond.notify()
+
+
+class _Attempt(Future):
+    def __init__(self):
+        super().__init__()
+        self.started = time.monotonic()
+        self.settled = False  # its slot released and outcome recorded
+        self.abandoned = False  # given up on at the deadline while still running
+        self.returned = False  # its thread is done
+
+
+class Backend:
+    def __init__(self, name, timeout=60.0, max_wait=1.0, max_retries=1, retry_backoff=0.2,
+                 hedge_min=0.05, limit=None, breaker=None, max_abandoned=16):
+        self.name = name
+        self.timeout = timeout  # for calls outside any deadline
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.hedge_min = hedge_min
+        self.limit = limit or AIMDLimit()
+        self.breaker = breaker or CircuitBreaker()
+        self.max_abandoned = max_abandoned
+        self.abandoned = 0  # attempts past their deadline whose thread hasn't returned
+        self._latencies = deque(maxlen=200)  # of successful attempts, for the hedge delay
+        self._lock = threading.Lock()
+        self.counters = {'calls': 0, 'failures': 0, 'shed': 0, 'rejected_open': 0, 'deadline_exceeded': 0,
+                         'retries': 0, 'hedges': 0, 'hedge_wins': 0}
+
+    def _count(self, key):
+        with self._lock:
+            self.counters[key] += 1
+
+    def hedge_delay(self):
+        """p95 of recent successful attempts, None until there are enough of them."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < 20:
+            return None
+        return max(self.hedge_min, latencies[int(len(latencies) * 0.95)])
+
+    def _settle(self, attempt, ok):
+        """Releases an attempt's slot and records its outcome, once."""
+        with self._lock:
+            if attempt.settled:
+                return
+            attempt.settled = True
+        latency = time.monotonic() - attempt.started
+        self.limit.release(ok, latency)
+        self.breaker.record(ok)
+        if ok:
+            with self._lock:
+                self._latencies.append(latency)
+
+    def _abandon(self, attempt):
+        """Gives back the slot of an attempt still running at the deadline, counting it until it returns."""
+        self._settle(attempt, False)
+        with self._lock:
+            if not attempt.returned:
+                attempt.abandoned = True
+                self.abandoned += 1
+
+    def _attempt(self, attempt, fn, at):
+        try:
+            result = fn(max(at - attempt.started, 0.001))
+        except BaseException as e:
+            self._settle(attempt, False)
+            attempt.set_exception(e)
+        else:
+            self._settle(attempt, True)
+            attempt.set_result(result)
+        finally:
+            with self._lock:
+                attempt.returned = True
+                if attempt.abandoned:
+                    self.abandoned -= 1
+
+    def _start(self, fn, at, wait_for_slot=True):
+        """Starts an attempt, or returns None if the limit had no room in time or the deadline has passed."""
+        if self.abandoned >= self.max_abandoned or time.monotonic() >= at:
+            return None
+        if not self.limit.acquire(min(self.max_wait, at - time.monotonic()) if wait_for_slot else 0):
+            return None
+        if time.monotonic() >= at:
+            self.limit.cancel()  # the deadline passed while waiting for the slot
+            return None
+        attempt = _Attempt()
+        # a thread per attempt rather than a pool: one abandoned at its deadline keeps its thread
+        # until the client returns, but never holds up the attempts after it (see _abandon).
+        # The caller's context goes along, so nested calls see the same deadline.
+        threading.Thread(target=contextvars.copy_context().run, args=(self._attempt, attempt, fn, at),
+                         name=f'{self.name}-call', daemon=True).start()
+        return attempt
+
+    def _shed_reason(self):
+        if self.abandoned >= self.max_abandoned:
+            return f"{self.name} has {self.abandoned} calls still running past their deadline"
+        return f"{self.name} is at its concurrency limit ({int(self.limit.limit)})"
+
+    def _check_deadline(self, at):
+        if time.monotonic() >= at:
+            self._count('deadline_exceeded')
+            raise DeadlineExceeded(f"{self.name} call exceeded its deadline")
+
+    def _check_open(self):
+        if not self.breaker.allow():
+            self._count('rejected_open')
+            raise BackendUnavailable(f"{self.name} is failing, circuit open", self.breaker.retry_after())
+
+    def call(self, fn, hedge=False):
+        """
+        fn(timeout) with the deadline, breaker, limit, retries and (if hedge)
+        hedging above. Raises fn's last error, or BackendUnavailable.
+        """
+        self._count('calls')
+        at = time.monotonic() + remaining(self.timeout)
+        self._check_deadline(at)  # no attempt thread for a call that is already too late
+        self._check_open()
+        first = self._start(fn, at)
+        if first is None:
+            self.breaker.cancel()
+            self._check_deadline(at)
+            self._count('shed')
+            raise BackendUnavailable(self._shed_reason(), 1)
+
+        pending, retries, error = {first}, 0, None
+        delay = self.hedge_delay() if hedge else None
+        hedge_at = time.monotonic() + delay if delay is not None else None
+        while True:
+            wake = at if hedge_at is None else min(at, hedge_at)
+            done, pending = wait(pending, timeout=max(wake - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is not first:
+                        self._count('hedge_wins')
+                    return future.result()
+                error = future.exception()
+            now = time.monotonic()
+            if now >= at:
+                # the slots of attempts still running are given back now, as failures,
+                # or a backend that never answers would hold the limit forever
+                for attempt in pending:
+                    self._abandon(attempt)
+                self._count('deadline_exceeded')
+                raise DeadlineExceeded(f"{self.name} call exceeded its deadline")
+            if hedge_at is not None and now >= hedge_at:
+                hedge_at = None
+                extra = self._start(fn, at, wait_for_slot=False)
+                if extra is not None:
+                    self._count('hedges')
+                    pending.add(extra)
+            if not pending:
+                if retries >= self.max_retries or isinstance(error, BackendUnavailable):
+                    self._count('failures')
+                    raise error
+                retries += 1
+                self._count('retries')
+                time.sleep(min(self.retry_backoff * retries, max(at - time.monotonic(), 0)))
+                self._check_deadline(at)
+                self._check_open()
+                first = self._start(fn, at)
+                if first is None:
+                    self.breaker.cancel()  # _check_open may have let this retry through as the probe
+                    self._count('failures')
+                    raise error
+                pending = {first}
+
+    async def call_async(self, fn):
+        """
+        await fn(timeout) for the asyncio mode: the deadline, breaker and limit
+        as in call(), without hedging or retries (the job runner retries). The
+        limit's lock is never held across an await, so a slot is waited for by
+        polling.
+        """
+        self._count('calls')
+        at = time.monotonic() + remaining(self.timeout)
+        self._check_deadline(at)
+        self._check_open()
+        give_up = min(time.monotonic() + self.max_wait, at)
+        while not self.limit.acquire(0):
+            if time.monotonic() >= give_up:
+                self.breaker.cancel()
+                self._check_deadline(at)
+                self._count('shed')
+                raise BackendUnavailable(f"{self.name} is at its concurrency limit ({int(self.limit.limit)})", 1)
+            await asyncio.sleep(0.05)
+        if time.monotonic() >= at:
+            self.limit.cancel()
+            self.breaker.cancel()
+            self._check_deadline(at)
+        attempt = _Attempt()  # only for its bookkeeping, wait_for cancels the coroutine at the deadline
+        timeout = max(at - attempt.started, 0.001)
+        try:
+            result = await asyncio.wait_for(fn(timeout), timeout)
+        except asyncio.TimeoutError:
+            self._settle(attempt, False)
+            self._count('deadline_exceeded')
+            raise DeadlineExceeded(f"{self.name} call exceeded its deadline") from None
+        except BaseException:
+            self._settle(attempt, False)
+            self._count('failures')
+            raise
+        self._settle(attempt, True)
+        return result
+
+    def stats(self):
+        """Counters and current state as numbers, for /metrics."""
+        with self._lock:
+            stats = dict(self.counters)
+        stats.update(limit=round(self.limit.limit, 2), inflight=self.limit.inflight, abandoned=self.abandoned,
+                     circuit_open=int(self.breaker.state != 'closed'), hedge_delay=self.hedge_delay() or 0)
+        return stats
@@ -0,0 +1,73 @@
+"""
+Wall-clock comparison of single-request vs chunked parallel recognition,
+run offline against the fake speech client.
+
+    python bench_chunking.py [--minutes 1 5 10] [--workers 4] [--rtf 0.1]
+
+--rtf is the fake recognizer's processing time per second of audio.
+"""
+import argparse
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+import fakes
+from chunking import ChunkedRecognizer
+from preprocess import encode_wav
+
+RATE = 16000
+
+
+def synthetic_recording(minutes, seed=0):
+    """Bursts of tone ('speech') separated by short silences."""
+    rng = np.random.default_rng(seed)
+    pieces = []
+    total = 0
+    while total < minutes * 60 * RATE:
+        speech = int(rng.uniform(2, 8) * RATE)
+        t = np.arange(speech) / RATE
+        pieces.append(0.3 * np.sin(2 * np.pi * rng.uniform(150, 300) * t).astype(np.float32))
+        pause = int(rng.uniform(0.3, 1.5) * RATE)
+        pieces.append(np.zeros(pause, dtype=np.float32))
+        total += speech + pause
+    return encode_wav(np.concatenate(pieces), RATE)
+
+
+def single_call(client, wav):
+    response = client.long_running_recognize(audio=SimpleNamespace(content=wav)).result(timeout=None)
+    return ''.join(result.alternatives[0].transcript + '\n' for result in response.results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--minutes', type=float, nargs='+', default=[1, 5, 10])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--rtf', type=float, default=0.1)
+    parser.add_argument('--latency', type=float, default=0.2, help="fixed fake latency per request")
+    args = parser.parse_args()
+
+    fakes.FAKE_LATENCY = args.latency
+    fakes.FAKE_SECONDS_PER_AUDIO_SECOND = args.rtf
+    client = fakes.FakeSpeechClient()
+    recognizer = ChunkedRecognizer(lambda wav: client.recognize(audio=SimpleNamespace(content=wav)).results,
+                                   workers=args.workers, min_seconds=0)
+
+    print(f"{'audio':>8} {'chunks':>7} {'single':>9} {'chunked':>9} {'speedup':>8}")
+    for minutes in args.minutes:
+        wav = synthetic_recording(minutes)
+
+        start = time.perf_counter()
+        single_call(client, wav)
+        single = time.perf_counter() - start
+
+        chunks = len(recognizer.split(wav))
+        start = time.perf_counter()
+        recognizer.recognize(wav)
+        chunked = time.perf_counter() - start
+
+        print(f"{minutes:>7.1f}m {chunks:>7} {single:>8.2f}s {chunked:>8.2f}s {single / chunked:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Latency of transcript search (RecordingIndex.search) against a synthetic
+index, built in a scratch database.
+
+    python bench_search.py [--transcripts 100000] [--repeat 50]
+
+Transcripts are random sentences from a small call-centre vocabulary with a
+Zipf-like word frequency. Even the rarest query word is in thousands of
+transcripts, a worst case for ranking compared to real speech. Reports
+build time and p50/p99 milliseconds per query, with and without sentiment
+filters.
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from recordings_index import RecordingIndex
+from storage import TieredStore
+
+WORDS = ("the a to and i you it is that my was for on with this have order account refund "
+         "delivery late charge card help please thanks call again problem billing cancel "
+         "subscription password reset manager waiting broken replacement warranty invoice "
+         "shipping address update email number support agent great terrible happy angry").split()
+QUERIES = ['refund', 'the', 'late delivery', 'cancel subscription', 'warr*', 'password reset manager',
+           'nonexistentword']
+FILTERS = [{}, {'label': 'Negative'}, {'min_score': 0.5}, {'label': 'Positive', 'min_score': 0.2, 'max_score': 0.8}]
+
+
+def transcript(rng):
+    sentences = []
+    for _ in range(rng.randint(1, 4)):
+        length = rng.randint(6, 20)
+        sentences.append(' '.join(WORDS[min(int(rng.paretovariate(1.2)) - 1, len(WORDS) - 1)]
+                                  if rng.random() < 0.6 else rng.choice(WORDS) for _ in range(length)))
+    return '. '.join(sentences) + '.'
+
+
+def build(index, count, rng):
+    start = time.perf_counter()
+    for i in range(count):
+        score = round(rng.uniform(-1, 1), 2)
+        label = "Positive" if score > 0.1 else "Negative" if score < -0.1 else "Neutral"
+        # one transaction per recording, as store_transcript writes them
+        index.set_sentiment(f"{i:08d}.wav", score, label, transcript(rng))
+    return time.perf_counter() - start
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--transcripts', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='bench-search-')
+    try:
+        index = RecordingIndex(os.path.join(scratch, 'recordings.db'), TieredStore(scratch))
+        rng = random.Random(args.seed)
+        seconds = build(index, args.transcripts, rng)
+        size = os.path.getsize(index.path) / 1024 / 1024
+        print(f"indexed {args.transcripts} transcripts in {seconds:.1f}s "
+              f"({seconds / args.transcripts * 1000:.2f} ms each), {size:.0f} MB")
+
+        print(f"{'query':<24} {'filter':<44} {'hits':>5} {'p50 ms':>8} {'p99 ms':>8}")
+        for q in QUERIES:
+            for filters in FILTERS:
+                timings = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    results = index.search(q, limit=20, **filters)
+                    timings.append((time.perf_counter() - start) * 1000)
+                print(f"{q:<24} {str(filters):<44} {len(results):>5} "
+                      f"{percentile(timings, 50):>8.2f} {percentile(timings, 99):>8.2f}")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Recent changes to the recording lists, so an open page can fetch just the
+recordings added or updated since it was rendered instead of reloading.
+
+Every upload, finished transcript and synthesized file is published as
+(kind, filename) with a sequence number. The page gets a token ("<epoch>.<seq>")
+when it renders and passes it back as /api/recordings?since=<token>, which
+answers with the recordings changed after it and a new token.
+
+The log lives in memory and keeps the last max_changes entries. A token from
+before a restart (another epoch) or older than the log can't be answered, so
+since() says so and the page reloads once. With several server processes
+each would keep its own log, the app runs one worker (see Procfile).
+"""
+import threading
+import uuid
+from collections import deque
+
+
+class ChangeLog:
+    def __init__(self, max_changes=1000):
+        self.epoch = uuid.uuid4().hex[:8]
+        self._changes = deque(maxlen=max_changes)
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def publish(self, kind, filename):
+        with self._lock:
+            self._seq += 1
+            self._changes.append((self._seq, kind, filename))
+
+    def token(self):
+        with self._lock:
+            return f"{self.epoch}.{self._seq}"
+
+    def since(self, token):
+        """
+        ([(kind, filename)] changed after token, each once in the order of its
+        latest change, new token), or (None, new token) if the log can't say.
+        """
+        with self._lock:
+            current = f"{self.epoch}.{self._seq}"
+            epoch, _, seq = token.partition('.')
+            if epoch != self.epoch or not seq.isdigit() or int(seq) > self._seq:
+                return None, current
+            seq = int(seq)
+            oldest = self._changes[0][0] if self._changes else self._seq + 1
+            if seq < oldest - 1:
+                return None, current  # changes after it were already dropped
+            changed = {}
+            for change_seq, kind, filename in self._changes:
+                if change_seq > seq:
+                    changed.pop((kind, filename), None)
+                    changed[(kind, filename)] = True
+            return list(changed), current
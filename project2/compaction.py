@@ -0,0 +1,147 @@
+"""
+Background compaction and retention of a TieredStore (see storage.py).
+
+Whole days are the unit, by the UTC date in their names:
+
+    hot       <folder>/<YYYYMMDD>/<HHMM>/*     as written, for compact_after_days
+    archived  <kind>/<YYYYMMDD>/<name>.opus    each recording transcoded with ffmpeg,
+              <kind>/<YYYYMMDD>/<id>.seg       every other file of the day packed
+                                               into one segment, until retain_days
+    expired   deleted from both tiers, on_remove is called for every name
+
+0 turns either step off. Without ffmpeg audio is archived as it is. Names
+outside the shard layout (uploads from before it, bulk imports) are never
+compacted or expired.
+
+A day is archived object by object, then its catalogue is written, and only
+then are the hot files removed, so a crash part-way leaves the hot copy in
+use and the next pass archives the day again.
+"""
+import os
+import shutil
+import subprocess
+import threading
+import time
+from datetime import datetime, timezone
+
+from ids import new_id
+from media import AUDIO_EXTENSIONS, FORMATS
+
+
+class Compactor:
+    def __init__(self, store, kind, compact_after_days=30, retain_days=0, audio_format='opus',
+                 on_remove=None, timeout=300):
+        self.store = store
+        self.kind = kind  # key prefix in the archive, e.g. 'stt'
+        self.compact_after_days = compact_after_days
+        self.retain_days = retain_days
+        self.on_remove = on_remove
+        self.timeout = timeout
+        self.ffmpeg = shutil.which('ffmpeg') if audio_format in FORMATS else None
+        self.audio_format = audio_format if self.ffmpeg else None
+        if audio_format and not self.ffmpeg:
+            print("ffmpeg not found, recordings are archived uncompressed")
+
+    def days(self):
+        return sorted(entry.name for entry in os.scandir(self.store.folder)
+                      if entry.is_dir() and len(entry.name) == 8 and entry.name.isdigit())
+
+    def run(self, now=None):
+        """One pass over the folder, returns {'compacted': [days], 'expired': [days]}."""
+        today = datetime.fromtimestamp(time.time() if now is None else now, timezone.utc).date()
+        done = {'compacted': [], 'expired': []}
+        for day in self.days():
+            try:
+                age = (today - datetime.strptime(day, '%Y%m%d').date()).days
+            except ValueError:
+                continue
+            if self.retain_days and age > self.retain_days:
+                self.expire(day)
+                done['expired'].append(day)
+            elif self.compact_after_days and age > self.compact_after_days and self.store.archive is not None:
+                if self.compact(day):
+                    done['compacted'].append(day)
+        return done
+
+    def _hot_files(self, day):
+        """[(name, path)] of the day's files still in the hot tier."""
+        files = []
+        for minute in os.scandir(os.path.join(self.store.folder, day)):
+            if minute.is_dir():
+                files.extend((entry.name, entry.path) for entry in os.scandir(minute.path)
+                             if entry.is_file() and not entry.name.endswith('.tmp'))
+        return sorted(files)
+
+    def compact(self, day):
+        """Moves the day's hot files to the archive, returns False if there were none."""
+        hot = self._hot_files(day)
+        if not hot:
+            return False
+        files = dict(self.store.catalog(day))
+        segment_key = f"{self.kind}/{day}/{new_id()}.seg"
+        segment = bytearray()
+        for name, path in hot:
+            mtime_ns = os.stat(path).st_mtime_ns
+            if os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS:
+                data, fmt = self._encode(path)
+                key = f"{self.kind}/{day}/{name}" + (f".{fmt}" if fmt else '')
+                self.store.archive.put(key, data)
+                files[name] = {'key': key, 'offset': 0, 'length': len(data), 'mtime_ns': mtime_ns, 'format': fmt}
+            else:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                files[name] = {'key': segment_key, 'offset': len(segment), 'length': len(data),
+                               'mtime_ns': mtime_ns, 'format': None}
+                segment += data
+        if segment:
+            self.store.archive.put(segment_key, bytes(segment))
+        self.store.write_catalog(day, files)
+
+        for name, path in hot:
+            os.remove(path)
+        for minute in os.scandir(os.path.join(self.store.folder, day)):
+            if minute.is_dir() and not os.listdir(minute.path):
+                os.rmdir(minute.path)
+        return True
+
+    def _encode(self, path):
+        """(bytes, format) of a recording for the archive, the WAV itself if it can't be transcoded."""
+        if self.audio_format:
+            try:
+                result = subprocess.run([self.ffmpeg, '-nostdin', '-loglevel', 'error', '-i', path]
+                                        + FORMATS[self.audio_format][2] + ['pipe:1'], check=True,
+                                        timeout=self.timeout, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                return result.stdout, self.audio_format
+            except (OSError, subprocess.SubprocessError) as e:
+                print(f"Transcoding {path} for the archive failed, keeping the WAV: {e}")
+        with open(path, 'rb') as f:
+            return f.read(), None
+
+    def expire(self, day):
+        """Deletes the day from both tiers."""
+        archived = self.store.catalog(day)
+        names = set(archived) | {name for name, path in self._hot_files(day)}
+        if self.store.archive is not None:
+            for key in sorted({entry['key'] for entry in archived.values()}):
+                self.store.archive.delete(key)
+        shutil.rmtree(os.path.join(self.store.folder, day), ignore_errors=True)
+        if self.on_remove:
+            for name in sorted(names):
+                self.on_remove(name)
+
+    def start(self, interval=3600, delay=60):
+        """Runs a pass every interval seconds on a background thread, the first after delay."""
+        def loop():
+            time.sleep(delay)
+            while True:
+                try:
+                    done = self.run()
+                    if done['compacted'] or done['expired']:
+                        print(f"Storage {self.kind}: archived days {done['compacted']}, "
+                              f"expired days {done['expired']}")
+                except Exception as e:
+                    print(f"Compaction of {self.store.folder} failed: {e}")
+                time.sleep(interval)
+        thread = threading.Thread(target=loop, name=f'compaction-{self.kind}', daemon=True)
+        thread.start()
+        return thread
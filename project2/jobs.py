@@ -0,0 +1,206 @@
+import asyncio
+import heapq
+import itertools
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class QueueFull(Exception):
+    """Raised when the job queue is at its backpressure limit."""
+
+
+class Job:
+    def __init__(self, filename, payload=None):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.payload = payload  # optional data for the handler (uploads pass only the filename), dropped once the job finishes
+        self.status = 'queued'  # queued -> running -> done | failed (retrying in between)
+        self.attempts = 0
+        self.error = None
+        self.result = None
+        self.created = time.time()
+        self.updated = self.created
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'status': self.status,
+            'attempts': self.attempts,
+            'error': self.error,
+            'result': self.result,
+            'created': self.created,
+            'updated': self.updated,
+        }
+
+
+class JobQueue:
+    """
+    Bounded background worker pool for recognition jobs.
+
+    submit() never blocks: when max_pending jobs are already waiting it raises
+    QueueFull so the request can be rejected with a 503 instead of piling up.
+    Failed jobs are retried with exponential backoff up to max_retries times.
+    Retries wait in a heap drained by one thread, which requeues them without
+    blocking; a retry that finds the queue full fails instead of bypassing the
+    limit. Nothing runs until start(), so importing the app starts no threads.
+    """
+
+    def __init__(self, handler, workers=2, max_pending=32, max_retries=3,
+                 backoff=1.0, max_history=1000):
+        self.handler = handler
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_history = max_history
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._retries = []  # heap of (due, sequence, job)
+        self._retry_sequence = itertools.count()  # ties on due never compare jobs
+        self._retry_cond = threading.Condition()
+        self._threads = []
+
+    def start(self):
+        """Starts the workers and the retry thread, once."""
+        if self._threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        t = threading.Thread(target=self._requeue, name="job-retry", daemon=True)
+        t.start()
+        self._threads.append(t)
+
+    def submit(self, filename, payload=None):
+        job = Job(filename, payload)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            raise QueueFull(f"{self._queue.maxsize} jobs already pending")
+        self._track(job)
+        return job
+
+    def track(self, filename, payload=None):
+        """Records a job that runs elsewhere (see AsyncJobRunner) so get() reports it."""
+        return self._track(Job(filename, payload))
+
+    def _track(self, job):
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _prune(self):
+        # drop the oldest finished jobs once the history is full
+        if len(self._jobs) <= self.max_history:
+            return
+        for job_id, job in list(self._jobs.items()):
+            if len(self._jobs) <= self.max_history:
+                break
+            if job.status in ('done', 'failed'):
+                del self._jobs[job_id]
+
+    def update(self, job, status, **fields):
+        with self._lock:
+            job.status = status
+            for key, value in fields.items():
+                setattr(job, key, value)
+            job.updated = time.time()
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            self.update(job, 'running', attempts=job.attempts + 1)
+            try:
+                result = self.handler(job.filename, job.payload)
+            except Exception as e:
+                print(f"Job {job.id} attempt {job.attempts} failed: {e}")
+                if job.attempts <= self.max_retries:
+                    # no sooner than a busy backend asked for (resilience.BackendUnavailable)
+                    delay = max(self.backoff * (2 ** (job.attempts - 1)), getattr(e, 'retry_after', 0))
+                    self.update(job, 'retrying', error=str(e))
+                    # the retry thread requeues it, so the worker is free during the backoff
+                    with self._retry_cond:
+                        heapq.heappush(self._retries, (time.monotonic() + delay, next(self._retry_sequence), job))
+                        self._retry_cond.notify()
+                else:
+                    self.update(job, 'failed', error=str(e), payload=None)
+            else:
+                self.update(job, 'done', result=result, error=None, payload=None)
+            finally:
+                self._queue.task_done()
+
+
+    def _requeue(self):
+        while True:
+            with self._retry_cond:
+                while not self._retries or self._retries[0][0] > time.monotonic():
+                    self._retry_cond.wait(self._retries[0][0] - time.monotonic() if self._retries else None)
+                due, sequence, job = heapq.heappop(self._retries)
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                print(f"Job {job.id} not retried, {self._queue.maxsize} jobs already pending")
+                self.update(job, 'failed', error=f"{job.error} (not retried, queue full)", payload=None)
+
+
+class AsyncJobRunner:
+    """
+    Runs jobs as asyncio tasks on the running event loop instead of worker
+    threads (the ASGI mode), so a job waiting on the network costs a coroutine
+    rather than a thread. Jobs are recorded in a JobQueue's history, so
+    /jobs/<id> reports them as usual. At most max_inflight jobs run (or wait for
+    a retry) at once and submit() raises QueueFull beyond that. handler is a
+    coroutine function taking (filename, payload).
+    """
+
+    def __init__(self, jobs, handler, max_inflight=1000, max_retries=3, backoff=1.0):
+        self.jobs = jobs
+        self.handler = handler
+        self.max_inflight = max_inflight
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.inflight = 0  # only touched from the event loop thread
+        self._tasks = set()  # strong references, the loop only keeps weak ones
+
+    def submit(self, filename, payload=None):
+        if self.inflight >= self.max_inflight:
+            raise QueueFull(f"{self.max_inflight} jobs already in flight")
+        job = self.jobs.track(filename, payload)
+        self.inflight += 1
+        task = asyncio.get_running_loop().create_task(self._run(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def _run(self, job):
+        try:
+            while True:
+                self.jobs.update(job, 'running', attempts=job.attempts + 1)
+                try:
+                    result = await self.handler(job.filename, job.payload)
+                except Exception as e:
+                    print(f"Job {job.id} attempt {job.attempts} failed: {e}")
+                    if job.attempts <= self.max_retries:
+                        self.jobs.update(job, 'retrying', error=str(e))
+                        await asyncio.sleep(max(self.backoff * (2 ** (job.attempts - 1)),
+                                                getattr(e, 'retry_after', 0)))
+                        continue
+                    self.jobs.update(job, 'failed', error=str(e), payload=None)
+                else:
+                    self.jobs.update(job, 'done', result=result, error=None, payload=None)
+                return
+        finally:
+            self.inflight -= 1
@@ -0,0 +1,172 @@
+"""
+Audio clean-up before recognition: decode the WAV, downmix to mono, resample
+to 16 kHz and trim leading/trailing silence with a simple frame-energy VAD.
+Everything is vectorized with NumPy. Audio that can't be decoded (not PCM or
+float WAV) is passed through unchanged.
+"""
+import json
+import struct
+import threading
+
+import numpy as np
+
+TARGET_RATE = 16000
+FRAME_SECONDS = 0.02
+SILENCE_BELOW_PEAK_DB = 35.0  # frames this far below the loudest frame count as silence
+SILENCE_FLOOR_DB = -60.0  # and anything below this level always does
+PAD_SECONDS = 0.2  # keep a little audio around the detected speech
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+_log_lock = threading.Lock()
+
+
+class WavDecodeError(Exception):
+    pass
+
+
+def decode_wav(data):
+    """Returns (samples as float32 array of shape (frames, channels), sample_rate)."""
+    if len(data) < 12 or data[0:4] != b'RIFF' or data[8:12] != b'WAVE':
+        raise WavDecodeError("not a RIFF/WAVE file")
+    fmt = None
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id = data[offset:offset + 4]
+        chunk_len = struct.unpack('<I', data[offset + 4:offset + 8])[0]
+        body = offset + 8
+        if chunk_id == b'fmt ':
+            fmt = struct.unpack('<HHIIHH', data[body:body + 16])
+            if fmt[0] == WAVE_FORMAT_EXTENSIBLE and chunk_len >= 40:
+                # the real format is the first two bytes of the sub-format GUID
+                sub_format = struct.unpack('<H', data[body + 24:body + 26])[0]
+                fmt = (sub_format,) + fmt[1:]
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise WavDecodeError("data chunk before fmt chunk")
+            # browsers sometimes write 0 or 0xFFFFFFFF while streaming, use what's there
+            frames = data[body:min(body + chunk_len, len(data))]
+            return _decode_samples(frames, fmt), fmt[2]
+        offset = body + chunk_len + (chunk_len & 1)
+    raise WavDecodeError("no data chunk")
+
+
+def _decode_samples(frames, fmt):
+    audio_format, channels, sample_rate, _, block_align, bits = fmt
+    if channels == 0 or sample_rate == 0 or block_align == 0:
+        raise WavDecodeError("invalid fmt chunk")
+    frames = frames[:len(frames) - len(frames) % block_align]
+    if audio_format == WAVE_FORMAT_PCM and bits == 8:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif audio_format == WAVE_FORMAT_PCM and bits == 16:
+        samples = np.frombuffer(frames, dtype='<i2').astype(np.float32) / 32768.0
+    elif audio_format == WAVE_FORMAT_PCM and bits == 24:
+        raw = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+        ints = np.where(ints & 0x800000, ints - 0x1000000, ints)
+        samples = ints.astype(np.float32) / 8388608.0
+    elif audio_format == WAVE_FORMAT_PCM and bits == 32:
+        samples = np.frombuffer(frames, dtype='<i4').astype(np.float32) / 2147483648.0
+    elif audio_format == WAVE_FORMAT_IEEE_FLOAT and bits == 32:
+        samples = np.frombuffer(frames, dtype='<f4').astype(np.float32)
+    else:
+        raise WavDecodeError(f"unsupported format {audio_format} with {bits} bits")
+    return samples.reshape(-1, channels)
+
+
+def encode_wav(samples, sample_rate):
+    """16-bit mono PCM WAV bytes for a float array in [-1, 1]."""
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767.0).astype('<i2').tobytes()
+    header = struct.pack('<4sI4s4sIHHIIHH4sI',
+                         b'RIFF', 36 + len(pcm), b'WAVE',
+                         b'fmt ', 16, WAVE_FORMAT_PCM, 1, sample_rate, sample_rate * 2, 2, 16,
+                         b'data', len(pcm))
+    return header + pcm
+
+
+def downmix(samples):
+    return samples.mean(axis=1) if samples.shape[1] > 1 else samples[:, 0]
+
+
+def resample(mono, rate, target=TARGET_RATE):
+    """Downsamples to target with a windowed-sinc low-pass and linear interpolation."""
+    if rate <= target or len(mono) == 0:
+        return mono, rate
+    cutoff = 0.5 * target / rate  # new Nyquist as a fraction of the old sample rate
+    taps = np.arange(-32, 33)
+    kernel = 2 * cutoff * np.sinc(2 * cutoff * taps) * np.hamming(len(taps))
+    filtered = np.convolve(mono, kernel / kernel.sum(), mode='same')
+    duration = len(mono) / rate
+    new_times = np.arange(int(duration * target)) / target
+    old_times = np.arange(len(mono)) / rate
+    return np.interp(new_times, old_times, filtered).astype(np.float32), target
+
+
+def trim_silence(mono, rate):
+    """
+    Cuts leading and trailing frames whose energy is below the VAD threshold.
+    Returns (trimmed, start), start being the first kept sample of mono.
+    """
+    frame = max(int(rate * FRAME_SECONDS), 1)
+    count = len(mono) // frame
+    if count == 0:
+        return mono, 0
+    frames = mono[:count * frame].reshape(count, frame)
+    rms = np.sqrt(np.mean(frames.astype(np.float64) ** 2, axis=1))
+    level_db = 20 * np.log10(np.maximum(rms, 1e-10))
+    threshold = max(level_db.max() - SILENCE_BELOW_PEAK_DB, SILENCE_FLOOR_DB)
+    voiced = np.flatnonzero(level_db > threshold)
+    if len(voiced) == 0:
+        return mono, 0  # nothing above the threshold, leave it to the recognizer
+    pad = int(PAD_SECONDS * rate)
+    start = max(voiced[0] * frame - pad, 0)
+    end = min((voiced[-1] + 1) * frame + pad, len(mono))
+    return mono[start:end], int(start)
+
+
+def preprocess(data):
+    """
+    Returns (audio_bytes, stats). stats is None when the audio was passed
+    through untouched because it could not be decoded or would not shrink.
+    Otherwise the processed audio starts trim_start_seconds into the original
+    (trim_start_sample at processed_rate), which times measured on it, like
+    recognized word offsets, need adding back.
+    """
+    try:
+        samples, rate = decode_wav(data)
+    except (WavDecodeError, struct.error, ValueError) as e:
+        print(f"Skipping audio preprocessing: {e}")
+        return data, None
+
+    original_seconds = len(samples) / rate
+    mono, new_rate = resample(downmix(samples), rate)
+    mono, trim_start = trim_silence(mono, new_rate)
+    processed = encode_wav(mono, new_rate)
+    if len(processed) >= len(data):
+        return data, None
+
+    processed_seconds = len(mono) / new_rate
+    stats = {
+        'original_bytes': len(data),
+        'processed_bytes': len(processed),
+        'bytes_saved': len(data) - len(processed),
+        'original_seconds': round(original_seconds, 3),
+        'processed_seconds': round(processed_seconds, 3),
+        'seconds_saved': round(original_seconds - processed_seconds, 3),
+        'original_rate': rate,
+        'original_channels': samples.shape[1],
+        'processed_rate': new_rate,
+        'trim_start_sample': trim_start,
+        'trim_start_seconds': trim_start / new_rate,
+    }
+    return processed, stats
+
+
+def log_stats(path, filename, stats):
+    """Appends one JSON line with the savings for filename."""
+    line = json.dumps(dict(stats, filename=filename))
+    with _log_lock:
+        with open(path, 'a') as f:
+            f.write(line + '\n')
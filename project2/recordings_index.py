@@ -0,0 +1,299 @@
+"""
+SQLite index of processed recordings so the listing page doesn't have to
+scan the uploads folder and read every recording's metadata.
+
+Transcripts are also kept in an FTS5 full-text index (porter stemming, so
+"refund" finds "refunds" and "refunded"), updated with each recording's
+sentiment. search() ranks matches with bm25 and joins the sentiment columns,
+so filtering by label and score range happens in the same query.
+
+Hourly and daily sentiment rollups are kept in the same database and updated
+in the same transactions, see sentiment_stats.py.
+
+Rebuild from the files on disk (and the archive, see storage.py) with:
+    python recordings_index.py rebuild [uploads/stt] [uploads/recordings.db]
+"""
+import html
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+import sentiment_stats
+from ids import time_of, walk
+from recording_meta import load_fields, load_record
+from storage import TieredStore, open_archive
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    filename TEXT PRIMARY KEY,
+    sentiment_score REAL,
+    sentiment_label TEXT,
+    created INTEGER  -- unix seconds, what the sentiment rollups bucket by
+) WITHOUT ROWID;
+
+-- external content table: the text lives in transcripts, the triggers keep
+-- transcripts_fts in step and snippet() reads the text back from transcripts
+CREATE TABLE IF NOT EXISTS transcripts (
+    id INTEGER PRIMARY KEY,
+    filename TEXT NOT NULL UNIQUE,
+    transcript TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS transcripts_fts USING fts5(
+    transcript, content='transcripts', content_rowid='id', tokenize='porter unicode61', prefix='2 3 4'
+);
+CREATE TRIGGER IF NOT EXISTS transcripts_ai AFTER INSERT ON transcripts BEGIN
+    INSERT INTO transcripts_fts (rowid, transcript) VALUES (new.id, new.transcript);
+END;
+CREATE TRIGGER IF NOT EXISTS transcripts_ad AFTER DELETE ON transcripts BEGIN
+    INSERT INTO transcripts_fts (transcripts_fts, rowid, transcript) VALUES ('delete', old.id, old.transcript);
+END;
+CREATE TRIGGER IF NOT EXISTS transcripts_au AFTER UPDATE ON transcripts BEGIN
+    INSERT INTO transcripts_fts (transcripts_fts, rowid, transcript) VALUES ('delete', old.id, old.transcript);
+    INSERT INTO transcripts_fts (rowid, transcript) VALUES (new.id, new.transcript);
+END;
+"""
+
+# snippet() marks matches with these, they are swapped for <mark> after escaping the text
+_MARK_START, _MARK_END = '\ue000', '\ue001'
+SNIPPET_TOKENS = 16
+
+
+def match_query(q):
+    """
+    Turns what a user typed into an FTS5 query: every word must match, as a
+    prefix if it ends in *. Quoting each word means FTS5 operators and stray
+    punctuation are searched for as text instead of failing to parse.
+    """
+    terms = []
+    for word in q.split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*')
+        if re.search(r'\w', word):
+            terms.append('"' + word.replace('"', '""') + '"' + ('*' if prefix else ''))
+    return ' '.join(terms)
+
+
+def highlight(snippet):
+    """HTML-escapes a snippet and wraps the matched words in <mark>."""
+    return html.escape(snippet).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+
+
+class RecordingIndex:
+    def __init__(self, path, store, search_candidates=1000):
+        self.path = path
+        self.store = store  # a storage.TieredStore, rebuild() reads the records through it
+        self.search_candidates = search_candidates
+        self.created = not os.path.exists(self.path)
+        self._local = threading.local()
+        conn = self._conn()
+        # an index from before transcript search needs the same backfill as a new one
+        if not self.created and conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'transcripts'").fetchone() is None:
+            self.created = True
+        # rollups can be worked out from the recordings table alone, no need to go back to the files
+        backfill_rollups = not self.created and conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'sentiment_rollups'").fetchone() is None
+        add_created = not self.created and 'created' not in [
+            row[1] for row in conn.execute("PRAGMA table_info(recordings)")]
+        conn.executescript(SCHEMA + sentiment_stats.SCHEMA)
+        if add_created:
+            # only names without an ID need their record or file looked at
+            conn.execute("ALTER TABLE recordings ADD COLUMN created INTEGER")
+            with conn:
+                conn.executemany("UPDATE recordings SET created = ? WHERE filename = ?", [
+                    (self.created_time(filename), filename)
+                    for filename, in conn.execute("SELECT filename FROM recordings").fetchall()])
+        if backfill_rollups or add_created:
+            with conn:
+                sentiment_stats.rebuild(conn, conn.execute(
+                    "SELECT created, sentiment_score, sentiment_label FROM recordings").fetchall())
+
+    def _conn(self):
+        # sqlite connections can't be shared between threads, keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def created_time(self, filename, record=None):
+        """
+        Unix seconds a recording was made: the minute of its ID, else its
+        record's created time, else its file's mtime. Uploads from before
+        ids.py and bulk imports that kept their name have no ID.
+        """
+        at = time_of(filename)
+        if at is not None:
+            return at
+        if record is None:
+            record = load_fields(self.store, filename) or {}
+        if record.get('created') is not None:
+            return int(record['created'])
+        path = self.store.path(filename)
+        try:
+            return int(os.path.getmtime(path)) if path is not None else int(time.time())
+        except OSError:
+            return int(time.time())
+
+    def _replace(self, conn, filename, sentiment_score, sentiment_label):
+        # looked at before the transaction, it may read the record; an existing row keeps its time
+        created = self.created_time(filename)
+        # the old row is read and replaced in one write transaction, so the rollups can't drift
+        conn.execute("BEGIN IMMEDIATE")
+        old = conn.execute("SELECT created, sentiment_score, sentiment_label FROM recordings WHERE filename = ?",
+                           (filename,)).fetchone()
+        if old is not None and old['created'] is not None:
+            created = old['created']
+        conn.execute(
+            "INSERT OR REPLACE INTO recordings (filename, sentiment_score, sentiment_label, created) "
+            "VALUES (?, ?, ?, ?)",
+            (filename, sentiment_score, sentiment_label, created))
+        sentiment_stats.apply(conn, old and tuple(old), (created, sentiment_score, sentiment_label))
+
+    def add(self, filename, sentiment_score=None, sentiment_label=None):
+        with self._conn() as conn:
+            self._replace(conn, filename, sentiment_score, sentiment_label)
+
+    def set_sentiment(self, filename, sentiment_score, sentiment_label, transcript=None):
+        """Stores a processed recording's sentiment and, if given, indexes its transcript."""
+        if sentiment_score is not None:
+            sentiment_score = round(float(sentiment_score), ndigits=2)
+        with self._conn() as conn:
+            self._replace(conn, filename, sentiment_score, sentiment_label)
+            if transcript is not None:
+                # an upsert, not INSERT OR REPLACE: REPLACE deletes without firing the delete trigger
+                conn.execute(
+                    "INSERT INTO transcripts (filename, transcript) VALUES (?, ?) "
+                    "ON CONFLICT (filename) DO UPDATE SET transcript = excluded.transcript",
+                    (filename, transcript))
+
+    def remove(self, filename):
+        with self._conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            old = conn.execute("SELECT created, sentiment_score, sentiment_label FROM recordings "
+                               "WHERE filename = ?", (filename,)).fetchone()
+            conn.execute("DELETE FROM recordings WHERE filename = ?", (filename,))
+            sentiment_stats.apply(conn, old and tuple(old), None)
+            conn.execute("DELETE FROM transcripts WHERE filename = ?", (filename,))
+
+    def get(self, filename):
+        """One recording's listing row, or None if it isn't indexed."""
+        row = self._conn().execute(
+            "SELECT filename, sentiment_score, sentiment_label FROM recordings WHERE filename = ?",
+            (filename,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def list(self, cursor=None, limit=None):
+        """
+        Recordings newest first. Keyset pagination: pass the last filename of the
+        previous page as cursor to get the ones after it.
+        """
+        query = "SELECT filename, sentiment_score, sentiment_label FROM recordings"
+        params = []
+        if cursor:
+            query += " WHERE filename < ?"
+            params.append(cursor)
+        query += " ORDER BY filename DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        rows = self._conn().execute(query, params)
+        return [dict(row) for row in rows]
+
+    def search(self, q, label=None, min_score=None, max_score=None, limit=20, offset=0):
+        """
+        Recordings whose transcript matches q, best match first, each with a
+        highlighted 'snippet' (HTML). label, min_score and max_score filter on
+        the sentiment columns. Empty if q has nothing to search for.
+
+        bm25 costs a few microseconds per match, so for a word found in most
+        of 100k transcripts ranking every match would take over 100 ms. Only
+        the newest search_candidates matches (after filtering) are ranked,
+        which FTS5 reads in rowid order and stops early; queries with fewer
+        matches than that are ranked exactly.
+        """
+        match = match_query(q)
+        if not match:
+            return []
+        candidates = "SELECT transcripts_fts.rowid AS id, bm25(transcripts_fts) AS rank FROM transcripts_fts"
+        conditions, params = ["transcripts_fts MATCH ?"], [match]
+        if label:
+            conditions.append("r.sentiment_label = ?")
+            params.append(label)
+        if min_score is not None:
+            conditions.append("r.sentiment_score >= ?")
+            params.append(min_score)
+        if max_score is not None:
+            conditions.append("r.sentiment_score <= ?")
+            params.append(max_score)
+        if len(conditions) > 1:
+            candidates += (" JOIN transcripts t ON t.id = transcripts_fts.rowid"
+                           " JOIN recordings r ON r.filename = t.filename")
+        candidates += " WHERE " + " AND ".join(conditions) + " ORDER BY transcripts_fts.rowid DESC LIMIT ?"
+        params.append(self.search_candidates)
+
+        conn = self._conn()
+        rows = conn.execute(
+            f"SELECT t.id, r.filename, r.sentiment_score, r.sentiment_label FROM ({candidates}) AS m "
+            "JOIN transcripts t ON t.id = m.id JOIN recordings r ON r.filename = t.filename "
+            "ORDER BY m.rank LIMIT ? OFFSET ?",
+            params + [limit, offset]).fetchall()
+        if not rows:
+            return []
+
+        # snippets only for the page, they tokenize the whole transcript again
+        ids = [row['id'] for row in rows]
+        snippets = dict(conn.execute(
+            "SELECT rowid, snippet(transcripts_fts, 0, ?, ?, '…', ?) FROM transcripts_fts "
+            f"WHERE transcripts_fts MATCH ? AND rowid IN ({', '.join('?' * len(ids))})",
+            [_MARK_START, _MARK_END, SNIPPET_TOKENS, match] + ids).fetchall())
+        results = []
+        for row in rows:
+            result = dict(row)
+            result['snippet'] = highlight(snippets.get(result.pop('id'), ''))
+            results.append(result)
+        return results
+
+    def sentiment_rollup(self, start, end, bucket='day'):
+        """Rolled-up sentiment from start to end (unix seconds), see sentiment_stats.stats."""
+        return sentiment_stats.stats(self._conn(), start, end, bucket)
+
+    def rebuild(self, allowed_file):
+        """Replaces the index contents with what is currently in the store."""
+        rows, transcripts = [], []
+        # sorted so transcript rowids follow upload order, as they do when added one by one
+        for filename in sorted(walk(self.store.folder)):
+            if allowed_file(filename):
+                record = load_record(self.store, filename) or {}
+                score = record.get('sentiment_score')
+                if score is not None:
+                    score = round(float(score), ndigits=2)
+                rows.append((filename, score, record.get('sentiment_label'), self.created_time(filename, record)))
+                if record.get('transcript') is not None:
+                    transcripts.append((filename, record['transcript']))
+        with self._conn() as conn:
+            conn.execute("DELETE FROM recordings")
+            conn.execute("DELETE FROM transcripts")
+            conn.executemany(
+                "INSERT INTO recordings (filename, sentiment_score, sentiment_label, created) VALUES (?, ?, ?, ?)",
+                rows)
+            conn.executemany("INSERT INTO transcripts (filename, transcript) VALUES (?, ?)", transcripts)
+            sentiment_stats.rebuild(conn, [(created, score, label) for filename, score, label, created in rows])
+        return len(rows)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'rebuild':
+        print("usage: python recordings_index.py rebuild [folder] [index_path]")
+        sys.exit(1)
+    folder = sys.argv[2] if len(sys.argv) > 2 else 'uploads/stt'
+    path = sys.argv[3] if len(sys.argv) > 3 else 'uploads/recordings.db'
+    index = RecordingIndex(path, TieredStore(folder, open_archive(), 'uploads/storage_cache/stt'))
+    count = index.rebuild(lambda name: name.lower().endswith('.wav'))
+    print(f"Indexed {count} recordings in {index.path}")
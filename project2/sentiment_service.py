@@ -0,0 +1,94 @@
+"""
+Coalescing front end for the sentiment RPC.
+
+The Natural Language API has no batch RPC, so calls are not batched on the
+wire: each distinct transcript is still one analyze_sentiment call, run on a
+small worker pool. What is saved is repeats. Identical transcripts already in
+flight share that call's result, and results are memoized by content hash so
+repeats never reach the API again.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class SentimentService:
+    def __init__(self, analyze, workers=4, cache_size=4096, timeout=60):
+        self.analyze = analyze
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sentiment')
+        self._lock = threading.Lock()
+        self._inflight = {}  # key -> Future
+        self._memo = OrderedDict()  # key -> score
+        self.counters = {
+            'requests': 0,
+            'cache_hits': 0,
+            'coalesced': 0,
+            'rpcs': 0,
+            'rpc_errors': 0,
+            'queue_wait_seconds_sum': 0.0,
+            'queue_wait_seconds_max': 0.0,
+        }
+
+    def score(self, text):
+        """Sentiment score for text, blocking until it is available."""
+        return self.submit(text).result(timeout=self.timeout)
+
+    def submit(self, text):
+        """
+        Returns a concurrent.futures.Future for the score of text without
+        blocking, e.g. for asyncio.wrap_future() in the ASGI mode.
+        """
+        key = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        with self._lock:
+            self.counters['requests'] += 1
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                self.counters['cache_hits'] += 1
+                future = Future()
+                future.set_result(self._memo[key])
+                return future
+            future = self._inflight.get(key)
+            if future is not None:
+                self.counters['coalesced'] += 1
+                return future
+            future = self._inflight[key] = Future()
+        self._executor.submit(self._run, key, text, time.monotonic())
+        return future
+
+    def _run(self, key, text, submitted_at):
+        wait = time.monotonic() - submitted_at
+        try:
+            score = self.analyze(text)
+        except Exception as e:
+            with self._lock:
+                self._count(wait)
+                self.counters['rpc_errors'] += 1
+                future = self._inflight.pop(key)
+            future.set_exception(e)
+            return
+        with self._lock:
+            self._count(wait)
+            self._memo[key] = score
+            while len(self._memo) > self.cache_size:
+                self._memo.popitem(last=False)
+            future = self._inflight.pop(key)
+        future.set_result(score)
+
+    def _count(self, wait):
+        # under self._lock, wait is how long the call queued for a worker
+        self.counters['rpcs'] += 1
+        self.counters['queue_wait_seconds_sum'] += wait
+        self.counters['queue_wait_seconds_max'] = max(self.counters['queue_wait_seconds_max'], wait)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['inflight'] = len(self._inflight)
+            stats['memo_entries'] = len(self._memo)
+        rpcs = stats['rpcs']
+        stats['queue_wait_seconds_avg'] = stats['queue_wait_seconds_sum'] / rpcs if rpcs else 0.0
+        return stats
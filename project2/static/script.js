@@ -4,10 +4,13 @@ const audioElement = document.getElementById('audio');
 const uploadForm = document.getElementById('uploadForm');
 const audioDataInput = document.getElementById('audioData');
 const timerDisplay = document.getElementById('timer');
+const liveModeInput = document.getElementById('liveMode');
+const liveTranscript = document.getElementById('liveTranscript');
 
 let mediaRecorder;
 let audioChunks = [];
 let startTime;
+let timerInterval;
 
 function formatTime(time) {
   const minutes = Math.floor(time / 60);
@@ -15,18 +18,92 @@ function formatTime(time) {
   return `${minutes}:${seconds.toString().padStart(2, '0')}`;
 }
 
+// poll a background recognition job until it finishes, then patch the list
+function waitForJob(statusUrl) {
+  timerDisplay.textContent = 'processing...';
+  fetch(statusUrl)
+    .then(response => response.json())
+    .then(job => {
+      if (job.status === 'done' || job.status === 'failed') {
+        if (job.status === 'failed') {
+          console.error('Processing failed:', job.error);
+        }
+        timerDisplay.textContent = formatTime(0);
+        applyChanges();
+      } else {
+        setTimeout(() => waitForJob(statusUrl), 1000);
+      }
+    })
+    .catch(error => {
+      console.error('Error checking job status:', error);
+    });
+}
+
+// live mode: send recorder chunks as they arrive, show transcripts from the SSE stream
+function startLiveTranscription(recorder) {
+  let finalText = '';
+  let sending = Promise.resolve();
+  liveTranscript.textContent = '';
+
+  return fetch('/stream', { method: 'POST' })
+    .then(response => {
+      if (!response.ok) {
+        throw new Error('Could not start live transcription');
+      }
+      return response.json();
+    })
+    .then(live => {
+      const events = new EventSource(live.events_url);
+      events.addEventListener('partial', e => {
+        liveTranscript.textContent = finalText + JSON.parse(e.data).transcript;
+      });
+      events.addEventListener('final', e => {
+        finalText += JSON.parse(e.data).transcript + '\n';
+        liveTranscript.textContent = finalText;
+      });
+      events.addEventListener('done', () => {
+        events.close();
+        applyChanges();
+      });
+      events.addEventListener('error', e => {
+        if (e.data) {
+          console.error('Live transcription failed:', JSON.parse(e.data).error);
+        }
+        events.close();
+      });
+
+      // chain the POSTs so chunks reach the server in recording order
+      recorder.ondataavailable = e => {
+        sending = sending.then(() => fetch(live.audio_url, { method: 'POST', body: e.data }));
+      };
+      recorder.onstop = () => {
+        sending.then(() => fetch(live.end_url, { method: 'POST' }));
+      };
+      recorder.start(250);
+    });
+}
+
 recordButton.addEventListener('click', () => {
   navigator.mediaDevices.getUserMedia({ audio: true })
     .then(stream => {
       mediaRecorder = new MediaRecorder(stream);
-      mediaRecorder.start();
 
+      audioChunks = [];
       startTime = Date.now();
-      let timerInterval = setInterval(() => {
+      timerInterval = setInterval(() => {
         const elapsedTime = Math.floor((Date.now() - startTime) / 1000);
         timerDisplay.textContent = formatTime(elapsedTime);
       }, 1000);
 
+      if (liveModeInput && liveModeInput.checked) {
+        startLiveTranscription(mediaRecorder)
+          .catch(error => {
+            console.error('Error starting live transcription:', error);
+          });
+        return;
+      }
+
+      mediaRecorder.start();
       mediaRecorder.ondataavailable = e => {
         audioChunks.push(e.data);
       };
@@ -44,13 +121,11 @@ recordButton.addEventListener('click', () => {
             if (!response.ok) {
                 throw new Error('Network response was not ok');
             }
-            location.reload(); // Force refresh
-
-            return response.text();
+            return response.json();
         })
         .then(data => {
             console.log('Audio uploaded successfully:', data);
-            // Redirect to playback page or display success message
+            waitForJob(data.status_url);
         })
         .catch(error => {
             console.error('Error uploading audio:', error);
@@ -69,10 +144,291 @@ stopButton.addEventListener('click', () => {
   if (mediaRecorder) {
     mediaRecorder.stop();
   }
+  clearInterval(timerInterval);
 
   recordButton.disabled = false;
   stopButton.disabled = true;
 });
 
 // Initially disable the stop button
-stopButton.disabled = true;
\ No newline at end of file
+stopButton.disabled = true;
+
+// --- infinite scroll for the recording lists ---
+
+function escapeHtml(value) {
+  return String(value).replace(/[&<>"']/g, c => ({
+    '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'
+  }[c]));
+}
+
+// transcoded formats the server offers ahead of the original WAV, e.g. [["opus", "audio/ogg; codecs=opus"]]
+const mediaSources = JSON.parse(document.body.dataset.mediaSources || '[]');
+
+// wordsUrl, for recordings, lets the player highlight the word being spoken
+function audioItem(src, filename, links, wordsUrl) {
+  const sources = mediaSources.map(([format, type]) =>
+    `<source src="${src}?format=${format}" type="${escapeHtml(type)}">`).join('');
+  const words = wordsUrl ? ` data-words="${wordsUrl}"` : '';
+  return `
+    <audio controls preload="none"${words}>
+        ${sources}
+        <source src="${src}">
+        Your browser does not support the audio element.
+    </audio>
+    <div class="file-info">
+        <span class="filename">${escapeHtml(filename)}</span>
+        ${links}
+    </div>`;
+}
+
+function renderStt(file) {
+  const base = '/stt/' + encodeURIComponent(file.filename);
+  let links = `<a class="matrix-link" href="${base}/transcript" target="_blank">[VIEW TRANSCRIPT]</a>`;
+  let meter = '';
+  if (file.sentiment_score !== null) {
+    const percent = (file.sentiment_score + 1) * 50;
+    const labelClass = file.sentiment_label ? 'sentiment-' + file.sentiment_label.toLowerCase() : '';
+    links += ` <a class="matrix-link" href="${base}/record" target="_blank">[VIEW SENTIMENT]</a>`;
+    meter = `
+        <div class="sentiment-meter">
+            <div class="sentiment-line"></div>
+            <div class="sentiment-marker" style="left: ${percent}%;"></div>
+            <span class="sentiment-value" style="left: ${percent}%;">${file.sentiment_score}</span>
+            <span class="sentiment-label ${escapeHtml(labelClass)}" style="left: ${percent}%;">
+                ${escapeHtml(file.sentiment_label || '')}
+            </span>
+        </div>`;
+  }
+  return audioItem(base, file.filename, `<div class="file-links">${links}</div>${meter}`, `${base}/words`);
+}
+
+function renderTts(file) {
+  const base = '/tts/' + encodeURIComponent(file.filename);
+  return audioItem(base, file.filename,
+    `<a class="matrix-link" href="${base}.txt" target="_blank">[VIEW SOURCE]</a>`);
+}
+
+const renderers = { stt: renderStt, tts: renderTts };
+
+// --- transcript search ---
+
+const searchForm = document.getElementById('searchForm');
+const searchResults = document.getElementById('search-results');
+const searchMore = document.getElementById('searchMore');
+let searchOffset = null;
+
+// the snippet is already escaped by the server, only <mark> is markup
+function renderSearchResult(result) {
+  return `<div class="search-snippet">${result.snippet}</div>` + renderStt(result);
+}
+
+function runSearch(offset) {
+  const params = new URLSearchParams(new FormData(searchForm));
+  params.set('offset', offset);
+  fetch('/search?' + params)
+    .then(response => response.json())
+    .then(page => {
+      if (page.error) {
+        throw new Error(page.error);
+      }
+      if (offset === 0) {
+        searchResults.innerHTML = page.items.length ? '' : '<li>NO MATCHES</li>';
+      }
+      page.items.forEach(result => {
+        const li = document.createElement('li');
+        li.innerHTML = renderSearchResult(result);
+        searchResults.appendChild(li);
+      });
+      searchOffset = page.next_offset;
+      searchMore.hidden = searchOffset === null;
+    })
+    .catch(error => {
+      console.error('Error searching transcripts:', error);
+    });
+}
+
+searchForm.addEventListener('submit', e => {
+  e.preventDefault();
+  runSearch(0);
+});
+
+searchMore.addEventListener('click', () => {
+  if (searchOffset !== null) {
+    runSearch(searchOffset);
+  }
+});
+
+function loadMore(list, sentinel, observer) {
+  const cursor = list.dataset.cursor;
+  if (!cursor || list.dataset.loading) {
+    return;
+  }
+  list.dataset.loading = 'true';
+  const kind = list.dataset.kind;
+  fetch(`/api/recordings?kind=${kind}&cursor=${encodeURIComponent(cursor)}`)
+    .then(response => response.json())
+    .then(page => {
+      page.items.forEach(file => {
+        const li = document.createElement('li');
+        li.dataset.filename = file.filename;
+        li.innerHTML = renderers[kind](file);
+        list.appendChild(li);
+      });
+      list.dataset.cursor = page.next_cursor || '';
+      // re-observing fires again if the sentinel is still on screen
+      observer.unobserve(sentinel);
+      if (page.next_cursor) {
+        observer.observe(sentinel);
+      }
+    })
+    .catch(error => {
+      console.error('Error loading recordings:', error);
+    })
+    .finally(() => {
+      delete list.dataset.loading;
+    });
+}
+
+document.querySelectorAll('.list-sentinel').forEach(sentinel => {
+  const list = document.getElementById(sentinel.dataset.list);
+  const observer = new IntersectionObserver(entries => {
+    if (entries.some(entry => entry.isIntersecting)) {
+      loadMore(list, sentinel, observer);
+    }
+  }, { rootMargin: '200px' });
+  observer.observe(sentinel);
+});
+
+// --- patching the lists with what changed instead of reloading the page ---
+
+const CHANGES_POLL_MS = 15000; // picks up other tabs' and users' recordings
+let since = document.body.dataset.since || '';
+
+function patchList(item) {
+  const list = document.getElementById(item.kind + '-list');
+  if (!list) {
+    return;
+  }
+  const existing = [...list.children].find(row => row.dataset.filename === item.filename);
+  if (item.removed) {
+    if (existing) {
+      existing.remove();
+    }
+    return;
+  }
+  const audio = existing && existing.querySelector('audio');
+  if (audio && !audio.paused) {
+    return; // don't cut off playback, the next page load shows the update
+  }
+  const row = existing || document.createElement('li');
+  row.dataset.filename = item.filename;
+  row.innerHTML = renderers[item.kind](item);
+  if (existing) {
+    return;
+  }
+  // newest first; a recording older than every loaded row arrives with infinite scroll
+  const older = [...list.children].find(other => other.dataset.filename && other.dataset.filename < item.filename);
+  if (older) {
+    list.insertBefore(row, older);
+  } else if (!list.dataset.cursor) {
+    list.appendChild(row);
+  }
+}
+
+function applyChanges() {
+  return fetch(`/api/recordings?since=${encodeURIComponent(since)}`)
+    .then(response => response.json())
+    .then(delta => {
+      if (delta.reset) {
+        location.reload(); // the server restarted or too much changed to patch
+        return;
+      }
+      delta.items.forEach(patchList);
+      since = delta.since;
+    })
+    .catch(error => {
+      console.error('Error loading recording changes:', error);
+    });
+}
+
+setInterval(() => {
+  if (!document.hidden) {
+    applyChanges();
+  }
+}, CHANGES_POLL_MS);
+
+// synthesize without leaving the page, the new file is patched into the list
+const ttsForm = document.getElementById('ttsForm');
+ttsForm.addEventListener('submit', e => {
+  e.preventDefault();
+  if (!ttsForm.elements.text.value) {
+    return;
+  }
+  fetch(ttsForm.action, {
+    method: 'POST',
+    body: new FormData(ttsForm),
+    headers: { 'Accept': 'application/json' }
+  })
+    .then(response => {
+      if (!response.ok) {
+        throw new Error('Text to speech failed');
+      }
+      ttsForm.reset();
+      return applyChanges();
+    })
+    .catch(error => {
+      console.error('Error generating speech:', error);
+    });
+});
+
+// --- word highlighting while a recording plays ---
+
+const WORD_WINDOW = 30; // seconds of words fetched at a time
+
+function wordTrack(audio) {
+  let track = audio.nextElementSibling;
+  if (!track || !track.classList.contains('word-track')) {
+    track = document.createElement('div');
+    track.className = 'word-track';
+    audio.after(track);
+  }
+  return track;
+}
+
+function highlightWord(track, time) {
+  track.querySelectorAll('span').forEach(span => {
+    span.classList.toggle('word-current',
+      Number(span.dataset.start) <= time && time < Number(span.dataset.end));
+  });
+}
+
+function showWords(audio) {
+  const time = audio.currentTime;
+  const track = wordTrack(audio);
+  if (time >= Number(track.dataset.from) && time < Number(track.dataset.to)) {
+    highlightWord(track, time);
+    return;
+  }
+  // claim the window before fetching so timeupdates in the meantime don't fetch it again
+  const from = Math.max(Math.floor(time) - 1, 0);
+  track.dataset.from = from;
+  track.dataset.to = from + WORD_WINDOW;
+  fetch(`${audio.dataset.words}?from=${from}&to=${from + WORD_WINDOW}`)
+    .then(response => response.ok ? response.json() : { words: [] }) // 404: no timings kept
+    .then(page => {
+      track.innerHTML = page.words.map(w =>
+        `<span data-start="${w.start}" data-end="${w.end}" title="confidence ${w.confidence}">${escapeHtml(w.word)}</span>`
+      ).join(' ');
+      highlightWord(track, audio.currentTime);
+    })
+    .catch(error => {
+      console.error('Error loading word timings:', error);
+    });
+}
+
+// timeupdate doesn't bubble, so listen in the capture phase for every player, including later ones
+document.addEventListener('timeupdate', e => {
+  if (e.target.dataset && e.target.dataset.words) {
+    showWords(e.target);
+  }
+}, true);
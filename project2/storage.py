@@ -0,0 +1,222 @@
+"""
+Where recordings, synthesized audio and their sidecars are stored.
+
+Storage is tiered. New files are written to the local folder (the hot tier),
+where recognition, memory-mapped word timings and Range requests need them.
+compaction.py later moves whole days out of it into an archive backend:
+
+    LocalBackend   a directory, STORAGE_ARCHIVE_FOLDER (default uploads/archive)
+    S3Backend      an S3-compatible bucket, STORAGE_BACKEND=s3 with S3_BUCKET,
+                   S3_PREFIX and S3_ENDPOINT_URL for MinIO and friends
+
+An archived day leaves only <folder>/<YYYYMMDD>/archive.json behind:
+
+    {"v": 1, "files": {name: {"key", "offset", "length", "mtime_ns", "format"}}}
+
+Audio is one object per recording (format is the codec it was transcoded
+to, or null), sidecars are byte ranges of a segment object holding the whole
+day. ids.walk/newest list catalogue names like any other, and TieredStore.path
+fetches archived files into a local read cache, so listing and serving code
+sees a path either way.
+"""
+import json
+import os
+import threading
+
+from werkzeug.security import safe_join
+
+from ids import ARCHIVE_CATALOG, day_of, path_for, relative_path
+
+CATALOG_VERSION = 1
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local')  # local or s3
+ARCHIVE_FOLDER = os.environ.get('STORAGE_ARCHIVE_FOLDER', 'uploads/archive')
+S3_BUCKET = os.environ.get('S3_BUCKET', 'recordings')
+S3_PREFIX = os.environ.get('S3_PREFIX', '')
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL') or None  # e.g. http://localhost:9000 for MinIO
+
+
+def write_atomic(path, data):
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class LocalBackend:
+    def __init__(self, folder):
+        self.folder = folder
+
+    def _path(self, key):
+        return os.path.join(self.folder, *key.split('/'))
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_atomic(path, data)
+
+    def get(self, key, offset=0, length=None):
+        """length bytes of key from offset (the rest if None), None if it doesn't exist."""
+        try:
+            with open(self._path(key), 'rb') as f:
+                f.seek(offset)
+                return f.read() if length is None else f.read(length)
+        except FileNotFoundError:
+            return None
+
+    def delete(self, key):
+        path = self._path(key)
+        try:
+            os.remove(path)
+            os.removedirs(os.path.dirname(path))  # the day's directory once it is empty
+        except OSError:
+            pass
+
+
+def _missing(error):
+    # botocore's ClientError (and fakes.FakeS3Client's) carry the S3 error code
+    code = getattr(error, 'response', {}).get('Error', {}).get('Code')
+    return code in ('NoSuchKey', '404')
+
+
+class S3Backend:
+    def __init__(self, client, bucket, prefix=''):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+
+    def put(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data)
+
+    def get(self, key, offset=0, length=None):
+        byte_range = f"bytes={offset}-" + ('' if length is None else str(offset + length - 1))
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.prefix + key, Range=byte_range)
+        except Exception as e:
+            if _missing(e):
+                return None
+            raise
+        return response['Body'].read()
+
+    def delete(self, key):
+        # deleting a missing key succeeds in S3
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+
+def s3_client():
+    import boto3  # only needed with STORAGE_BACKEND=s3
+    return boto3.client('s3', endpoint_url=S3_ENDPOINT_URL)
+
+
+def open_archive(s3=None):
+    """The archive backend STORAGE_BACKEND selects, s3 defaults to a boto3 client."""
+    if STORAGE_BACKEND == 's3':
+        return S3Backend(s3 if s3 is not None else s3_client(), S3_BUCKET, S3_PREFIX)
+    return LocalBackend(ARCHIVE_FOLDER)
+
+
+class TieredStore:
+    def __init__(self, folder, archive=None, cache_folder=None, max_cache_bytes=256 * 1024 * 1024):
+        self.folder = folder
+        self.archive = archive
+        self.cache_folder = cache_folder
+        self.max_cache_bytes = max_cache_bytes
+        self._catalogs = {}  # day -> (catalogue mtime_ns, files)
+        self._lock = threading.Lock()
+        if cache_folder:
+            os.makedirs(cache_folder, exist_ok=True)
+
+    def new_path(self, name):
+        """Where a new file is written, in the hot tier."""
+        return path_for(self.folder, name, create=True)
+
+    def write(self, name, data):
+        write_atomic(self.new_path(name), data)
+
+    def delete(self, name):
+        path = self._local_path(name)
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+
+    def exists(self, name):
+        path = self._local_path(name)
+        return path is not None and (os.path.isfile(path) or self.archived(name) is not None)
+
+    def path(self, name):
+        """A local path with the contents of name, fetched from the archive if needed. None if missing."""
+        path = self._local_path(name)
+        if path is None:
+            return None
+        if os.path.isfile(path):
+            return path
+        entry = self.archived(name)
+        return self._fetch(name, entry) if entry is not None else None
+
+    def _local_path(self, name):
+        # names come from URLs, safe_join refuses anything that would leave the folder
+        return safe_join(self.folder, relative_path(name))
+
+    def catalog_path(self, day):
+        return os.path.join(self.folder, day, ARCHIVE_CATALOG)
+
+    def catalog(self, day):
+        """{name: entry} of a day's archived files, {} if none."""
+        path = self.catalog_path(day)
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return {}
+        cached = self._catalogs.get(day)
+        if cached is not None and cached[0] == mtime_ns:
+            return cached[1]
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                files = json.load(f)['files']
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Unreadable archive catalogue {path}: {e}")
+            return {}
+        with self._lock:
+            self._catalogs[day] = (mtime_ns, files)
+        return files
+
+    def write_catalog(self, day, files):
+        write_atomic(self.catalog_path(day),
+                     json.dumps({'v': CATALOG_VERSION, 'files': files}, separators=(',', ':')).encode('utf-8'))
+
+    def archived(self, name):
+        day = day_of(name)
+        return self.catalog(day).get(name) if day and self.archive is not None else None
+
+    def _fetch(self, name, entry):
+        if not self.cache_folder:
+            return None
+        # the extension tells media.py what the audio was transcoded to
+        path = os.path.join(self.cache_folder, name + (f".{entry['format']}" if entry.get('format') else ''))
+        if os.path.exists(path):
+            return path
+        data = self.archive.get(entry['key'], entry['offset'], entry['length'])
+        if data is None:
+            print(f"Archived {name} is missing from {entry['key']}")
+            return None
+        write_atomic(path, data)
+        # the original mtime keeps ETags stable however often the copy is re-fetched
+        os.utime(path, ns=(entry['mtime_ns'], entry['mtime_ns']))
+        self._prune(keep=path)
+        return path
+
+    def _prune(self, keep):
+        """Trims the read cache to max_cache_bytes, the longest-cached copies first."""
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.cache_folder):
+                if entry.is_file() and entry.path != keep and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    entries.append((stat.st_ctime, stat.st_size, entry.path))
+            total = sum(size for ctime, size, path in entries) + os.path.getsize(keep)
+            for ctime, size, path in sorted(entries):
+                if total <= self.max_cache_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
@@ -0,0 +1,148 @@
+"""
+Live transcription sessions backed by streaming_recognize.
+
+The browser POSTs MediaRecorder chunks as they are recorded and listens on a
+Server-Sent Events stream for partial and final transcripts. Each session
+runs one streaming_recognize call on its own thread, fed from a queue of the
+received chunks.
+"""
+import json
+import queue
+import threading
+import time
+import uuid
+
+_END = object()
+
+
+class StreamError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class StreamSession:
+    def __init__(self, client, streaming_config, request_factory, on_complete,
+                 max_bytes=50 * 1024 * 1024, max_chunks=256):
+        self.id = uuid.uuid4().hex
+        self.client = client
+        self.streaming_config = streaming_config
+        self.request_factory = request_factory
+        self.on_complete = on_complete
+        self.max_bytes = max_bytes
+        self.received_bytes = 0
+        self.events = queue.Queue()
+        self.finals = []
+        self.audio_chunks = []
+        self.closed = False
+        self.finished = False
+        self.last_activity = time.time()
+        self._chunks = queue.Queue(maxsize=max_chunks)
+        self._thread = threading.Thread(target=self._run, name=f"stream-{self.id[:8]}", daemon=True)
+        self._thread.start()
+
+    def feed(self, chunk):
+        if self.closed:
+            raise StreamError("Stream already ended", 409)
+        self.last_activity = time.time()
+        self.received_bytes += len(chunk)
+        if self.received_bytes > self.max_bytes:
+            raise StreamError(f"Stream exceeds {self.max_bytes} bytes", 413)
+        self.audio_chunks.append(chunk)
+        try:
+            self._chunks.put(chunk, timeout=5)
+        except queue.Full:
+            raise StreamError("Recognizer is falling behind, slow down", 429)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._chunks.put(_END)
+
+    def _requests(self):
+        while True:
+            chunk = self._chunks.get()
+            if chunk is _END:
+                return
+            yield self.request_factory(chunk)
+
+    def _run(self):
+        try:
+            responses = self.client.streaming_recognize(config=self.streaming_config, requests=self._requests())
+            for response in responses:
+                for result in response.results:
+                    if not result.alternatives:
+                        continue
+                    transcript = result.alternatives[0].transcript
+                    if result.is_final:
+                        self.finals.append(transcript)
+                        self.events.put({'type': 'final', 'transcript': transcript})
+                    else:
+                        self.events.put({'type': 'partial', 'transcript': transcript})
+            extra = self.on_complete(self) or {}
+            self.events.put(dict({'type': 'done', 'transcript': self.transcript()}, **extra))
+        except Exception as e:
+            print(f"Streaming recognition failed: {e}")
+            self.events.put({'type': 'error', 'error': str(e)})
+        finally:
+            self.finished = True
+            self.last_activity = time.time()
+
+    def transcript(self):
+        return ''.join(text + '\n' for text in self.finals)
+
+    def audio(self):
+        return b''.join(self.audio_chunks)
+
+    def sse(self, keepalive=15):
+        """Yields the session events formatted as a text/event-stream."""
+        while True:
+            try:
+                event = self.events.get(timeout=keepalive)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+            if event['type'] in ('done', 'error'):
+                return
+
+
+class StreamManager:
+    def __init__(self, client, streaming_config, request_factory, on_complete,
+                 max_sessions=8, max_bytes=50 * 1024 * 1024, idle_timeout=120):
+        self.client = client
+        self.streaming_config = streaming_config
+        self.request_factory = request_factory
+        self.on_complete = on_complete
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_timeout = idle_timeout
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            self._expire()
+            active = sum(1 for s in self._sessions.values() if not s.finished)
+            if active >= self.max_sessions:
+                raise StreamError("Too many live transcriptions in progress", 503)
+            session = StreamSession(self.client, self.streaming_config, self.request_factory,
+                                    self.on_complete, max_bytes=self.max_bytes)
+            self._sessions[session.id] = session
+        return session
+
+    def get(self, stream_id):
+        with self._lock:
+            session = self._sessions.get(stream_id)
+        if session is None:
+            raise StreamError("Unknown stream", 404)
+        return session
+
+    def _expire(self):
+        # caller holds the lock
+        now = time.time()
+        for stream_id, session in list(self._sessions.items()):
+            if now - session.last_activity > self.idle_timeout:
+                session.close()
+                if session.finished:
+                    del self._sessions[stream_id]
@@ -0,0 +1,127 @@
+"""
+Concurrency stress test of the upload name allocator (ids.py).
+
+    python stress_ids.py [--processes 4] [--threads 8] [--count 25000] [--files]
+
+Forks --processes workers (like gunicorn/uvicorn workers) with --threads
+threads each. After a shared start barrier every thread allocates --count
+names as fast as it can. With --files each name is also created with O_EXCL
+in its shard directory under a scratch folder, so any collision fails the
+open() the way it would have overwritten an upload.
+
+Checks that no name repeats across all processes, that every thread saw
+strictly increasing names, that the workers drew different nodes, and that a
+clock stepping backwards never yields a smaller name. Reports names/s overall
+and the largest shard directory, and exits non-zero on any failure.
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import ids
+
+
+def allocate(count, folder, results):
+    names = []
+    for _ in range(count):
+        name = ids.new_id() + '.wav'
+        if folder is not None:
+            fd = os.open(ids.path_for(folder, name, create=True), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.close(fd)
+        names.append(name)
+    results.append(names)
+
+
+def worker(index, args, folder, barrier, result_path):
+    results = []
+    threads = [threading.Thread(target=allocate, args=(args.count, folder, results))
+               for _ in range(args.threads)]
+    barrier.wait()
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    with open(result_path, 'w') as f:
+        f.write(f"{ids._allocator.node} {elapsed}\n")
+        for names in results:
+            f.write(' '.join(names) + '\n')
+
+
+def check_clock_steps():
+    """Names must keep increasing when the wall clock jumps back."""
+    allocator = ids.IdAllocator()
+    now = time.time()
+    names = [allocator.new_id(t) for t in (now, now - 1, now - 3600, now, now + 0.001, now - 0.5)]
+    return names == sorted(names) and len(set(names)) == len(names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--count', type=int, default=25000, help="names per thread")
+    parser.add_argument('--files', action='store_true', help="also create every name with O_EXCL")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='stress-ids-')
+    folder = os.path.join(scratch, 'files') if args.files else None
+    context = multiprocessing.get_context('fork')  # exercises the node re-draw after fork
+    barrier = context.Barrier(args.processes + 1)
+    result_paths = [os.path.join(scratch, f'worker-{i}.txt') for i in range(args.processes)]
+    try:
+        workers = [context.Process(target=worker, args=(i, args, folder, barrier, result_paths[i]))
+                   for i in range(args.processes)]
+        for p in workers:
+            p.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for p in workers:
+            p.join()
+        elapsed = time.perf_counter() - start
+        crashed = [p.pid for p in workers if p.exitcode != 0]
+
+        nodes, total, unsorted = [], 0, 0
+        seen = set()
+        for path in result_paths:
+            if not os.path.exists(path):
+                continue
+            with open(path) as f:
+                node, _ = f.readline().split()
+                nodes.append(node)
+                for line in f:
+                    names = line.split()
+                    total += len(names)
+                    seen.update(names)
+                    unsorted += sum(1 for a, b in zip(names, names[1:]) if a >= b)
+        largest = 0
+        if folder is not None:
+            for root, dirs, files in os.walk(folder):
+                largest = max(largest, len(files))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    duplicates = total - len(seen)
+    clock_ok = check_clock_steps()
+    expected = args.processes * args.threads * args.count
+    print(f"{args.processes} processes x {args.threads} threads x {args.count} names"
+          f"{' (files created with O_EXCL)' if args.files else ''}")
+    print(f"allocated {total}/{expected} in {elapsed:.2f}s = {total / elapsed:,.0f} names/s")
+    print(f"duplicates: {duplicates}, out-of-order within a thread: {unsorted}, "
+          f"distinct nodes: {len(set(nodes))}/{len(nodes)}, clock steps back ok: {clock_ok}")
+    if folder is not None:
+        print(f"largest shard directory: {largest} files")
+    failed = crashed or duplicates or unsorted or total != expected or len(set(nodes)) != len(nodes) or not clock_ok
+    if crashed:
+        print(f"workers failed: {crashed}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
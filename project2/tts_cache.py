@@ -0,0 +1,155 @@
+"""
+Content-addressed cache for synthesized speech.
+
+Entries are keyed by a hash of everything that affects the audio (text,
+language, encoding, voice). A small in-memory tier holds the hottest clips and
+a size-bounded directory on disk holds the rest, both evicted least recently
+used first.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def cache_key(text, language_code, audio_encoding, voice_name=''):
+    payload = json.dumps([text, language_code, str(audio_encoding), voice_name], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class TTSCache:
+    def __init__(self, folder, max_disk_bytes=256 * 1024 * 1024, max_memory_bytes=16 * 1024 * 1024):
+        self.folder = folder
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> audio bytes
+        self._memory_bytes = 0
+        self._disk = OrderedDict()  # key -> size, oldest access first
+        self._disk_bytes = 0
+        self.counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'bytes_saved': 0,
+            'latency_saved_seconds': 0.0,
+            'evictions': 0,
+        }
+        self._miss_latency_total = 0.0
+
+        os.makedirs(folder, exist_ok=True)
+        entries = []
+        for name in os.listdir(folder):
+            if name.endswith('.wav'):
+                stat = os.stat(os.path.join(folder, name))
+                entries.append((stat.st_mtime, name[:-4], stat.st_size))
+        for mtime, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+
+    def _path(self, key):
+        return os.path.join(self.folder, key + '.wav')
+
+    def _avg_miss_latency(self):
+        misses = self.counters['misses']
+        return self._miss_latency_total / misses if misses else 0.0
+
+    def _remember(self, key, audio):
+        # caller holds the lock
+        if len(audio) > self.max_memory_bytes:
+            return
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = audio
+        self._memory_bytes += len(audio)
+        while self._memory_bytes > self.max_memory_bytes:
+            old_key, old_audio = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old_audio)
+
+    def _hit(self, kind, audio):
+        self.counters[kind] += 1
+        self.counters['bytes_saved'] += len(audio)
+        self.counters['latency_saved_seconds'] += self._avg_miss_latency()
+
+    def get(self, key):
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                # the disk order decides eviction, so a clip served from memory is recent there too
+                if key in self._disk:
+                    self._disk.move_to_end(key)
+                self._hit('memory_hits', audio)
+            elif key not in self._disk:
+                return None
+        if audio is not None:
+            try:
+                os.utime(self._path(key))  # keeps the order across restarts
+            except OSError:
+                pass
+            return audio
+        try:
+            with open(self._path(key), 'rb') as f:
+                audio = f.read()
+            os.utime(self._path(key))
+        except OSError:
+            with self._lock:
+                self._disk_bytes -= self._disk.pop(key, 0)
+            return None
+        with self._lock:
+            if key in self._disk:
+                self._disk.move_to_end(key)
+            self._remember(key, audio)
+            self._hit('disk_hits', audio)
+        return audio
+
+    def put(self, key, audio):
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(audio)
+        os.replace(tmp_path, path)
+        evicted = []
+        with self._lock:
+            self._disk_bytes += len(audio) - self._disk.pop(key, 0)
+            self._disk[key] = len(audio)
+            self._remember(key, audio)
+            while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+                old_key, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                self._memory_bytes -= len(self._memory.pop(old_key, b''))
+                self.counters['evictions'] += 1
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    def get_or_synthesize(self, key, synthesize):
+        """Returns cached audio for key, calling synthesize() and caching the result on a miss."""
+        audio = self.get(key)
+        if audio is not None:
+            return audio
+        start = time.perf_counter()
+        audio = synthesize()
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.counters['misses'] += 1
+            self._miss_latency_total += elapsed
+        self.put(key, audio)
+        return audio
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+            stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+            stats['memory_entries'] = len(self._memory)
+            stats['memory_bytes'] = self._memory_bytes
+            stats['disk_entries'] = len(self._disk)
+            stats['disk_bytes'] = self._disk_bytes
+        return stats
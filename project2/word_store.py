@@ -0,0 +1,121 @@
+"""
+Word timings and confidences of each recording, stored column-wise so the
+player can fetch the words of any stretch of a recording cheaply.
+
+The recognizer returns a start, end and confidence for every word. They are
+kept in <recording name without extension>.words next to the audio:
+
+    header   magic b'WRD1', word count, vocabulary size, vocabulary bytes,
+             longest word and end of the last word in ms (little-endian uint32s)
+    starts   uint32[count]      milliseconds, in time order
+    ends     uint32[count]      milliseconds
+    word_ids uint32[count]      index into the vocabulary
+    offsets  uint32[vocab + 1]  where each vocabulary word starts in the text
+    conf     uint8[count]       confidence * 255
+    text     the distinct words, UTF-8, back to back
+
+That is 13 bytes per word plus each distinct word once, against ~80 bytes per
+word as JSON. Reads memory-map the file and binary search the starts column,
+so a time-range query only touches the pages it returns however long the
+recording is, and nothing is held in memory between requests. Files of an
+archived day are read from the storage.TieredStore's read cache.
+"""
+import mmap
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b'WRD1'
+HEADER = struct.Struct('<4sIIIII')
+MAX_MS = 2 ** 32 - 1  # times are stored as uint32 milliseconds
+
+
+def words_name(audio_filename):
+    return os.path.splitext(audio_filename)[0] + '.words'
+
+
+def encode(words):
+    """[(word, start_seconds, end_seconds, confidence)] -> the file contents."""
+    words = sorted(words, key=lambda word: word[1])
+    vocab = {}
+    word_ids = np.array([vocab.setdefault(word, len(vocab)) for word, start, end, confidence in words],
+                        dtype='<u4')
+    text = [word.encode('utf-8') for word in vocab]
+    offsets = np.zeros(len(text) + 1, dtype='<u4')
+    offsets[1:] = np.cumsum([len(word) for word in text])
+
+    times = np.array([(start, end) for word, start, end, confidence in words], dtype=np.float64).reshape(-1, 2)
+    millis = np.round(np.clip(times, 0, None) * 1000).astype('<u4')
+    starts, ends = np.ascontiguousarray(millis[:, 0]), np.ascontiguousarray(millis[:, 1])
+    confidences = np.array([confidence or 0.0 for word, start, end, confidence in words], dtype=np.float64)
+    confidences = np.round(np.clip(confidences, 0, 1) * 255).astype(np.uint8)
+    longest = int((ends.astype(np.int64) - starts).clip(0).max()) if len(words) else 0
+    end = int(ends.max()) if len(words) else 0
+
+    return b''.join([HEADER.pack(MAGIC, len(words), len(text), int(offsets[-1]), longest, end),
+                     starts.tobytes(), ends.tobytes(), word_ids.tobytes(), offsets.tobytes(),
+                     confidences.tobytes(), b''.join(text)])
+
+
+def _millis(seconds):
+    # finite seconds only, clamped to what the file can hold
+    return int(round(min(max(seconds, 0.0), MAX_MS / 1000) * 1000))
+
+
+def _between(buffer, start_ms, end_ms):
+    """Words of an encoded file overlapping [start_ms, end_ms], as plain Python values."""
+    magic, count, vocab_size, text_bytes, longest, end = HEADER.unpack_from(buffer)
+    if magic != MAGIC:
+        raise ValueError("not a word timings file")
+    position = HEADER.size
+
+    def column(dtype, length):
+        nonlocal position
+        array = np.frombuffer(buffer, dtype=dtype, count=length, offset=position)
+        position += array.nbytes
+        return array
+
+    starts, ends, word_ids = column('<u4', count), column('<u4', count), column('<u4', count)
+    offsets = column('<u4', vocab_size + 1)
+    confidences = column(np.uint8, count)
+    text = position
+
+    # a word that started up to `longest` ms before the range can still overlap it
+    first = int(np.searchsorted(starts, max(start_ms - longest, 0), side='left'))
+    last = int(np.searchsorted(starts, end_ms, side='right'))
+    words = []
+    for i in range(first, last):
+        if ends[i] < start_ms:
+            continue
+        word_id = word_ids[i]
+        word = bytes(buffer[text + offsets[word_id]:text + offsets[word_id + 1]]).decode('utf-8')
+        words.append({'word': word, 'start': int(starts[i]) / 1000, 'end': int(ends[i]) / 1000,
+                      'confidence': round(int(confidences[i]) / 255, 2)})
+    return words, end / 1000
+
+
+class WordStore:
+    def __init__(self, store):
+        self.store = store
+
+    def write(self, audio_filename, words):
+        """Stores [(word, start_seconds, end_seconds, confidence)] for a recording, atomically."""
+        self.store.write(words_name(audio_filename), encode(words))
+
+    def between(self, audio_filename, start=0.0, end=None):
+        """
+        (words, duration) for the words overlapping [start, end] seconds, each
+        a dict of word, start, end and confidence. end defaults to the end of
+        the recording. None if the recording has no word timings.
+        """
+        path = self.store.path(words_name(audio_filename))
+        if path is None:
+            return None
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        with f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            # _between's numpy views are gone when it returns, so the map can close
+            return _between(buffer, _millis(start), MAX_MS if end is None else _millis(end))
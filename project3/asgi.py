@@ -0,0 +1,199 @@
+"""
+ASGI serving mode: uploads are sent to Gemini with generate_content_async on
+an asyncio event loop instead of holding a request thread for the LLM call.
+
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT --workers 1     (Procfile.asgi)
+
+POST /upload is handled natively here; every other route is the unchanged
+Flask app from main.py mounted through a WSGI adapter.
+
+Thread mode (Procfile) vs async mode (Procfile.asgi)
+----------------------------------------------------
+Thread mode, gunicorn with 1 worker and 8 threads:
+  - /upload calls Gemini synchronously, so each upload holds one of the 8
+    threads for the whole LLM call. At most 8 uploads (minus whatever page
+    and listing requests are being served) are processed at once, and with
+    a 10 s LLM call throughput tops out at 8 / 10 s = 0.8 uploads/s;
+  - a burst of uploads also starves the page and listing requests, which
+    queue behind them for a thread.
+
+Async mode, uvicorn with 1 worker:
+  - an upload waiting on Gemini is a coroutine, not a thread. Up to
+    ASYNC_MAX_INFLIGHT (256) uploads are processed at once (more get a 503
+    with Retry-After), so throughput is bounded by ASYNC_MAX_INFLIGHT /
+    latency until the Vertex AI quota or the CPU for WAV preprocessing
+    becomes the limit;
+  - saving, preprocessing, sqlite and the LLM cache still block, so they run
+    in the default thread pool (asyncio.to_thread);
+  - the mounted Flask routes keep their own WSGI_THREADS (8) threads, so
+    page loads are no longer queued behind LLM calls;
+  - memory: every upload in flight keeps its audio in memory until Gemini
+    answers, so size ASYNC_MAX_INFLIGHT to RAM / typical upload size.
+
+To compare them on the same machine, run each Procfile with
+USE_FAKE_CLIENTS=1 FAKE_LATENCY=10 and send concurrent uploads with any HTTP
+load tool while watching stt_app_requests_in_flight, stt_app_async_uploads_inflight
+and stt_app_stage_seconds{stage="llm"} on /metrics.
+"""
+import asyncio
+import contextlib
+import os
+import time
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, RedirectResponse
+from starlette.routing import Mount, Route
+
+import main
+from clients import ClientUnavailable
+from ids import new_id
+from ingest import MultipartUpload, UploadError
+from recording_meta import audio_duration
+from resilience import AIMDLimit, Backend, BackendUnavailable, deadline
+
+ASYNC_MAX_INFLIGHT = int(os.environ.get('ASYNC_MAX_INFLIGHT', 256))
+WSGI_THREADS = int(os.environ.get('WSGI_THREADS', 8)) # Threads for the mounted Flask routes
+
+inflight = 0 # Uploads being processed, only touched from the event loop thread
+main.metrics.gauge_callback('async_uploads_inflight', 'Uploads being processed on the event loop',
+                            lambda: inflight)
+
+# Calls from the loop are limited separately, their limit can grow towards ASYNC_MAX_INFLIGHT,
+# but share the Gemini circuit breaker with the thread-mode routes
+gemini_async_backend = Backend('gemini_async', timeout=main.REQUEST_DEADLINE, breaker=main.gemini_backend.breaker,
+                               limit=AIMDLimit(main.BACKEND_CONCURRENCY, max_limit=ASYNC_MAX_INFLIGHT))
+main.metrics.gauge_callback('backend_gemini_async', 'Gemini calls from the loop, concurrency limit and circuit',
+                            gemini_async_backend.stats)
+
+
+async def transcribe_with_llm_async(audio_bytes):
+    """Async counterpart of main.transcribe_with_llm, same cache, parser, main.LLMError and BackendUnavailable."""
+    try:
+        model = main.clients.get('gemini')
+    except ClientUnavailable as e:
+        print(f"Error: Vertex AI Model not initialized. {e}")
+        raise main.LLMError("Error: Model not available")
+
+    key, cached = await asyncio.to_thread(main.cached_llm_result, audio_bytes)
+    if cached is not None:
+        return cached
+
+    print("Sending audio to LLM...")
+    try:
+        with main.metrics.timer('llm'):
+            response = await gemini_async_backend.call_async(
+                # Cancelled at the deadline by call_async, the SDK's generate_content_async takes no timeout
+                lambda timeout: model.generate_content_async(main.llm_contents(audio_bytes),
+                                                             generation_config=main.GENERATION_CONFIG))
+        print("LLM Response Received.")
+        llm_text = response.text
+    except BackendUnavailable:
+        raise
+    except Exception as e:
+        print(f"An unexpected error occurred during LLM processing: {e}")
+        raise main.LLMError(f"Error: Unexpected processing error ({type(e).__name__})")
+
+    return await asyncio.to_thread(main.finish_llm_result, key, llm_text)
+
+
+async def process_audio_with_llm_async(audio_bytes):
+    """Async counterpart of main.process_audio_with_llm."""
+    try:
+        return await transcribe_with_llm_async(audio_bytes)
+    except main.LLMError as e:
+        return str(e), "Neutral", 0.0
+
+
+def count_response(response, started):
+    """The Flask request hooks don't see native routes, so record the same metrics here."""
+    main.metrics.observe('request_seconds', time.perf_counter() - started,
+                         'HTTP request latency by endpoint', endpoint='upload_audio')
+    main.metrics.inc('responses_total', 1, 'HTTP responses by endpoint and status',
+                     endpoint='upload_audio', status=response.status_code)
+    return response
+
+
+async def upload_audio(request):
+    """Handles audio upload, processing via LLM, and saving results."""
+    global inflight
+    started = time.perf_counter()
+    if inflight >= ASYNC_MAX_INFLIGHT:
+        return count_response(PlainTextResponse('Server busy, try again later', 503,
+                                                headers={'Retry-After': '5'}), started)
+    if int(request.headers.get('content-length') or 0) > main.app.config['MAX_CONTENT_LENGTH']:
+        return count_response(PlainTextResponse('Upload too large', 413), started)
+
+    inflight += 1
+    try:
+        # Generate a unique, time-sortable filename, stored in its minute's shard
+        audio_filename = f"audio_{new_id()}.wav"
+        audio_filepath = main.stt_store.new_path(audio_filename)
+        try:
+            # Parsed as the body arrives, request.form() would spool it to a temporary file first
+            with main.metrics.timer('save'), MultipartUpload(request.headers.get('content-type'), 'audio_data',
+                                                             audio_filepath, main.MAX_UPLOAD_BYTES,
+                                                             validate=main.VALIDATE_WAV_HEADER, keep=True) as upload:
+                async for chunk in request.stream():
+                    if chunk:
+                        await asyncio.to_thread(upload.feed, chunk)
+                upload.feed(b'') # End of body
+                if upload.filename and not main.allowed_file(upload.filename):
+                    raise UploadError("Invalid file type. Only .wav files are allowed.")
+                upload.finish()
+            audio_data = upload.data # Kept while streaming, so the file is not read back
+        except UploadError as e:
+            print(f"Rejecting upload: {e}")
+            return count_response(PlainTextResponse(str(e), e.status), started)
+        except OSError as e:
+            print(f"Error saving uploaded audio: {e}")
+            return count_response(RedirectResponse('/', 302), started)
+
+        try:
+            print(f"Audio file saved to: {audio_filepath}")
+            await asyncio.to_thread(main.recordings_index.add, audio_filename)
+            main.changes.publish('stt', audio_filename)
+
+            duration = audio_duration(audio_data)
+            timings = {}
+            start = time.perf_counter()
+            audio_data = await asyncio.to_thread(main.prepare_audio, audio_filename, audio_data)
+            timings['preprocess'] = round(time.perf_counter() - start, 3)
+            start = time.perf_counter()
+            with deadline(main.request_deadline(request.headers.get('X-Request-Timeout'))):
+                transcript, sentiment_label, sentiment_score = await process_audio_with_llm_async(audio_data)
+            timings['llm'] = round(time.perf_counter() - start, 3)
+
+            await asyncio.to_thread(main.save_results, audio_filename, transcript, sentiment_label,
+                                    sentiment_score, duration=duration, timings=timings)
+        except BackendUnavailable as e:
+            # As in main.upload_audio: drop the recording and let the client retry later
+            print(f"Rejecting upload, Gemini unavailable: {e}")
+            main.metrics.inc('upload_errors_total', 1, 'Uploads that failed during processing')
+            await asyncio.to_thread(main.stt_store.delete, audio_filename)
+            await asyncio.to_thread(main.recordings_index.remove, audio_filename)
+            main.changes.publish('stt', audio_filename)
+            return count_response(JSONResponse({'error': str(e)}, e.status,
+                                               headers={'Retry-After': str(e.retry_after)}), started)
+        except Exception as e:
+            print(f"Error during file upload or processing: {e}")
+            main.metrics.inc('upload_errors_total', 1, 'Uploads that failed during processing')
+    finally:
+        inflight -= 1
+
+    # The page uploads with fetch and patches the list from /api/recordings?since=
+    if request.headers.get('accept') == 'application/json':
+        return count_response(JSONResponse({'filename': audio_filename}, 201), started)
+    return count_response(RedirectResponse('/', 302), started)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    main.start_background() # Only when serving, see main.start_background
+    yield
+
+
+app = Starlette(routes=[
+    Route('/upload', upload_audio, methods=['POST']),
+    Mount('/', app=WSGIMiddleware(main.app, workers=WSGI_THREADS)),
+], lifespan=lifespan)
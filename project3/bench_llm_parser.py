@@ -0,0 +1,165 @@
+"""
+Micro-benchmark and fuzz check of llm_parser against the previous
+three-regex parse_llm_response.
+
+    python bench_llm_parser.py [--fuzz 5000] [--seed 0] [--repeat 20]
+
+Runs both parsers over llm_parser_corpus.json (hand-written well-formed and
+malformed answers with the expected result) and over --fuzz random mutations
+of it (truncation, dropped/duplicated/swapped lines, junk characters, mangled
+numbers, fences, case changes). Reports corpus accuracy, fuzz invariant
+violations (exceptions, labels outside Positive/Neutral/Negative, scores
+outside [-1, 1]) and microseconds per response. Exits non-zero if the new
+parser misses any corpus case or violates an invariant.
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import random
+import re
+import sys
+import time
+
+from llm_parser import parse_llm_response
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'llm_parser_corpus.json')
+JUNK = ['```', ':', '\n', '\r\n', '**', '"', '\x00', 'é', '—', '{', '}', 'Text:', 'Sentiment Score:', ' ' * 8]
+BAD_NUMBERS = ['NaN', '1e999', '--1', '0.5.5', '', 'high', '− 0.4', '1,5']
+
+
+def legacy_parse_llm_response(llm_text):
+    """The parser as it was before llm_parser (prints removed), kept as the baseline."""
+    transcript = "Error: Could not parse transcript."
+    sentiment_label = "neutral"
+    sentiment_score = 0.0
+    llm_text = llm_text.strip().strip('```').strip()
+    try:
+        text_match = re.search(r"^\s*Text:(.*)", llm_text, re.IGNORECASE | re.MULTILINE)
+        label_match = re.search(r"^\s*Sentiment Label:\s*(positive|neutral|negative)\s*$", llm_text,
+                                re.IGNORECASE | re.MULTILINE)
+        score_match = re.search(r"^\s*Sentiment Score:\s*(-?\d+(\.\d+)?)\s*$", llm_text,
+                                re.IGNORECASE | re.MULTILINE)
+        if text_match:
+            transcript = text_match.group(1).strip()
+            transcript = transcript.strip('"').strip("'")
+            if not transcript:
+                transcript = "[Empty Transcript Received]"
+        if label_match:
+            sentiment_label = label_match.group(1).lower()
+        if score_match:
+            try:
+                sentiment_score = max(-1.0, min(1.0, float(score_match.group(1))))
+            except ValueError:
+                sentiment_score = 0.0
+    except Exception as e:
+        transcript = f"Error parsing response: {e}"
+    if sentiment_label == "positive":
+        final_label = "Positive"
+    elif sentiment_label == "negative":
+        final_label = "Negative"
+    else:
+        final_label = "Neutral"
+    return transcript, final_label, sentiment_score
+
+
+def mutate(text, rng):
+    lines = text.split('\n')
+    op = rng.randrange(9)
+    if op == 0:
+        return text[:rng.randrange(len(text) + 1)]
+    if op == 1 and len(lines) > 1:
+        del lines[rng.randrange(len(lines))]
+    elif op == 2:
+        i = rng.randrange(len(lines))
+        lines.insert(i, lines[i])
+    elif op == 3 and len(lines) > 1:
+        i, j = rng.sample(range(len(lines)), 2)
+        lines[i], lines[j] = lines[j], lines[i]
+    elif op == 4:
+        pos = rng.randrange(len(text) + 1)
+        return text[:pos] + rng.choice(JUNK) + text[pos:]
+    elif op == 5:
+        return re.sub(r'-?\d+(\.\d+)?', lambda m: rng.choice(BAD_NUMBERS), text, count=1)
+    elif op == 6:
+        return f"```{rng.choice(['', 'json', 'text'])}\n{text}\n```"
+    elif op == 7:
+        return ''.join(c.upper() if rng.random() < 0.5 else c.lower() for c in text)
+    else:
+        i = rng.randrange(len(lines))
+        lines.insert(i + 1, "and then a second line of speech")
+    return '\n'.join(lines)
+
+
+def check(parse, response):
+    """Returns an error string if the result violates the parser contract, else None."""
+    try:
+        transcript, label, score = parse(response)
+    except Exception as e:
+        return f"raised {type(e).__name__}: {e}"
+    if not isinstance(transcript, str) or not transcript:
+        return f"bad transcript {transcript!r}"
+    if label not in ('Positive', 'Neutral', 'Negative'):
+        return f"bad label {label!r}"
+    if not isinstance(score, float) or not -1.0 <= score <= 1.0:
+        return f"bad score {score!r}"
+    return None
+
+
+def time_parser(parse, responses, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for response in responses:
+            parse(response)
+        best = min(best, time.perf_counter() - start)
+    return best / len(responses) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fuzz', type=int, default=5000, help="number of mutated responses")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=20, help="timing repetitions, best one is reported")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)  # the parser warns on every malformed answer
+    with open(CORPUS_PATH) as f:
+        corpus = json.load(f)
+    rng = random.Random(args.seed)
+    seeds = [case['response'] for case in corpus if case['response']]
+    fuzzed = []
+    for _ in range(args.fuzz):
+        text = rng.choice(seeds)
+        for _ in range(rng.randint(1, 3)):
+            text = mutate(text, rng)
+        fuzzed.append(text)
+
+    parsers = [('legacy', legacy_parse_llm_response), ('llm_parser', parse_llm_response)]
+    failed = False
+    print(f"{'parser':>10} {'corpus':>9} {'fuzz errors':>12} {'us/response':>12}")
+    for name, parse in parsers:
+        misses = []
+        for case in corpus:
+            expected = case['expected']
+            if parse(case['response']) != (expected['transcript'], expected['label'], expected['score']):
+                misses.append(case['name'])
+        violations = [(response, error) for response in fuzzed
+                      for error in [check(parse, response)] if error]
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            micros = time_parser(parse, [case['response'] for case in corpus] + fuzzed, args.repeat)
+        print(f"{name:>10} {len(corpus) - len(misses):>4}/{len(corpus):<4} {len(violations):>12} {micros:>12.1f}")
+        if name == 'llm_parser':
+            for miss in misses:
+                print(f"  corpus miss: {miss}")
+            for response, error in violations[:5]:
+                print(f"  fuzz violation: {error} for {response!r}")
+            failed = bool(misses or violations)
+        else:
+            print(f"  missed: {', '.join(misses) or 'none'}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""
+Bulk import / re-processing of WAV files outside the browser.
+
+    python bulk_import.py <directory | manifest.txt> [--workers 4] [--llm-rate 2] [--force]
+
+A manifest is a text file with one WAV path per line. Files are copied into
+the STT upload folder (unless they are already there) under a name derived
+from their content, import_<hash>.wav, so files with the same name in
+different directories don't collide; the record keeps the source path. They
+are then sent through transcribe_with_llm and written out as the usual
+metadata record. Files that already have a record (or legacy sentiment file)
+are skipped, so an interrupted run can be restarted. --llm-rate counts every
+Gemini call, retries included. LLM errors are reported but not written to disk, so the
+file is picked up again on the next run.
+"""
+import argparse
+import hashlib
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import main
+from ids import path_for
+from recording_meta import audio_duration, load_fields
+
+
+class RateLimiter:
+    """Token bucket shared by all workers, rate is calls per second (0 = unlimited)."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class RateLimitedClient:
+    """
+    Takes a token from limiter before every method call on client, so each
+    chunk, retry and hedge counts against the rate, not just each file.
+    """
+
+    def __init__(self, client, limiter):
+        self._client = client
+        self._limiter = limiter
+
+    def __getattr__(self, attr):
+        value = getattr(self._client, attr)
+        if not callable(value):
+            return value
+
+        def call(*args, **kwargs):
+            self._limiter.acquire()
+            return value(*args, **kwargs)
+        return call
+
+
+def rate_limit(client_name, rate):
+    if rate > 0:
+        limiter = RateLimiter(rate)
+        main.clients.wrap(client_name, lambda client: RateLimitedClient(client, limiter))
+
+
+def find_inputs(source):
+    if os.path.isdir(source):
+        paths = [os.path.join(source, name) for name in sorted(os.listdir(source))]
+    else:
+        with open(source) as manifest:
+            paths = [line.strip() for line in manifest if line.strip() and not line.startswith('#')]
+    return [path for path in paths if main.allowed_file(os.path.basename(path))]
+
+
+def import_name(path, audio_data):
+    """
+    The recording name for path: its own if it is already in the STT folder,
+    else one from its content, so a restarted run finds what it imported.
+    """
+    filename = os.path.basename(path)
+    if os.path.abspath(path) == os.path.abspath(path_for(main.STT_FOLDER, filename)):
+        return filename
+    return f"import_{hashlib.sha256(audio_data).hexdigest()[:32]}.wav"
+
+
+def import_file(path, force):
+    with open(path, 'rb') as f:
+        audio_data = f.read()
+    filename = import_name(path, audio_data)
+    if not force and load_fields(main.stt_store, filename) is not None:
+        return 'skipped', 0.0
+
+    if not main.stt_store.exists(filename):
+        main.stt_store.write(filename, audio_data)
+    main.recordings_index.add(filename)
+
+    duration = audio_duration(audio_data)
+    audio_data = main.prepare_audio(filename, audio_data)
+    # Raises LLMError instead of returning an error transcript, so nothing is persisted
+    transcript, sentiment_label, sentiment_score = main.transcribe_with_llm(audio_data)
+    main.save_results(filename, transcript, sentiment_label, sentiment_score, duration=duration,
+                      source=os.path.abspath(path))
+    return 'processed', duration or 0.0
+
+
+def run(source, workers=4, llm_rate=0.0, force=False):
+    paths = find_inputs(source)
+    rate_limit('gemini', llm_rate)
+    counts = {'processed': 0, 'skipped': 0, 'failed': 0}
+    audio_seconds = 0.0
+
+    print(f"Processing {len(paths)} files with {workers} workers...")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(import_file, path, force): path for path in paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                status, seconds = future.result()
+            except Exception as e:
+                print(f"FAILED {path}: {e}")
+                counts['failed'] += 1
+                continue
+            counts[status] += 1
+            audio_seconds += seconds
+            if status == 'processed':
+                print(f"Processed {path} ({seconds:.1f}s of audio)")
+    elapsed = time.perf_counter() - start
+
+    print(f"Done in {elapsed:.1f}s: {counts['processed']} processed, "
+          f"{counts['skipped']} skipped, {counts['failed']} failed")
+    if elapsed > 0:
+        print(f"Throughput: {counts['processed'] / elapsed:.2f} files/s, "
+              f"{audio_seconds / elapsed:.2f} audio-seconds/s")
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bulk import and re-process WAV recordings.")
+    parser.add_argument('source', help="directory of .wav files or a manifest with one path per line")
+    parser.add_argument('--workers', type=int, default=4, help="concurrent files")
+    parser.add_argument('--llm-rate', type=float, default=0.0,
+                        help="max Gemini calls per second (0 = unlimited)")
+    parser.add_argument('--force', action='store_true', help="re-process files that already have results")
+    args = parser.parse_args()
+
+    counts = run(args.source, args.workers, args.llm_rate, args.force)
+    sys.exit(1 if counts['failed'] else 0)
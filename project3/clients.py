@@ -0,0 +1,97 @@
+"""
+Lazily created, process-wide cloud clients.
+
+Clients are registered with a factory and only built on first use (or by the
+background warm-up), so importing the app stays fast and a backend that fails
+to initialize only breaks the routes that need it. Each client is created
+once and shared by every thread; the Google clients are thread-safe and
+multiplex requests over their gRPC channel.
+"""
+import threading
+import time
+
+
+class ClientUnavailable(Exception):
+    pass
+
+
+class ClientRegistry:
+    def __init__(self, retry_after=30):
+        self.retry_after = retry_after  # seconds before retrying a failed factory
+        self._factories = {}
+        self._clients = {}
+        self._errors = {}  # name -> (error, failed_at)
+        self._timings = {}  # name -> seconds spent in the factory
+        self._lock = threading.Lock()
+
+    def register(self, name, factory):
+        self._factories[name] = factory
+
+    def get(self, name):
+        client = self._clients.get(name)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(name)
+            if client is not None:
+                return client
+            error = self._errors.get(name)
+            if error and time.time() - error[1] < self.retry_after:
+                raise ClientUnavailable(f"{name} client failed to initialize: {error[0]}")
+            start = time.perf_counter()
+            try:
+                client = self._factories[name]()
+            except Exception as e:
+                print(f"Could not create {name} client: {e}")
+                self._errors[name] = (e, time.time())
+                raise ClientUnavailable(f"{name} client failed to initialize: {e}") from e
+            self._timings[name] = time.perf_counter() - start
+            self._errors.pop(name, None)
+            self._clients[name] = client
+            print(f"Created {name} client in {self._timings[name] * 1000:.0f} ms")
+            return client
+
+    def wrap(self, name, wrapper):
+        """Hands out wrapper(client) for name from now on, e.g. to rate limit a batch job's calls."""
+        with self._lock:
+            factory = self._factories[name]
+            self._factories[name] = lambda: wrapper(factory())
+            if name in self._clients:
+                self._clients[name] = wrapper(self._clients[name])
+
+    def lazy(self, name):
+        """A stand-in that creates the client the first time an attribute is used."""
+        return LazyClient(self, name)
+
+    def warm_up(self, delay=0.0):
+        """Creates all registered clients on a background thread after delay seconds."""
+        def run():
+            time.sleep(delay)
+            for name in list(self._factories):
+                try:
+                    self.get(name)
+                except ClientUnavailable:
+                    pass
+        thread = threading.Thread(target=run, name='client-warmup', daemon=True)
+        thread.start()
+        return thread
+
+    def status(self):
+        status = {}
+        for name in self._factories:
+            if name in self._clients:
+                status[name] = {'state': 'ready', 'init_seconds': round(self._timings[name], 3)}
+            elif name in self._errors:
+                status[name] = {'state': 'error', 'error': str(self._errors[name][0])}
+            else:
+                status[name] = {'state': 'not created'}
+        return status
+
+
+class LazyClient:
+    def __init__(self, registry, name):
+        self._registry = registry
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(self._registry.get(self._name), attr)
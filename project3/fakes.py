@@ -0,0 +1,148 @@
+"""
+Local stand-in for the Vertex AI Gemini model so the app can run and be
+load-tested offline. Enable with USE_FAKE_CLIENTS=1. FakeS3Client stands in
+for an S3/MinIO archive with STORAGE_BACKEND=s3, keeping the objects under
+FAKE_S3_FOLDER.
+
+Every call sleeps for a latency drawn from FAKE_LATENCY_DIST (fixed, uniform,
+exponential or lognormal, all with mean FAKE_LATENCY) and then fails with
+probability FAKE_ERROR_RATE.
+
+FAKE_BROWNOUT=<period>,<length>,<slowdown>,<error rate> injects a recurring
+brownout: for the first <length> seconds of every <period>, calls take
+<slowdown> times as long and fail with <error rate> instead (e.g. 60,20,10,0.5).
+"""
+import asyncio
+import hashlib
+import io
+import json
+import math
+import os
+import random
+import time
+from types import SimpleNamespace
+
+FAKE_LATENCY = float(os.environ.get('FAKE_LATENCY', 1.0)) # Mean seconds per call
+FAKE_LATENCY_DIST = os.environ.get('FAKE_LATENCY_DIST', 'fixed')
+FAKE_ERROR_RATE = float(os.environ.get('FAKE_ERROR_RATE', 0.0)) # 0.0 - 1.0
+# Extra latency per second of audio, 0.1 = ten times faster than real time
+FAKE_SECONDS_PER_AUDIO_SECOND = float(os.environ.get('FAKE_SECONDS_PER_AUDIO_SECOND', 0.0))
+BYTES_PER_AUDIO_SECOND = 32000 # 16 kHz 16-bit mono
+FAKE_S3_FOLDER = os.environ.get('FAKE_S3_FOLDER', 'uploads/fake_s3')
+FAKE_BROWNOUT = os.environ.get('FAKE_BROWNOUT')
+
+
+def _latency():
+    if FAKE_LATENCY <= 0:
+        return 0.0
+    if FAKE_LATENCY_DIST == 'uniform':
+        return random.uniform(0, 2 * FAKE_LATENCY)
+    if FAKE_LATENCY_DIST == 'exponential':
+        return random.expovariate(1 / FAKE_LATENCY)
+    if FAKE_LATENCY_DIST == 'lognormal':
+        # Sigma 1 gives a long tail, mu chosen so the mean stays FAKE_LATENCY
+        return random.lognormvariate(math.log(FAKE_LATENCY) - 0.5, 1.0)
+    return FAKE_LATENCY
+
+
+_STARTED = time.monotonic()
+
+
+def _faults():
+    """(latency multiplier, error rate) right now, see FAKE_BROWNOUT."""
+    if FAKE_BROWNOUT:
+        period, length, slowdown, error_rate = (float(value) for value in FAKE_BROWNOUT.split(','))
+        if (time.monotonic() - _STARTED) % period < length:
+            return slowdown, error_rate
+    return 1.0, FAKE_ERROR_RATE
+
+
+def _simulate_call():
+    slowdown, error_rate = _faults()
+    time.sleep(_latency() * slowdown)
+    if random.random() < error_rate:
+        raise RuntimeError("Injected fake backend error")
+
+
+class FakeGenerativeModel:
+    """
+    Answers generate_content([audio_part, prompt]) like Gemini would: JSON when a
+    generation_config (response schema) is passed, the plain text format otherwise.
+    generate_content_async is the same for the ASGI mode (see asgi.py).
+    """
+
+    def generate_content(self, contents, generation_config=None):
+        # contents[0] is a vertexai Part built with Part.from_data
+        data = contents[0].inline_data.data
+        slowdown, error_rate = _faults()
+        time.sleep((_latency() + len(data) / BYTES_PER_AUDIO_SECOND * FAKE_SECONDS_PER_AUDIO_SECOND) * slowdown)
+        return self._answer(data, generation_config, error_rate)
+
+    async def generate_content_async(self, contents, generation_config=None):
+        data = contents[0].inline_data.data
+        slowdown, error_rate = _faults()
+        await asyncio.sleep((_latency() + len(data) / BYTES_PER_AUDIO_SECOND * FAKE_SECONDS_PER_AUDIO_SECOND) * slowdown)
+        return self._answer(data, generation_config, error_rate)
+
+    def _answer(self, data, generation_config, error_rate):
+        if random.random() < error_rate:
+            raise RuntimeError("Injected fake backend error")
+
+        # Deterministic per audio so repeated runs are comparable
+        digest = hashlib.sha256(data).digest()
+        score = (digest[0] - 128) / 128.0
+        label = 'positive' if score > 0.1 else 'negative' if score < -0.1 else 'neutral'
+        transcript = f"fake transcript of {len(data)} bytes"
+        if generation_config is not None:
+            text = json.dumps({'transcript': transcript, 'sentiment_label': label,
+                               'sentiment_score': round(score, 2)})
+        else:
+            text = (f"Text: {transcript}\n"
+                    f"Sentiment Label: {label}\n"
+                    f"Sentiment Score: {score:.2f}\n")
+        return SimpleNamespace(text=text)
+
+
+class _FakeS3Error(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.response = {'Error': {'Code': code, 'Message': message}}  # as on botocore's ClientError
+
+
+class FakeS3Client:
+    """S3 subset used by storage.S3Backend, objects are files under <folder>/<bucket>/<key>."""
+
+    def __init__(self, folder=None):
+        self.folder = folder or FAKE_S3_FOLDER
+
+    def _path(self, bucket, key):
+        return os.path.join(self.folder, bucket, *key.split('/'))
+
+    def put_object(self, Bucket=None, Key=None, Body=b''):
+        _simulate_call()
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(Body)
+        os.replace(path + '.tmp', path)
+        return {}
+
+    def get_object(self, Bucket=None, Key=None, Range=None):
+        _simulate_call()
+        try:
+            with open(self._path(Bucket, Key), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            raise _FakeS3Error('NoSuchKey', f"The specified key does not exist: {Key}") from None
+        if Range:
+            start, _, end = Range[len('bytes='):].partition('-')
+            data = data[int(start):int(end) + 1 if end else None]
+        return {'Body': io.BytesIO(data), 'ContentLength': len(data)}
+
+    def delete_object(self, Bucket=None, Key=None):
+        _simulate_call()
+        try:
+            os.remove(self._path(Bucket, Key))
+        except FileNotFoundError:
+            pass
+        return {}
@@ -0,0 +1,179 @@
+"""
+Collision-free, sortable names for uploaded and generated files, and the
+sharded directory layout they are stored in.
+
+An ID looks like 20261018-101448-0K5Q3Z8M1T2VWX7A: the UTC second it was
+allocated (readable, and sorting after the older local-time names) followed by
+16 Crockford base32 characters holding 80 bits, as in a ULID:
+
+    milliseconds (10 bits) | process node (30 bits) | sequence (40 bits)
+
+The node is random per process and re-drawn after a fork, so gunicorn/uvicorn
+workers differ. The sequence counts up within a millisecond and the clock is
+never allowed to go backwards, so IDs from one process are strictly
+increasing. Two processes can only produce the same ID if they drew the same
+node and allocate in the same millisecond with the same sequence number.
+
+Files are stored as <folder>/<YYYYMMDD>/<HHMM>/<name>, so a directory only
+holds one minute of files (100,000 entries would take ~1,700 uploads/s for a
+whole minute) and a day directory at most 1440 minutes. Names without an ID
+(uploads from before, bulk imports) stay directly in <folder>. A day moved
+to the archive by compaction.py keeps only <folder>/<YYYYMMDD>/archive.json,
+whose names are listed as if the files were still there. See stress_ids.py
+for the concurrency check.
+"""
+import base64
+import calendar
+import json
+import os
+import re
+import threading
+import time
+
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'  # Crockford base32, no I L O U
+NODE_BITS = 30
+SEQUENCE_BITS = 40
+# an ID anywhere a name starts, optionally after a prefix such as "audio_"
+ID_PATTERN = re.compile(r'^(?:[A-Za-z]+_)?(\d{8})-(\d{4})\d{2}-[0-9A-HJKMNP-TV-Z]{16}')
+ARCHIVE_CATALOG = 'archive.json'  # names of a day's archived files and where they are, see storage.py
+
+
+# 80 bits are exactly 16 base32 characters, so b32encode needs no padding, only the alphabet swapped
+_TO_CROCKFORD = bytes.maketrans(b'ABCDEFGHIJKLMNOPQRSTUVWXYZ234567', ALPHABET.encode('ascii'))
+
+
+def _base32(value):
+    return base64.b32encode(value.to_bytes(10, 'big')).translate(_TO_CROCKFORD).decode('ascii')
+
+
+class IdAllocator:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._sequence = 0
+        self._stamp = (None, '')  # (second, formatted) so strftime runs once a second
+        self.node = int.from_bytes(os.urandom(4), 'big') >> (32 - NODE_BITS)
+
+    def reseed(self):
+        """Draws a new node, called in forked children so workers never share one."""
+        self._lock = threading.Lock()
+        self.node = int.from_bytes(os.urandom(4), 'big') >> (32 - NODE_BITS)
+
+    def new_id(self, now=None):
+        now_ms = int((time.time() if now is None else now) * 1000)
+        with self._lock:
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._sequence = 0
+            else:
+                # same millisecond, or the clock stepped back: stay on the last one
+                self._sequence += 1
+                if self._sequence >> SEQUENCE_BITS:
+                    self._last_ms += 1
+                    self._sequence = 0
+            ms, sequence = self._last_ms, self._sequence
+        seconds, millis = divmod(ms, 1000)
+        second, stamp = self._stamp
+        if second != seconds:
+            stamp = time.strftime('%Y%m%d-%H%M%S-', time.gmtime(seconds))
+            self._stamp = (seconds, stamp)
+        return stamp + _base32((millis << (NODE_BITS + SEQUENCE_BITS)) | (self.node << SEQUENCE_BITS) | sequence)
+
+
+_allocator = IdAllocator()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_allocator.reseed)
+
+
+def new_id():
+    return _allocator.new_id()
+
+
+def relative_path(filename):
+    """'20261018-101448-<tail>.wav' -> '20261018/1014/20261018-101448-<tail>.wav', other names as they are."""
+    match = ID_PATTERN.match(filename)
+    if match is None:
+        return filename
+    return os.path.join(match.group(1), match.group(2), filename)
+
+
+def day_of(filename):
+    """'20261018' for an ID name, None for other names."""
+    match = ID_PATTERN.match(filename)
+    return match.group(1) if match else None
+
+
+def time_of(filename):
+    """Unix time of the UTC minute an ID name was allocated in, None for other names."""
+    match = ID_PATTERN.match(filename)
+    if match is None:
+        return None
+    return calendar.timegm(time.strptime(match.group(1) + match.group(2), '%Y%m%d%H%M'))
+
+
+def archived_names(day_path):
+    """Names in a day directory's archive catalogue, [] if the day isn't archived."""
+    try:
+        with open(os.path.join(day_path, ARCHIVE_CATALOG), 'r', encoding='utf-8') as f:
+            return list(json.load(f)['files'])
+    except (OSError, ValueError, KeyError):
+        return []
+
+
+def path_for(folder, filename, create=False):
+    """Where filename is stored in folder, creating its shard directory if asked."""
+    path = os.path.join(folder, relative_path(filename))
+    if create:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def walk(folder):
+    """Yields the name of every file in folder and its shard directories."""
+    for entry in os.scandir(folder):
+        if entry.is_file():
+            yield entry.name
+        elif entry.is_dir() and len(entry.name) == 8 and entry.name.isdigit():
+            yield from archived_names(entry.path)
+            for minute in os.scandir(entry.path):
+                if minute.is_dir():
+                    for file in os.scandir(minute.path):
+                        if file.is_file():
+                            yield file.name
+
+
+def newest(folder, keep, cursor=None, limit=None):
+    """
+    Names in folder (and its shards) for which keep(name) is true, newest
+    first, starting after cursor. With a limit only the newest shard
+    directories are read: every name in a shard sorts above every name in
+    an older one, so once limit names are found the rest can be skipped.
+    """
+    names, days = [], []
+    for entry in os.scandir(folder):
+        if entry.is_file():
+            if keep(entry.name) and (not cursor or entry.name < cursor):
+                names.append(entry.name)
+        elif entry.is_dir() and len(entry.name) == 8 and entry.name.isdigit():
+            days.append(entry)
+
+    found = 0
+    for day in sorted(days, key=lambda entry: entry.name, reverse=True):
+        if limit is not None and found >= limit:
+            break
+        for name in archived_names(day.path):
+            if keep(name) and (not cursor or name < cursor):
+                names.append(name)
+                found += 1
+        minutes = [entry for entry in os.scandir(day.path) if entry.is_dir()]
+        for minute in sorted(minutes, key=lambda entry: entry.name, reverse=True):
+            if limit is not None and found >= limit:
+                break
+            if cursor and cursor < f"{day.name}-{minute.name}":
+                continue  # every name in this shard sorts after the cursor
+            for entry in os.scandir(minute.path):
+                if entry.is_file() and keep(entry.name) and (not cursor or entry.name < cursor):
+                    names.append(entry.name)
+                    found += 1
+    names.sort(reverse=True)
+    return names if limit is None else names[:limit]
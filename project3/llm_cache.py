@@ -0,0 +1,77 @@
+"""
+Persistent cache of parsed LLM results (transcript, label, score), keyed by
+the audio content hash, the prompt version and the model name so a prompt or
+model change never serves stale answers.
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_results (
+    key TEXT PRIMARY KEY,
+    transcript TEXT NOT NULL,
+    sentiment_label TEXT NOT NULL,
+    sentiment_score REAL NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS llm_results_last_used ON llm_results (last_used);
+"""
+
+
+def cache_key(audio_bytes, prompt_version, model_name):
+    digest = hashlib.sha256(audio_bytes).hexdigest()
+    return f"{model_name}:{prompt_version}:{digest}"
+
+
+class LLMCache:
+    def __init__(self, path, ttl=30 * 24 * 3600, max_entries=10000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        # sqlite connections can't be shared between threads, keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """Returns the cached (transcript, label, score) tuple or None."""
+        now = time.time()
+        with self._conn() as conn:
+            row = conn.execute(
+                "SELECT transcript, sentiment_label, sentiment_score, created FROM llm_results WHERE key = ?",
+                (key,)).fetchone()
+            if row is None or now - row[3] > self.ttl:
+                if row is not None:
+                    conn.execute("DELETE FROM llm_results WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            conn.execute("UPDATE llm_results SET last_used = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return row[0], row[1], row[2]
+
+    def put(self, key, transcript, sentiment_label, sentiment_score):
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_results "
+                "(key, transcript, sentiment_label, sentiment_score, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, transcript, sentiment_label, sentiment_score, now, now))
+            # drop expired rows, then the least recently used ones over the limit
+            conn.execute("DELETE FROM llm_results WHERE created < ?", (now - self.ttl,))
+            conn.execute(
+                "DELETE FROM llm_results WHERE key IN ("
+                "SELECT key FROM llm_results ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,))
@@ -0,0 +1,138 @@
+"""
+Parsing of Gemini's transcript + sentiment answers.
+
+With structured output enabled, Gemini answers with JSON matching
+RESPONSE_SCHEMA, and parse_llm_response() only needs json.loads. Anything else
+goes through one scan of a precompiled field-header regex. That covers the
+older "Text: / Sentiment Label: / Sentiment Score:" layout, a model ignoring
+the schema, and answers wrapped in code fences or markdown. Each field's value
+runs until the next header, so multi-line transcripts are kept whole.
+
+See bench_llm_parser.py for the benchmark and fuzz checks against the old
+regex parser.
+"""
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# OpenAPI-style schema accepted by GenerationConfig(response_schema=...)
+RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "transcript": {"type": "STRING"},
+        "sentiment_label": {"type": "STRING", "enum": ["positive", "neutral", "negative"]},
+        "sentiment_score": {"type": "NUMBER"},
+    },
+    "required": ["transcript", "sentiment_label", "sentiment_score"],
+}
+
+DEFAULT_TRANSCRIPT = "Error: Could not parse transcript."
+EMPTY_TRANSCRIPT = "[Empty Transcript Received]"
+LABELS = {'positive': 'Positive', 'negative': 'Negative', 'neutral': 'Neutral'}
+
+# A field header at the start of a line, optionally bulleted, quoted or in markdown bold
+_FIELD = re.compile(
+    r'^[ \t>*_#-]*(text|transcript(?:ion)?|sentiment[ _]?label|sentiment[ _]?score)[ \t*_]*:[ \t*_]*',
+    re.IGNORECASE | re.MULTILINE)
+_LABEL = re.compile(r'positive|negative|neutral', re.IGNORECASE)
+_NUMBER = re.compile(r'[-+]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?')
+
+
+def _field_key(name):
+    name = name.lower()
+    if name.startswith(('text', 'transcript')):
+        return 'transcript'
+    return 'label' if name.endswith('label') else 'score'
+
+
+def _label(value):
+    if value is None:
+        return None
+    label = LABELS.get(str(value).strip().lower())
+    if label is not None:
+        return label
+    match = _LABEL.search(str(value))
+    return LABELS[match.group(0).lower()] if match else None
+
+
+def _score(value):
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        score = float(value)
+    except (TypeError, ValueError):
+        # Tolerate trailing commentary such as "-0.35 (moderately negative)"
+        match = _NUMBER.search(str(value))
+        if not match:
+            return None
+        score = float(match.group(0))
+    if score != score:  # NaN
+        return None
+    return max(-1.0, min(1.0, score))
+
+
+def _finish(transcript, label, score):
+    """Applies defaults: a missing label follows the score, a missing score is 0.0."""
+    if transcript is None:
+        logger.warning("Transcript field not found in LLM response")
+        transcript = DEFAULT_TRANSCRIPT
+    else:
+        transcript = transcript.strip().strip('"').strip("'").strip()
+        if not transcript:
+            transcript = EMPTY_TRANSCRIPT
+    if score is None:
+        logger.warning("Sentiment score missing or invalid in LLM response")
+        score = 0.0
+    if label is None:
+        logger.warning("Sentiment label missing or invalid in LLM response")
+        label = "Positive" if score > 0.1 else "Negative" if score < -0.1 else "Neutral"
+    return transcript, label, score
+
+
+def parse_json(llm_text):
+    """Parses a structured (JSON) answer, or returns None if it isn't one."""
+    try:
+        data = json.loads(llm_text)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    transcript = data.get('transcript', data.get('text'))
+    if transcript is not None and not isinstance(transcript, str):
+        transcript = str(transcript)
+    return _finish(transcript,
+                   _label(data.get('sentiment_label', data.get('label'))),
+                   _score(data.get('sentiment_score', data.get('score'))))
+
+
+def parse_fields(llm_text):
+    """Single-pass parse of the 'Text: / Sentiment Label: / Sentiment Score:' layout."""
+    values = {}
+    matches = list(_FIELD.finditer(llm_text))
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(llm_text)
+        # The first occurrence of a field wins, later repeats are usually the model rambling
+        values.setdefault(_field_key(match.group(1)), llm_text[match.end():end])
+    return _finish(values.get('transcript'), _label(values.get('label')), _score(values.get('score')))
+
+
+def _strip_fence(llm_text):
+    """Removes a ```/```json code fence around the answer."""
+    if llm_text.startswith('```'):
+        newline = llm_text.find('\n')
+        llm_text = llm_text[newline + 1:] if newline != -1 else llm_text[3:]
+    if llm_text.endswith('```'):
+        llm_text = llm_text[:-3]
+    return llm_text.strip()
+
+
+def parse_llm_response(llm_text):
+    """Returns (transcript, label, score) with label in Positive/Neutral/Negative and score in [-1, 1]."""
+    llm_text = _strip_fence((llm_text or '').strip())
+    if llm_text.startswith('{'):
+        result = parse_json(llm_text)
+        if result is not None:
+            return result
+    return parse_fields(llm_text)
@@ -1,35 +1,165 @@
+import time
+STARTUP_BEGAN = time.perf_counter() # Before the heavy imports, see STARTUP_SECONDS
+
+import hashlib
+import json
 import os
-import re 
-from datetime import datetime
 
-from flask import Flask, render_template, request, redirect, url_for, send_file, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, jsonify, Response, g
+from werkzeug.utils import secure_filename
 
 # --- Vertex AI Imports ---
 import vertexai
-from vertexai.generative_models import GenerativeModel, Part
+from vertexai.generative_models import GenerationConfig, GenerativeModel, Part
+
+import fakes
+from changes import ChangeLog
+from clients import ClientRegistry, ClientUnavailable
+from compaction import Compactor
+from ids import new_id
+from ingest import MultipartUpload, UploadError
+from llm_cache import LLMCache, cache_key
+from llm_parser import DEFAULT_TRANSCRIPT, RESPONSE_SCHEMA, parse_llm_response
+from media import MediaServer, file_etag, send_text
+from metrics import Metrics, RequestProfiler
+from preprocess import log_stats, preprocess
+from recording_meta import audio_duration, load_record, record_name, write_record
+from recordings_index import RecordingIndex
+from resilience import AIMDLimit, Backend, BackendUnavailable, reset_deadline, set_deadline
+from sentiment_stats import BUCKETS, HISTOGRAM_BINS, parse_time
+from storage import STORAGE_BACKEND, TieredStore, open_archive, s3_client
 
 app = Flask(__name__)
 
 # --- Configuration ---
 STT_FOLDER = 'uploads/stt' 
 ALLOWED_EXTENSIONS = {'wav'}
+PAGE_SIZE = 20 # Recordings rendered per page / infinite scroll batch
+MAX_PAGE_SIZE = 100
 app.config['STT_FOLDER'] = STT_FOLDER
 
+# Largest accepted recording, werkzeug rejects bigger request bodies with a 413
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 50 * 1024 * 1024))
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES + 64 * 1024 # Room for multipart overhead
+# Reject uploads that are not WAV or the browser recorder's WebM/Ogg, set VALIDATE_WAV_HEADER=0 to accept anything
+VALIDATE_WAV_HEADER = os.environ.get('VALIDATE_WAV_HEADER', '1') != '0'
+
 # --- Vertex AI Configuration ---
 PROJECT_ID = 'conversational-ai-448621'
 LOCATION = 'us-east1' 
 MODEL_NAME = 'gemini-1.5-flash-001'
 
+# --- LLM Prompt ---
+# Ask for JSON matching RESPONSE_SCHEMA, set LLM_STRUCTURED_OUTPUT=0 to use the plain text format
+LLM_STRUCTURED_OUTPUT = os.environ.get('LLM_STRUCTURED_OUTPUT', '1') != '0'
+
+LLM_PROMPT_JSON = """Please provide an exact transcript for the audio, followed by sentiment analysis including a label and a numerical score.
+
+Respond with a JSON object with these fields:
+transcript: the user's speech, transcribed exactly, keeping line breaks between sentences or speakers
+sentiment_label: positive, neutral or negative
+sentiment_score: a float between -1.0 and 1.0
+"""
+
+LLM_PROMPT_TEXT = """Please provide an exact transcript for the audio, followed by sentiment analysis including a label and a numerical score.
+
+Your response MUST follow this exact format, with each item on a new line:
+
+Text: [USERS SPEECH TRANSCRIPTION HERE]
+Sentiment Label: [positive|neutral|negative]
+Sentiment Score: [SENTIMENT SCORE AS A FLOAT BETWEEN -1.0 AND 1.0 HERE]
+"""
+
+LLM_PROMPT = LLM_PROMPT_JSON if LLM_STRUCTURED_OUTPUT else LLM_PROMPT_TEXT
+GENERATION_CONFIG = GenerationConfig(response_mime_type="application/json",
+                                     response_schema=RESPONSE_SCHEMA) if LLM_STRUCTURED_OUTPUT else None
+
+# Part of the LLM cache key, so editing the prompt invalidates old results
+PROMPT_VERSION = hashlib.sha256(LLM_PROMPT.encode('utf-8')).hexdigest()[:12]
+
+# --- Audio Preprocessing ---
+# Downmix/resample/trim before sending to the LLM, set PREPROCESS_AUDIO=0 to send uploads untouched
+PREPROCESS_AUDIO = os.environ.get('PREPROCESS_AUDIO', '1') != '0'
+PREPROCESS_LOG = 'uploads/preprocess_stats.jsonl'
+
+# --- LLM Result Cache ---
+LLM_CACHE_PATH = 'uploads/llm_cache.db'
+LLM_CACHE_TTL = int(os.environ.get('LLM_CACHE_TTL', 30 * 24 * 3600)) # Seconds
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', 10000))
+
+# --- Backend Resilience ---
+# Gemini calls go through a Backend: an adaptive concurrency limit, a circuit breaker, the
+# request's deadline and retries, so a Vertex brownout sheds uploads with a 503 (see resilience.py)
+REQUEST_DEADLINE = float(os.environ.get('REQUEST_DEADLINE', 120)) # Seconds, X-Request-Timeout can ask for less
+BACKEND_CONCURRENCY = int(os.environ.get('BACKEND_CONCURRENCY', 8)) # Starting limit, it adapts from there
+
+# --- Metrics ---
+# Per-stage latency, error and in-flight metrics, scraped from /metrics
+metrics = Metrics(prefix='stt_app')
+# Set PROFILE_SLOW_REQUESTS=<seconds> to keep cProfile dumps of requests slower than that
+PROFILE_SLOW_REQUESTS = float(os.environ.get('PROFILE_SLOW_REQUESTS', 0))
+PROFILE_FOLDER = 'uploads/profiles'
+
+# --- Media Serving ---
+# Range requests, ETags and long-lived caching for recordings (see media.py)
+# Set MEDIA_TRANSCODE_FORMATS=opus,flac to also offer transcoded audio (needs ffmpeg)
+MEDIA_CACHE_FOLDER = 'uploads/media_cache'
+MEDIA_CACHE_MAX_BYTES = int(os.environ.get('MEDIA_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+MEDIA_TRANSCODE_FORMATS = [f.strip() for f in os.environ.get('MEDIA_TRANSCODE_FORMATS', '').split(',') if f.strip()]
+
 # --- Initialization ---
 os.makedirs(STT_FOLDER, exist_ok=True)
 
-try:
+# New and updated recordings, so pages fetch deltas instead of reloading
+changes = ChangeLog()
+
+# Parsed LLM results by audio hash, prompt version and model
+llm_cache = LLMCache(LLM_CACHE_PATH, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES)
+
+profiler = RequestProfiler(PROFILE_FOLDER, PROFILE_SLOW_REQUESTS) if PROFILE_SLOW_REQUESTS else None
+
+media = MediaServer(MEDIA_CACHE_FOLDER, MEDIA_TRANSCODE_FORMATS, max_cache_bytes=MEDIA_CACHE_MAX_BYTES)
+
+def create_model():
+    """Initializes Vertex AI and builds the Gemini model (called lazily by the client registry)."""
     vertexai.init(project=PROJECT_ID, location=LOCATION)
     model = GenerativeModel(MODEL_NAME)
     print(f"Vertex AI initialized successfully. Project: {PROJECT_ID}, Location: {LOCATION}, Model: {MODEL_NAME}")
-except Exception as e:
-    print(f"FATAL: Could not initialize Vertex AI: {e}")
-    exit()
+    return model
+
+# Vertex AI is initialized on first use and pre-warmed in the background after startup,
+# so a Vertex outage no longer stops the app from booting
+CLIENT_WARMUP_DELAY = float(os.environ.get('CLIENT_WARMUP_DELAY', 1.0))
+clients = ClientRegistry()
+# Set USE_FAKE_CLIENTS=1 to run offline against a local fake model (see fakes.py)
+if os.environ.get('USE_FAKE_CLIENTS'):
+    clients.register('gemini', fakes.FakeGenerativeModel)
+else:
+    clients.register('gemini', create_model)
+# Not hedged: every Gemini call is billed, and a slow one is usually just long audio
+gemini_backend = Backend('gemini', timeout=REQUEST_DEADLINE, limit=AIMDLimit(BACKEND_CONCURRENCY))
+metrics.gauge_callback('backend_gemini', 'Gemini calls, concurrency limit and circuit', gemini_backend.stats)
+
+# --- Storage ---
+# Files are written to STT_FOLDER and moved to the archive once old, see storage.py
+# Set STORAGE_BACKEND=s3 (S3_BUCKET, S3_ENDPOINT_URL) to archive to S3 or MinIO instead of a folder
+if STORAGE_BACKEND == 's3':
+    clients.register('s3', fakes.FakeS3Client if os.environ.get('USE_FAKE_CLIENTS') else s3_client)
+STORAGE_CACHE_FOLDER = 'uploads/storage_cache/stt' # Archived files fetched for reading
+STORAGE_CACHE_MAX_BYTES = int(os.environ.get('STORAGE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+stt_store = TieredStore(STT_FOLDER, open_archive(clients.lazy('s3')), STORAGE_CACHE_FOLDER, STORAGE_CACHE_MAX_BYTES)
+# Days older than COMPACT_AFTER_DAYS are moved to the archive, older than RETAIN_DAYS deleted (0 = never)
+COMPACT_AFTER_DAYS = int(os.environ.get('COMPACT_AFTER_DAYS', 30))
+RETAIN_DAYS = int(os.environ.get('RETAIN_DAYS', 0))
+COMPACT_INTERVAL = float(os.environ.get('COMPACT_INTERVAL', 3600))
+
+# SQLite index of processed recordings, backfilled from disk on first start
+INDEX_PATH = 'uploads/recordings.db'
+# Transcript search ranks at most this many of the newest matches, see RecordingIndex.search
+SEARCH_CANDIDATES = int(os.environ.get('SEARCH_CANDIDATES', 1000))
+recordings_index = RecordingIndex(INDEX_PATH, stt_store, search_candidates=SEARCH_CANDIDATES)
+# Longest range /api/sentiment/stats answers, in buckets (1000 hours is about six weeks)
+STATS_MAX_BUCKETS = int(os.environ.get('STATS_MAX_BUCKETS', 1000))
 
 # --- Helper Functions ---
 
@@ -38,253 +168,286 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def parse_llm_response(llm_text):
+def prepare_audio(filename, audio_bytes):
     """
-    Parses the LLM response to extract transcript, sentiment label, and score.
-    Expects format with each item starting on a new line:
-    Text: [TRANSCRIPT]
-    Sentiment Label: [positive|neutral|negative]
-    Sentiment Score: [SCORE as float between -1 and 1]
+    Downmixes to mono, resamples to 16 kHz and trims silence before the LLM call.
+    The bytes and audio-seconds saved are appended to PREPROCESS_LOG.
     """
-    transcript = "Error: Could not parse transcript."
-    sentiment_label = "neutral" # Default
-    sentiment_score = 0.0      # Default
+    if not PREPROCESS_AUDIO:
+        return audio_bytes
+    with metrics.timer('preprocess'):
+        audio_bytes, stats = preprocess(audio_bytes)
+    if stats:
+        log_stats(PREPROCESS_LOG, filename, stats)
+        print(f"Preprocessed {filename}: saved {stats['bytes_saved']} bytes, {stats['seconds_saved']}s of audio")
+    return audio_bytes
 
-    # Pre-clean the response text (remove potential ``` wrapper)
-    llm_text = llm_text.strip().strip('```').strip()
 
-    try:
-        # Match "Text:" at the start of a line (ignoring leading whitespace), capture the rest of THAT line.
-        text_match = re.search(r"^\s*Text:(.*)", llm_text, re.IGNORECASE | re.MULTILINE)
-
-        # Match "Sentiment Label:" at the start of a line, capture the label, ensure nothing else on the line (except whitespace).
-        label_match = re.search(r"^\s*Sentiment Label:\s*(positive|neutral|negative)\s*$", llm_text, re.IGNORECASE | re.MULTILINE)
-
-        # Match "Sentiment Score:" at the start of a line, capture the score, ensure nothing else on the line (except whitespace).
-        score_match = re.search(r"^\s*Sentiment Score:\s*(-?\d+(\.\d+)?)\s*$", llm_text, re.IGNORECASE | re.MULTILINE)
-
-        if text_match:
-            # Strip leading/trailing whitespace from the captured group
-            transcript = text_match.group(1).strip()
-            # Remove potential leading/trailing quote marks sometimes added by LLMs
-            transcript = transcript.strip('"').strip("'")
-            # Handle potential case where only "Text:" exists with nothing after it
-            if not transcript:
-                transcript = "[Empty Transcript Received]"
-        else:
-             print("Warning: 'Text:' field not found in LLM response.")
-             # Keep default error message in transcript
-
-
-        if label_match:
-            sentiment_label = label_match.group(1).lower() # Ensure lowercase
-        else:
-             # Don't print warning if text_match also failed (likely malformed response)
-             if text_match:
-                 print("Warning: 'Sentiment Label:' field not found or invalid in LLM response.")
-
-
-        if score_match:
-            try:
-                # Extract the score and convert to float
-                raw_score = float(score_match.group(1))
-                # Bound the score between -1.0 and 1.0
-                sentiment_score = max(-1.0, min(1.0, raw_score))
-            except ValueError:
-                 if text_match: # Avoid warning if response is totally malformed
-                    print(f"Warning: Could not parse sentiment score from '{score_match.group(1)}'. Using default 0.0.")
-                    sentiment_score = 0.0 # Default if conversion fails
-        else:
-             if text_match: # Avoid warning if response is totally malformed
-                print("Warning: 'Sentiment Score:' field not found or invalid in LLM response.")
+def cached_llm_result(audio_bytes):
+    """Returns (cache key, cached result or None) for the audio."""
+    key = cache_key(audio_bytes, PROMPT_VERSION, MODEL_NAME)
+    cached = llm_cache.get(key)
+    if cached is not None:
+        print("LLM cache hit, skipping request.")
+        metrics.inc('llm_cache_hits_total', 1, 'LLM results served from the cache')
+    return key, cached
 
 
-    except Exception as e:
-        print(f"Error parsing LLM response: {e}\nRaw Response:\n---\n{llm_text}\n---")
-        # Return defaults but potentially keep the raw text for debugging if parsing fails early
-        transcript = f"Error parsing response: {e}" # Overwrite transcript with error
+def llm_contents(audio_bytes):
+    """Builds the request contents: the audio part followed by the prompt."""
+    return [Part.from_data(data=audio_bytes, mime_type="audio/wav"), LLM_PROMPT]
 
 
-    # Map parsed label string to standardized label for consistency
-    if sentiment_label == "positive":
-        final_label = "Positive"
-    elif sentiment_label == "negative":
-        final_label = "Negative"
-    else: # Includes 'neutral' or parsing errors/missing field
-        final_label = "Neutral"
+class LLMError(Exception):
+    """Gemini gave no usable result. The message is the "Error: ..." text upload_audio saves as the transcript."""
 
-    return transcript, final_label, sentiment_score
 
+def finish_llm_result(key, llm_text):
+    """Parses the LLM answer and caches it. Raises LLMError if it could not be parsed."""
+    with metrics.timer('parse'):
+        result = parse_llm_response(llm_text)
 
-def process_audio_with_llm(audio_bytes):
+    # Never cache failures
+    if result[0] == DEFAULT_TRANSCRIPT:
+        metrics.inc('llm_parse_errors_total', 1, 'LLM responses that could not be parsed')
+        raise LLMError(DEFAULT_TRANSCRIPT)
+    llm_cache.put(key, *result)
+    return result
+
+
+def transcribe_with_llm(audio_bytes):
     """
     Sends audio to Vertex AI Gemini model for transcription and sentiment analysis.
     Returns transcript, sentiment label, and sentiment score.
+    Successful results are cached, so identical audio is only sent once.
+    Raises LLMError when there is no usable result, and BackendUnavailable when
+    Gemini is shedding load, failing or too slow for the request's deadline.
     """
-    if not model:
-        print("Error: Vertex AI Model not initialized.")
-        return "Error: Model not available", "Neutral", 0.0
+    try:
+        model = clients.get('gemini')
+    except ClientUnavailable as e:
+        print(f"Error: Vertex AI Model not initialized. {e}")
+        raise LLMError("Error: Model not available")
+
+    key, cached = cached_llm_result(audio_bytes)
+    if cached is not None:
+        return cached
 
     print("Sending audio to LLM...")
     try:
-        # Create the prompt
-        prompt = """Please provide an exact transcript for the audio, followed by sentiment analysis including a label and a numerical score.
+        # Generate content. The SDK's generate_content takes no timeout, so the backend stops waiting at
+        # the request's deadline and sheds new calls while too many abandoned ones are still running
+        with metrics.timer('llm'):
+            response = gemini_backend.call(
+                lambda timeout: model.generate_content(llm_contents(audio_bytes), generation_config=GENERATION_CONFIG))
 
-Your response MUST follow this exact format, with each item on a new line:
+        print("LLM Response Received.")
+        # print(f"Raw LLM Response Text:\n{response.text}") # Optional: for debugging
+        llm_text = response.text
 
-Text: [USERS SPEECH TRANSCRIPTION HERE]
-Sentiment Label: [positive|neutral|negative]
-Sentiment Score: [SENTIMENT SCORE AS A FLOAT BETWEEN -1.0 AND 1.0 HERE]
-"""
-        # Prepare the audio part
-        audio_file = Part.from_data(data=audio_bytes, mime_type="audio/wav")
+    except BackendUnavailable:
+        raise
+    except Exception as e:
+        print(f"An unexpected error occurred during LLM processing: {e}")
+        raise LLMError(f"Error: Unexpected processing error ({type(e).__name__})")
 
-        # Prepare the request contents
-        contents = [audio_file, prompt]
+    return finish_llm_result(key, llm_text)
 
-        # Generate content
-        response = model.generate_content(contents)
 
-        print("LLM Response Received.")
-        # print(f"Raw LLM Response Text:\n{response.text}") # Optional: for debugging
+def process_audio_with_llm(audio_bytes):
+    """
+    transcribe_with_llm for the upload routes: an LLMError comes back as its
+    "Error: ..." transcript with a neutral sentiment, which is saved so the
+    recording still lists. BackendUnavailable is raised, so the caller can
+    answer 503 instead of saving an error transcript.
+    """
+    try:
+        return transcribe_with_llm(audio_bytes)
+    except LLMError as e:
+        return str(e), "Neutral", 0.0
 
-        # Parse the response
-        return parse_llm_response(response.text)
 
-    except Exception as e:
-        print(f"An unexpected error occurred during LLM processing: {e}")
-        return f"Error: Unexpected processing error ({type(e).__name__})", "Neutral", 0.0
-
-
-def get_stt_files():
-    """Gets list of processed audio files and their sentiment data."""
-    files = []
-    if not os.path.exists(STT_FOLDER):
-        return files
-
-    for filename in os.listdir(STT_FOLDER):
-        # Process only the original audio files, not the derived .txt files
-        if allowed_file(filename):
-            base_filename, ext = os.path.splitext(filename)
-            sent_filename = base_filename + '_sentiment.txt' # Adjusted naming convention
-            sent_filepath = os.path.join(STT_FOLDER, sent_filename)
-
-            sentiment_score = None
-            sentiment_label = None
-
-            if os.path.exists(sent_filepath):
-                try:
-                    with open(sent_filepath, 'r') as f:
-                        lines = f.readlines()
-                        for line in lines:
-                            line = line.strip()
-                            if line.startswith("Sentiment Score:"):
-                                try:
-                                    # Extract score and round for display
-                                    score_str = line.split(":", 1)[1].strip()
-                                    sentiment_score = round(float(score_str), ndigits=2)
-                                except (ValueError, IndexError):
-                                    print(f"Warning: Could not parse score from line in {sent_filename}: {line}")
-                                    sentiment_score = 0.0 # Default on parsing error
-                            elif line.startswith("Sentiment:"):
-                                try:
-                                    sentiment_label = line.split(":", 1)[1].strip()
-                                except IndexError:
-                                     print(f"Warning: Could not parse label from line in {sent_filename}: {line}")
-                                     sentiment_label = "Neutral" # Default on parsing error
-                except IOError as e:
-                    print(f"Error reading sentiment file {sent_filepath}: {e}")
-                    sentiment_label = "Error Reading"
-                    sentiment_score = 0.0
-
-            # Ensure score is float or None for template logic
-            if sentiment_score is not None:
-                sentiment_score = float(sentiment_score)
-
-            files.append({
-                'filename': filename, # The original .wav filename
-                'sentiment_score': sentiment_score,
-                'sentiment_label': sentiment_label
-            })
-
-    # Sort by filename (which includes timestamp), newest first
-    files.sort(key=lambda x: x['filename'], reverse=True)
-    return files
+def get_stt_files(cursor=None, limit=None):
+    """
+    Gets list of processed audio files and their sentiment data, newest first.
+    Pass the last filename of the previous page as cursor to continue after it.
+    """
+    return recordings_index.list(cursor, limit)
+
+
+def paginate(files, limit):
+    """Splits a limit+1 sized fetch into (page, next_cursor)."""
+    if len(files) <= limit:
+        return files, None
+    page = files[:limit]
+    return page, page[-1]['filename']
+
+
+if recordings_index.created:
+    print(f"Backfilled {recordings_index.rebuild(allowed_file)} recordings into {INDEX_PATH}")
+
+def save_results(audio_filename, transcript, sentiment_label, sentiment_score, duration=None, timings=None,
+                 source=None):
+    """Writes the metadata record (transcript, sentiment, duration, timings) and updates the index."""
+    try:
+        with metrics.timer('record_write'):
+            write_record(app.config['STT_FOLDER'], audio_filename, transcript, sentiment_score,
+                         sentiment_label, duration=duration, model=MODEL_NAME, timings=timings, source=source)
+        print(f"Results saved for: {audio_filename}")
+    except IOError as e:
+        print(f"Error saving recording metadata: {e}")
+
+    # Add to the listing and transcript search index
+    with metrics.timer('index_write'):
+        recordings_index.set_sentiment(audio_filename, sentiment_score, sentiment_label, transcript=transcript)
+    changes.publish('stt', audio_filename)
+
 
 # --- Flask Routes ---
 
 @app.route('/')
 def index():
     """Renders the main page with the list of processed audio files."""
-    stt_files = get_stt_files()
+    since = changes.token() # Before listing, so nothing published meanwhile is missed
+    stt_files, stt_cursor = paginate(get_stt_files(limit=PAGE_SIZE + 1), PAGE_SIZE)
     # TTS files are removed
-    return render_template('index.html', stt_files=stt_files)
+    return render_template('index.html', stt_files=stt_files, stt_cursor=stt_cursor, since=since)
+
+@app.route('/api/recordings')
+def api_recordings():
+    """
+    Returns one page of processed recordings as JSON for infinite scrolling,
+    or with ?since=<token> the recordings added or updated after it.
+    """
+    if 'since' in request.args:
+        return recording_changes(request.args['since'])
+    cursor = request.args.get('cursor') or None
+    try:
+        limit = min(max(int(request.args.get('limit', PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+
+    files, next_cursor = paginate(get_stt_files(cursor, limit + 1), limit)
+    return jsonify({'items': files, 'next_cursor': next_cursor})
+
+def recording_changes(since):
+    """Returns the recordings published after the since token, or reset if the page has to reload."""
+    changed, token = changes.since(since)
+    if changed is None:
+        return jsonify({'reset': True, 'since': token})
+    items = []
+    for kind, filename in changed:
+        item = recordings_index.get(filename) or {'filename': filename, 'removed': True}
+        items.append(dict(item, kind=kind))
+    return jsonify({'items': items, 'since': token})
+
+@app.route('/search')
+def search():
+    """Returns recordings whose transcript matches q, best first, with highlighted snippets."""
+    q = request.args.get('q', '')
+    label = request.args.get('label', '').capitalize() or None
+    if label is not None and label not in ('Positive', 'Neutral', 'Negative'):
+        return jsonify({'error': 'label must be Positive, Neutral or Negative'}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        offset = max(int(request.args.get('offset', 0)), 0)
+        min_score = float(request.args['min_score']) if request.args.get('min_score') else None
+        max_score = float(request.args['max_score']) if request.args.get('max_score') else None
+    except ValueError:
+        return jsonify({'error': 'limit and offset must be integers, min_score and max_score numbers'}), 400
+
+    # One extra result tells whether there is another page
+    results = recordings_index.search(q, label, min_score, max_score, limit=limit + 1, offset=offset)
+    next_offset = offset + limit if len(results) > limit else None
+    return jsonify({'items': results[:limit], 'next_offset': next_offset})
+
+@app.route('/api/sentiment/stats')
+def api_sentiment_stats():
+    """
+    Returns sentiment per hour or day (?bucket=, default day) from ?from= to ?to=
+    (unix seconds or ISO 8601, default the last 30 buckets up to now): count, sum,
+    mean, min, max, label counts and a score histogram per bucket and in total.
+    Read from the rollups the index keeps (see sentiment_stats.py), never the recordings.
+    """
+    bucket = request.args.get('bucket', 'day')
+    if bucket not in BUCKETS:
+        return jsonify({'error': 'bucket must be hour or day'}), 400
+    try:
+        end = parse_time(request.args['to']) if request.args.get('to') else int(time.time()) + 1
+        start = parse_time(request.args['from']) if request.args.get('from') else end - 30 * BUCKETS[bucket]
+    except ValueError:
+        return jsonify({'error': 'from and to must be unix seconds or ISO 8601 times'}), 400
+    if end <= start:
+        return jsonify({'error': 'to must be after from'}), 400
+    if (end - start) / BUCKETS[bucket] > STATS_MAX_BUCKETS:
+        return jsonify({'error': f'at most {STATS_MAX_BUCKETS} buckets, use a shorter range or bucket=day'}), 400
+
+    with metrics.timer('sentiment_stats'):
+        stats = recordings_index.sentiment_rollup(start, end, bucket)
+    return jsonify({'from': start, 'to': end, 'bucket': bucket, 'bucket_seconds': BUCKETS[bucket],
+                    'histogram_bins': HISTOGRAM_BINS, **stats})
 
 @app.route('/upload', methods=['POST'])
 def upload_audio():
     """Handles audio upload, processing via LLM, and saving results."""
-    if 'audio_data' not in request.files:
-        #flash('No audio data part in the request.')
-        return redirect(url_for('index'))
-
-    file = request.files['audio_data']
+    # Generate a unique, time-sortable filename, stored in its minute's shard
+    audio_filename = f"audio_{new_id()}.wav"
+    audio_filepath = stt_store.new_path(audio_filename)
 
-    if file.filename == '':
-        #flash('No selected file.')
+    try:
+        # Stream the body straight to disk, request.files would spool it to a temporary file first
+        with metrics.timer('save'), MultipartUpload(request.content_type, 'audio_data', audio_filepath,
+                                                    MAX_UPLOAD_BYTES, validate=VALIDATE_WAV_HEADER,
+                                                    keep=True) as upload:
+            upload.read_from(request.stream)
+            if upload.filename and not allowed_file(upload.filename):
+                raise UploadError("Invalid file type. Only .wav files are allowed.")
+            upload.finish()
+        audio_data = upload.data # Kept while streaming, so the file is not read back
+    except UploadError as e:
+        print(f"Rejecting upload: {e}")
+        return str(e), e.status
+    except OSError as e:
+        print(f"Error saving uploaded audio: {e}")
         return redirect(url_for('index'))
 
-    if file and allowed_file(file.filename): # Check if file exists and has allowed extension
-        # Generate a secure filename based on timestamp
-        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
-        filename_base = f"audio_{timestamp}"
-        audio_filename = f"{filename_base}.wav"
-        audio_filepath = os.path.join(app.config['STT_FOLDER'], audio_filename)
-
-        try:
-            # Save the uploaded audio file
-            file.save(audio_filepath)
-            print(f"Audio file saved to: {audio_filepath}")
-
-            # Read the audio data for processing
-            with open(audio_filepath, 'rb') as f_audio:
-                audio_data = f_audio.read()
-
-            # Process with LLM
-            transcript, sentiment_label, sentiment_score = process_audio_with_llm(audio_data)
-
-            # Define paths for output files
-            txt_filename = f"{filename_base}.txt"
-            sentiment_filename = f"{filename_base}_sentiment.txt" # Use base name
-            txt_filepath = os.path.join(app.config['STT_FOLDER'], txt_filename)
-            sentiment_filepath = os.path.join(app.config['STT_FOLDER'], sentiment_filename)
-
-            # Save the transcript
-            try:
-                with open(txt_filepath, 'w', encoding='utf-8') as txt_file:
-                    txt_file.write(transcript)
-                print(f"Transcript saved to: {txt_filepath}")
-            except IOError as e:
-                print(f"Error saving transcript: {e}")
-                #flash(f'Error saving transcript for {secure_audio_filename}.')
-                # Continue to save sentiment if possible
-
-            # Save the sentiment analysis results
-            try:
-                with open(sentiment_filepath, 'w', encoding='utf-8') as sentiment_file:
-                    sentiment_file.write(f"Sentiment Score: {sentiment_score:.4f}\n") # Save with more precision if needed
-                    sentiment_file.write(f"Sentiment: {sentiment_label}\n")
-                print(f"Sentiment saved to: {sentiment_filepath}")
-            except IOError as e:
-                print(f"Error saving sentiment analysis: {e}")
-                #flash(f'Error saving sentiment for {secure_audio_filename}.')
-
-            #flash(f'File {secure_audio_filename} processed successfully.')
-
-        except Exception as e:
-            print(f"Error during file upload or processing: {e}")
-            #flash('An error occurred during processing.')
-
-        #flash('Invalid file type. Only .wav files are allowed.')
+    try:
+        print(f"Audio file saved to: {audio_filepath}")
+        recordings_index.add(audio_filename)
+        changes.publish('stt', audio_filename)
+
+        # Process with LLM, keeping per-stage timings for the metadata record
+        duration = audio_duration(audio_data)
+        timings = {}
+        start = time.perf_counter()
+        audio_data = prepare_audio(audio_filename, audio_data)
+        timings['preprocess'] = round(time.perf_counter() - start, 3)
+        start = time.perf_counter()
+        transcript, sentiment_label, sentiment_score = process_audio_with_llm(audio_data)
+        timings['llm'] = round(time.perf_counter() - start, 3)
+
+        # Save transcript and sentiment next to the audio
+        save_results(audio_filename, transcript, sentiment_label, sentiment_score,
+                     duration=duration, timings=timings)
+
+        #flash(f'File {secure_audio_filename} processed successfully.')
+
+    except BackendUnavailable as e:
+        # Nothing was learned about the recording, so drop it and let the client retry later
+        print(f"Rejecting upload, Gemini unavailable: {e}")
+        metrics.inc('upload_errors_total', 1, 'Uploads that failed during processing')
+        stt_store.delete(audio_filename)
+        recordings_index.remove(audio_filename)
+        changes.publish('stt', audio_filename)
+        return jsonify({'error': str(e)}), e.status, {'Retry-After': str(e.retry_after)}
+    except Exception as e:
+        print(f"Error during file upload or processing: {e}")
+        metrics.inc('upload_errors_total', 1, 'Uploads that failed during processing')
+        #flash('An error occurred during processing.')
+
+    # The page uploads with fetch and patches the list from /api/recordings?since=
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'filename': audio_filename}), 201
 
     return redirect(url_for('index')) # Redirect back to the main page
 
@@ -293,11 +456,133 @@ def upload_audio():
 @app.route('/stt/<filename>')
 def stt_file(filename):
     """Serves files (audio, transcript, sentiment) from the STT upload folder."""
-    # Basic security check: prevent directory traversal
-    if '..' in filename or filename.startswith('/'):
-        return "Invalid filename", 400
-    return send_from_directory(app.config['STT_FOLDER'], filename)
+    # MediaServer rejects paths outside the folder and handles Range / ETag / caching
+    return media.send(stt_store, filename)
+
+@app.context_processor
+def media_sources():
+    """Transcoded formats the audio players can offer before the original WAV."""
+    return {'media_sources': media.sources()}
+
+def request_deadline(header):
+    """REQUEST_DEADLINE, or less if the client sent X-Request-Timeout: <seconds> (header is its value)."""
+    try:
+        asked = float(header or REQUEST_DEADLINE)
+    except ValueError:
+        asked = REQUEST_DEADLINE
+    return max(min(asked, REQUEST_DEADLINE), 0)
+
+@app.before_request
+def start_request_metrics():
+    """Starts the request timer and deadline (and the profiler, if enabled)."""
+    g.request_started = time.perf_counter()
+    # Backend calls made for this request give up when the client would have
+    g.deadline = set_deadline(request_deadline(request.headers.get('X-Request-Timeout')))
+    metrics.gauge_add('requests_in_flight', 1, 'HTTP requests being handled')
+    if profiler:
+        profiler.start()
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    """Records request latency by endpoint and saves the profile of slow requests."""
+    if 'request_started' not in g:
+        return
+    reset_deadline(g.deadline)
+    endpoint = request.endpoint or 'unknown'
+    metrics.gauge_add('requests_in_flight', -1, 'HTTP requests being handled')
+    metrics.observe('request_seconds', time.perf_counter() - g.request_started,
+                    'HTTP request latency by endpoint', endpoint=endpoint)
+    if error is not None:
+        metrics.inc('request_errors_total', 1, 'HTTP requests that raised an exception', endpoint=endpoint)
+    if profiler:
+        profiler.stop(endpoint)
+
+@app.after_request
+def count_response(response):
+    """Counts responses by endpoint and status code."""
+    metrics.inc('responses_total', 1, 'HTTP responses by endpoint and status',
+                endpoint=request.endpoint or 'unknown', status=response.status_code)
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text exposition of the stage and request metrics."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def record_validators(filename):
+    """(etag, last_modified) of a recording's metadata record, stat'ed before it is read."""
+    try:
+        stat = os.stat(stt_store.path(record_name(filename)) or '')
+    except OSError:
+        return None, None # Legacy sidecars only, served without validators
+    return file_etag(stat), stat.st_mtime
+
+@app.route('/stt/<filename>/transcript')
+def stt_transcript(filename):
+    """Serves a recording's transcript from its metadata record as plain text (gzipped if accepted)."""
+    filename = secure_filename(filename)
+    etag, last_modified = record_validators(filename)
+    record = load_record(stt_store, filename)
+    if record is None:
+        return "Transcript not found", 404
+    return send_text(record['transcript'], 'text/plain', etag and etag + '-transcript', last_modified)
+
+@app.route('/stt/<filename>/record')
+def stt_record(filename):
+    """Serves a recording's full metadata record (sentiment, duration, model, timings) as JSON."""
+    filename = secure_filename(filename)
+    etag, last_modified = record_validators(filename)
+    record = load_record(stt_store, filename)
+    if record is None:
+        return jsonify({'error': 'Recording not found'}), 404
+    return send_text(json.dumps(record), 'application/json', etag, last_modified)
+
+@app.route('/status')
+def status():
+    """Reports startup time, the state of the cloud clients and the Gemini limit and circuit."""
+    return jsonify({'startup_seconds': round(STARTUP_SECONDS, 3), 'clients': clients.status(),
+                    'backends': {'gemini': dict(gemini_backend.stats(), circuit=gemini_backend.breaker.state)}})
+
+@app.errorhandler(BackendUnavailable)
+def backend_unavailable(e):
+    """Gemini is shedding load or failing: 503 (504 past the deadline) with Retry-After."""
+    return jsonify({'error': str(e)}), e.status, {'Retry-After': str(e.retry_after)}
+
+
+def forget_recording(filename):
+    """Drops an expired recording from the index and tells open pages it is gone."""
+    if allowed_file(filename):
+        recordings_index.remove(filename)
+        changes.publish('stt', filename)
+
+compactor = Compactor(stt_store, 'stt', COMPACT_AFTER_DAYS, RETAIN_DAYS, on_remove=forget_recording)
+
+
+STARTUP_SECONDS = time.perf_counter() - STARTUP_BEGAN
+print(f"App loaded in {STARTUP_SECONDS * 1000:.0f} ms")
+
+_background_started = False
+
+def start_background():
+    """
+    Starts client warm-up and the compactor. Only the server entry points call
+    this (serve(), asgi.py's lifespan, __main__): scripts like bulk_import.py
+    import main too and must never run a second compactor on the same folder.
+    """
+    global _background_started
+    if _background_started:
+        return
+    _background_started = True
+    clients.warm_up(CLIENT_WARMUP_DELAY)
+    if COMPACT_AFTER_DAYS or RETAIN_DAYS:
+        compactor.start(COMPACT_INTERVAL)
+
+def serve():
+    """The app with its background threads running, for gunicorn 'main:serve()'."""
+    start_background()
+    return app
 
 
 if __name__ == '__main__':
+    start_background()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
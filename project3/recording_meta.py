@@ -0,0 +1,187 @@
+"""
+One metadata record per recording, replacing the .txt transcript and
+_sentiment.txt sidecar pair.
+
+A record is <recording name without extension>.json next to the audio and has
+two lines: a small JSON object with the fields the listing needs (sentiment,
+duration, model, timings), then {"transcript": ...}. read_fields() only reads
+the first line, so the listing never loads the transcript.
+Records are written to a temp file and renamed into place, so readers never
+see a half-written one. load_fields() and load_record() read through a
+storage.TieredStore, so records of archived days are found too.
+
+Convert an existing folder of .txt/_sentiment.txt pairs with:
+    python recording_meta.py migrate [uploads/stt] [--keep]
+"""
+import argparse
+import io
+import json
+import os
+import threading
+import time
+import wave
+
+from ids import path_for, walk
+from storage import TieredStore
+
+FORMAT_VERSION = 1
+
+
+def record_name(audio_filename):
+    return os.path.splitext(audio_filename)[0] + '.json'
+
+
+def record_path(folder, audio_filename):
+    return path_for(folder, record_name(audio_filename))
+
+
+def legacy_names(audio_filename):
+    """(transcript, sentiment) sidecar names written before records existed, named by base name."""
+    base_filename = os.path.splitext(audio_filename)[0]
+    return base_filename + '.txt', base_filename + '_sentiment.txt'
+
+
+def legacy_paths(folder, audio_filename):
+    return tuple(path_for(folder, name) for name in legacy_names(audio_filename))
+
+
+def audio_duration(audio):
+    """Length of a WAV (bytes or a path) in seconds, or None if it isn't one."""
+    try:
+        with wave.open(io.BytesIO(audio) if isinstance(audio, bytes) else audio, 'rb') as w:
+            return round(w.getnframes() / float(w.getframerate()), 3)
+    except (wave.Error, EOFError, OSError, ZeroDivisionError):
+        return None
+
+
+def write_record(folder, audio_filename, transcript, sentiment_score=None, sentiment_label=None,
+                 duration=None, model=None, timings=None, created=None, source=None):
+    fields = {
+        'v': FORMAT_VERSION,
+        'filename': audio_filename,
+        'sentiment_score': sentiment_score,
+        'sentiment_label': sentiment_label,
+        'duration': duration,
+        'model': model,
+        'timings': timings or {},
+        'created': created if created is not None else round(time.time(), 3),
+    }
+    if source is not None:
+        fields['source'] = source  # where bulk_import.py read the recording from
+    path = record_path(folder, audio_filename)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        # json.dumps escapes newlines, so each part stays on its own line
+        f.write(json.dumps(fields, separators=(',', ':')) + '\n')
+        f.write(json.dumps({'transcript': transcript}, separators=(',', ':')) + '\n')
+    os.replace(tmp_path, path)
+    return fields
+
+
+def read_fields(path):
+    """The listing fields of a record without the transcript, or None."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.loads(f.readline())
+    except (OSError, ValueError):
+        return None
+
+
+def read_record(path):
+    """The full record including 'transcript', or None."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            fields = json.loads(f.readline())
+            fields['transcript'] = json.loads(f.readline())['transcript']
+    except (OSError, ValueError, KeyError):
+        return None
+    return fields
+
+
+def read_legacy_sentiment(path):
+    """Parses a _sentiment.txt sidecar, returns (score, label) or (None, None)."""
+    sentiment_score = None
+    sentiment_label = None
+    if not os.path.exists(path):
+        return sentiment_score, sentiment_label
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith("Sentiment Score:"):
+                    try:
+                        sentiment_score = float(line.split(":", 1)[1].strip())
+                    except (ValueError, IndexError):
+                        print(f"Warning: Could not parse score from line in {path}: {line}")
+                        sentiment_score = 0.0
+                elif line.startswith("Sentiment:"):
+                    sentiment_label = line.split(":", 1)[1].strip()
+    except IOError as e:
+        print(f"Error reading sentiment file {path}: {e}")
+        sentiment_label = "Error Reading"
+        sentiment_score = 0.0
+    return sentiment_score, sentiment_label
+
+
+def load_fields(store, audio_filename):
+    """Record fields, falling back to the legacy sentiment sidecar. None if neither exists."""
+    path = store.path(record_name(audio_filename))
+    fields = read_fields(path) if path is not None else None
+    if fields is not None:
+        return fields
+    sentiment_path = store.path(legacy_names(audio_filename)[1])
+    if sentiment_path is None:
+        return None
+    score, label = read_legacy_sentiment(sentiment_path)
+    return {'filename': audio_filename, 'sentiment_score': score, 'sentiment_label': label}
+
+
+def load_record(store, audio_filename):
+    """Full record, falling back to the legacy sidecar pair. None if neither exists."""
+    path = store.path(record_name(audio_filename))
+    record = read_record(path) if path is not None else None
+    if record is not None:
+        return record
+    transcript_name, sentiment_name = legacy_names(audio_filename)
+    transcript_path = store.path(transcript_name)
+    if transcript_path is None:
+        return None
+    with open(transcript_path, 'r', encoding='utf-8') as f:
+        transcript = f.read()
+    score, label = read_legacy_sentiment(store.path(sentiment_name) or '')
+    return {'filename': audio_filename, 'sentiment_score': score, 'sentiment_label': label,
+            'transcript': transcript}
+
+
+def migrate(folder, allowed_file, keep=False):
+    """Converts legacy sidecar pairs to records, returns (converted, skipped)."""
+    converted = skipped = 0
+    store = TieredStore(folder)  # the hot folder only, archived days are skipped
+    for filename in sorted(walk(folder)):
+        if not allowed_file(filename):
+            continue
+        transcript_path, sentiment_path = legacy_paths(folder, filename)
+        if os.path.exists(record_path(folder, filename)) or not os.path.exists(transcript_path):
+            skipped += 1
+            continue
+        record = load_record(store, filename)
+        write_record(folder, filename, record['transcript'], record['sentiment_score'],
+                     record['sentiment_label'], duration=audio_duration(path_for(folder, filename)),
+                     created=round(os.path.getmtime(transcript_path), 3))
+        if not keep:
+            for path in (transcript_path, sentiment_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        converted += 1
+    return converted, skipped
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert .txt/_sentiment.txt sidecars to JSON records.")
+    parser.add_argument('command', choices=['migrate'])
+    parser.add_argument('folder', nargs='?', default='uploads/stt')
+    parser.add_argument('--keep', action='store_true', help="leave the old sidecar files in place")
+    args = parser.parse_args()
+
+    converted, skipped = migrate(args.folder, lambda name: name.lower().endswith('.wav'), args.keep)
+    print(f"Converted {converted} recordings, skipped {skipped} in {args.folder}")
@@ -0,0 +1,153 @@
+"""
+Precomputed sentiment rollups for /api/sentiment/stats, kept in the
+recordings index database.
+
+Every scored recording counts once in an hour row and once in a day row:
+
+    sentiment_rollups (bucket, start, label, score, count)
+
+bucket is 'hour' or 'day', start the UTC unix second it begins, and score the
+sentiment score in hundredths (the index rounds scores to 2 decimals). Keying
+on the score means a recording can be taken out again exactly: count, sum,
+min, max, the histogram and the label distribution of a bucket all follow
+from its rows, and there are at most 3 labels x 201 scores of them however
+many recordings the bucket holds. stats() therefore reads a bounded number of
+rows per bucket of the asked range, never the recordings.
+
+RecordingIndex calls apply() in the same transaction as each change to a
+recording's sentiment, and rebuild() when it rebuilds. Recordings are
+bucketed by the created time the index keeps for them, see
+RecordingIndex.created_time.
+"""
+import math
+from collections import Counter
+from datetime import datetime, timezone
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sentiment_rollups (
+    bucket TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    label TEXT NOT NULL,
+    score INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (bucket, start, label, score)
+) WITHOUT ROWID;
+"""
+
+BUCKETS = {'hour': 3600, 'day': 86400}
+HISTOGRAM_BINS = 10  # over [-1, 1], the last bin includes 1.0
+MAX_TIME = 253402300799  # 9999-12-31T23:59:59Z, the last second datetime and sqlite can both hold
+
+
+def _keys(at, sentiment_score, sentiment_label):
+    """The (bucket, start, label, score) rows a recording created at at counts in, [] if none."""
+    if at is None or sentiment_score is None:
+        return []
+    score = round(sentiment_score * 100)
+    label = sentiment_label or ''
+    return [(bucket, at - at % seconds, label, score) for bucket, seconds in BUCKETS.items()]
+
+
+def apply(conn, old, new):
+    """
+    Moves a recording's counts from old to new, each a (created, score, label)
+    tuple or None for a recording that isn't indexed. Call inside the
+    transaction that changes the recordings row.
+    """
+    if old is not None:
+        for key in _keys(*old):
+            conn.execute("UPDATE sentiment_rollups SET count = count - 1 "
+                         "WHERE bucket = ? AND start = ? AND label = ? AND score = ?", key)
+            conn.execute("DELETE FROM sentiment_rollups "
+                         "WHERE bucket = ? AND start = ? AND label = ? AND score = ? AND count <= 0", key)
+    if new is not None:
+        for key in _keys(*new):
+            conn.execute("INSERT INTO sentiment_rollups (bucket, start, label, score, count) "
+                         "VALUES (?, ?, ?, ?, 1) "
+                         "ON CONFLICT (bucket, start, label, score) DO UPDATE SET count = count + 1", key)
+
+
+def rebuild(conn, rows):
+    """Replaces all rollups with those of rows, (created, score, label) tuples."""
+    counts = Counter(key for row in rows for key in _keys(*row))
+    conn.execute("DELETE FROM sentiment_rollups")
+    conn.executemany("INSERT INTO sentiment_rollups (bucket, start, label, score, count) VALUES (?, ?, ?, ?, ?)",
+                     [key + (count,) for key, count in counts.items()])
+
+
+def parse_time(value):
+    """
+    Unix seconds from a number or an ISO 8601 date or time, UTC unless it
+    has an offset. Raises ValueError for anything else, including numbers
+    that aren't finite or lie outside 0..MAX_TIME.
+    """
+    try:
+        seconds = float(value)
+    except ValueError:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        seconds = parsed.timestamp()
+    if not math.isfinite(seconds) or not 0 <= seconds <= MAX_TIME:
+        raise ValueError(f"time out of range: {value}")
+    return int(seconds)
+
+
+def _histogram_bin(score):
+    # score in hundredths, -100..100
+    return min((score + 100) * HISTOGRAM_BINS // 200, HISTOGRAM_BINS - 1)
+
+
+class _Summary:
+    def __init__(self):
+        self.count = 0
+        self.total = 0  # hundredths, so sums stay exact
+        self.min = None
+        self.max = None
+        self.histogram = [0] * HISTOGRAM_BINS
+        self.labels = Counter()
+
+    def add(self, label, score, count):
+        self.count += count
+        self.total += score * count
+        self.min = score if self.min is None else min(self.min, score)
+        self.max = score if self.max is None else max(self.max, score)
+        self.histogram[_histogram_bin(score)] += count
+        self.labels[label] += count
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.total / 100,
+            'mean': round(self.total / self.count / 100, 4) if self.count else None,
+            'min': self.min / 100 if self.min is not None else None,
+            'max': self.max / 100 if self.max is not None else None,
+            'labels': dict(self.labels),
+            'histogram': self.histogram,
+        }
+
+
+def stats(conn, start, end, bucket='day'):
+    """
+    Sentiment of the recordings from start to end (unix seconds, end
+    excluded), widened to whole buckets: {'buckets': [...], 'totals': {...}}.
+    Each bucket with recordings has its start, count, sum, mean, min, max,
+    label counts and a HISTOGRAM_BINS histogram of scores over [-1, 1].
+    """
+    seconds = BUCKETS[bucket]
+    start -= start % seconds
+    rows = conn.execute(
+        "SELECT start, label, score, count FROM sentiment_rollups "
+        "WHERE bucket = ? AND start >= ? AND start < ? ORDER BY start",
+        (bucket, start, end))
+    summaries, totals = {}, _Summary()
+    for row_start, label, score, count in rows:
+        summary = summaries.get(row_start)
+        if summary is None:
+            summary = summaries[row_start] = _Summary()
+        summary.add(label, score, count)
+        totals.add(label, score, count)
+    return {
+        'buckets': [dict(summary.to_dict(), start=row_start) for row_start, summary in summaries.items()],
+        'totals': totals.to_dict(),
+    }
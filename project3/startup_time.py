@@ -0,0 +1,51 @@
+"""
+Measures how long importing the app takes, so startup regressions show up.
+
+    python startup_time.py [--top 15] [--budget 3000]
+
+Runs 'import main' in a fresh interpreter with -X importtime (clients are not
+warmed up), prints the slowest imports made by main and the total, and exits
+non-zero if the total is over --budget milliseconds.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+
+def measure():
+    env = dict(os.environ, USE_FAKE_CLIENTS='1', CLIENT_WARMUP_DELAY='3600')
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'],
+                          cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                          capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr)
+        raise SystemExit(f"import main failed with exit code {proc.returncode}")
+
+    imports = []
+    for line in proc.stderr.splitlines():
+        # "import time:      self [us] |  cumulative | imported package"
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth <= 1:  # main and what it imports directly
+            imports.append((int(cumulative_us), name.strip()))
+    return wall, sorted(imports, reverse=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure app import time.")
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--budget', type=float, default=0, help="fail above this many ms (0 = no limit)")
+    args = parser.parse_args()
+
+    wall, imports = measure()
+    for cumulative_us, name in imports[:args.top]:
+        print(f"{cumulative_us / 1000:9.1f} ms  {name}")
+    print(f"{wall * 1000:9.1f} ms  total (interpreter start + import main)")
+    if args.budget and wall * 1000 > args.budget:
+        sys.exit(f"Startup took {wall * 1000:.0f} ms, over the {args.budget:.0f} ms budget")
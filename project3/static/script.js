@@ -8,6 +8,7 @@ const timerDisplay = document.getElementById('timer');
 let mediaRecorder;
 let audioChunks = [];
 let startTime;
+let timerInterval;
 
 function formatTime(time) {
   const minutes = Math.floor(time / 60);
@@ -21,8 +22,9 @@ recordButton.addEventListener('click', () => {
       mediaRecorder = new MediaRecorder(stream);
       mediaRecorder.start();
 
+      audioChunks = [];
       startTime = Date.now();
-      let timerInterval = setInterval(() => {
+      timerInterval = setInterval(() => {
         const elapsedTime = Math.floor((Date.now() - startTime) / 1000);
         timerDisplay.textContent = formatTime(elapsedTime);
       }, 1000);
@@ -36,21 +38,23 @@ recordButton.addEventListener('click', () => {
         const formData = new FormData();
         formData.append('audio_data', audioBlob, 'recorded_audio.wav');
 
+        timerDisplay.textContent = 'processing...';
         fetch('/upload', {
             method: 'POST',
-            body: formData
+            body: formData,
+            headers: { 'Accept': 'application/json' } // JSON instead of a redirect to the page
         })
         .then(response => {
             if (!response.ok) {
                 throw new Error('Network response was not ok');
             }
-            location.reload(); // Force refresh
-
-            return response.text();
+            return response.json();
         })
         .then(data => {
             console.log('Audio uploaded successfully:', data);
-            // Redirect to playback page or display success message
+            timerDisplay.textContent = formatTime(0);
+            // Patch the new recording into the list instead of reloading the page
+            return applyChanges();
         })
         .catch(error => {
             console.error('Error uploading audio:', error);
@@ -69,10 +73,212 @@ stopButton.addEventListener('click', () => {
   if (mediaRecorder) {
     mediaRecorder.stop();
   }
+  clearInterval(timerInterval);
 
   recordButton.disabled = false;
   stopButton.disabled = true;
 });
 
 // Initially disable the stop button
-stopButton.disabled = true;
\ No newline at end of file
+stopButton.disabled = true;
+
+// --- infinite scroll for the recording lists ---
+
+function escapeHtml(value) {
+  return String(value).replace(/[&<>"']/g, c => ({
+    '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'
+  }[c]));
+}
+
+// transcoded formats the server offers ahead of the original WAV, e.g. [["opus", "audio/ogg; codecs=opus"]]
+const mediaSources = JSON.parse(document.body.dataset.mediaSources || '[]');
+
+function audioItem(src, filename, links) {
+  const sources = mediaSources.map(([format, type]) =>
+    `<source src="${src}?format=${format}" type="${escapeHtml(type)}">`).join('');
+  return `
+    <audio controls preload="none">
+        ${sources}
+        <source src="${src}">
+        Your browser does not support the audio element.
+    </audio>
+    <div class="file-info">
+        <span class="filename">${escapeHtml(filename)}</span>
+        ${links}
+    </div>`;
+}
+
+function renderStt(file) {
+  const src = '/stt/' + encodeURIComponent(file.filename);
+  let links = `
+        <div class="file-links">
+            <a class="matrix-link" href="${src}/transcript" target="_blank">[VIEW TRANSCRIPT]</a>
+            <a class="matrix-link" href="${src}/record" target="_blank">[VIEW SENTIMENT DATA]</a>
+        </div>`;
+  if (file.sentiment_score !== null && file.sentiment_label !== null) {
+    const percent = (file.sentiment_score + 1) * 50;
+    const labelClass = 'sentiment-' + file.sentiment_label.toLowerCase();
+    links += `
+        <div class="sentiment-meter">
+            <div class="sentiment-line"></div>
+            <div class="sentiment-marker" style="left: ${percent}%;"></div>
+            <span class="sentiment-value" style="left: ${percent}%;">${file.sentiment_score.toFixed(2)}</span>
+            <span class="sentiment-label ${escapeHtml(labelClass)}" style="left: ${percent}%;">
+                ${escapeHtml(file.sentiment_label)}
+            </span>
+        </div>`;
+  } else {
+    links += `<p style="color: #ffcc00;">Sentiment data not available or could not be parsed.</p>`;
+  }
+  return audioItem(src, file.filename, links);
+}
+
+const renderers = { stt: renderStt };
+
+// --- patching the lists with what changed instead of reloading the page ---
+
+const CHANGES_POLL_MS = 15000; // picks up other tabs' and users' recordings
+let since = document.body.dataset.since || '';
+
+function patchList(item) {
+  const list = document.getElementById(item.kind + '-list');
+  if (!list) {
+    return;
+  }
+  const existing = [...list.children].find(row => row.dataset.filename === item.filename);
+  if (item.removed) {
+    if (existing) {
+      existing.remove();
+    }
+    return;
+  }
+  const audio = existing && existing.querySelector('audio');
+  if (audio && !audio.paused) {
+    return; // don't cut off playback, the next page load shows the update
+  }
+  const row = existing || document.createElement('li');
+  row.dataset.filename = item.filename;
+  row.innerHTML = renderers[item.kind](item);
+  if (existing) {
+    return;
+  }
+  list.querySelectorAll('li:not([data-filename])').forEach(placeholder => placeholder.remove());
+  // newest first; a recording older than every loaded row arrives with infinite scroll
+  const older = [...list.children].find(other => other.dataset.filename && other.dataset.filename < item.filename);
+  if (older) {
+    list.insertBefore(row, older);
+  } else if (!list.dataset.cursor) {
+    list.appendChild(row);
+  }
+}
+
+function applyChanges() {
+  return fetch(`/api/recordings?since=${encodeURIComponent(since)}`)
+    .then(response => response.json())
+    .then(delta => {
+      if (delta.reset) {
+        location.reload(); // the server restarted or too much changed to patch
+        return;
+      }
+      delta.items.forEach(patchList);
+      since = delta.since;
+    })
+    .catch(error => {
+      console.error('Error loading recording changes:', error);
+    });
+}
+
+setInterval(() => {
+  if (!document.hidden) {
+    applyChanges();
+  }
+}, CHANGES_POLL_MS);
+
+// --- transcript search ---
+
+const searchForm = document.getElementById('searchForm');
+const searchResults = document.getElementById('search-results');
+const searchMore = document.getElementById('searchMore');
+let searchOffset = null;
+
+// the snippet is already escaped by the server, only <mark> is markup
+function renderSearchResult(result) {
+  return `<div class="search-snippet">${result.snippet}</div>` + renderStt(result);
+}
+
+function runSearch(offset) {
+  const params = new URLSearchParams(new FormData(searchForm));
+  params.set('offset', offset);
+  fetch('/search?' + params)
+    .then(response => response.json())
+    .then(page => {
+      if (page.error) {
+        throw new Error(page.error);
+      }
+      if (offset === 0) {
+        searchResults.innerHTML = page.items.length ? '' : '<li>NO MATCHES</li>';
+      }
+      page.items.forEach(result => {
+        const li = document.createElement('li');
+        li.innerHTML = renderSearchResult(result);
+        searchResults.appendChild(li);
+      });
+      searchOffset = page.next_offset;
+      searchMore.hidden = searchOffset === null;
+    })
+    .catch(error => {
+      console.error('Error searching transcripts:', error);
+    });
+}
+
+searchForm.addEventListener('submit', e => {
+  e.preventDefault();
+  runSearch(0);
+});
+
+searchMore.addEventListener('click', () => {
+  if (searchOffset !== null) {
+    runSearch(searchOffset);
+  }
+});
+
+function loadMore(list, sentinel, observer) {
+  const cursor = list.dataset.cursor;
+  if (!cursor || list.dataset.loading) {
+    return;
+  }
+  list.dataset.loading = 'true';
+  const kind = list.dataset.kind;
+  fetch(`/api/recordings?kind=${kind}&cursor=${encodeURIComponent(cursor)}`)
+    .then(response => response.json())
+    .then(page => {
+      page.items.forEach(file => {
+        const li = document.createElement('li');
+        li.dataset.filename = file.filename;
+        li.innerHTML = renderers[kind](file);
+        list.appendChild(li);
+      });
+      list.dataset.cursor = page.next_cursor || '';
+      // re-observing fires again if the sentinel is still on screen
+      observer.unobserve(sentinel);
+      if (page.next_cursor) {
+        observer.observe(sentinel);
+      }
+    })
+    .catch(error => {
+      console.error('Error loading recordings:', error);
+    })
+    .finally(() => {
+      delete list.dataset.loading;
+    });
+}
+
+document.querySelectorAll('.list-sentinel').forEach(sentinel => {
+  const list = document.getElementById(sentinel.dataset.list);
+  const observer = new IntersectionObserver(entries => {
+    if (entries.some(entry => entry.isIntersecting)) {
+      loadMore(list, sentinel, observer);
+    }
+  }, { rootMargin: '200px' });
+  observer.observe(sentinel);
+});
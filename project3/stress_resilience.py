@@ -0,0 +1,118 @@
+"""
+Brownout test of the resilience layer (resilience.py) against the fake
+Gemini model.
+
+    python stress_resilience.py [--threads 32] [--seconds 60] [--brownout 30,10,10,0.5]
+                                [--latency 0.2] [--deadline 5] [--direct]
+
+--threads client threads call generate_content in a loop, each call under a
+--deadline like an upload's, through a Backend as main.py does. The fakes
+(see fakes.py) answer in --latency seconds (lognormal), except during the
+--brownout (<period>,<length>,<slowdown>,<error rate>), when they are
+<slowdown> times slower and fail at <error rate>.
+
+Every second prints the concurrency limit, attempts in flight, circuit state
+and how the calls of that second ended: ok, failed, shed (limit or open
+circuit) or past the deadline, with their p99 latency. With --direct the
+calls go straight to the model, for comparison: during a brownout every
+thread sits in a slow call instead of being shed (the SDK takes no timeout).
+"""
+import argparse
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--seconds', type=int, default=60)
+    parser.add_argument('--brownout', default='30,10,10,0.5', help="period,length,slowdown,error rate")
+    parser.add_argument('--latency', type=float, default=1.0, help="mean seconds per call outside the brownout")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="outside the brownout")
+    parser.add_argument('--deadline', type=float, default=5.0, help="seconds per call, as a request's deadline")
+    parser.add_argument('--concurrency', type=int, default=8, help="starting concurrency limit")
+    parser.add_argument('--think', type=float, default=0.05, help="seconds each thread waits between calls")
+    parser.add_argument('--direct', action='store_true', help="call the client without the resilience layer")
+    args = parser.parse_args()
+
+    # Fakes reads its settings on import
+    os.environ.update(FAKE_LATENCY=str(args.latency), FAKE_LATENCY_DIST='lognormal',
+                      FAKE_ERROR_RATE=str(args.error_rate), FAKE_BROWNOUT=args.brownout)
+    import fakes
+    from resilience import AIMDLimit, Backend, BackendUnavailable, DeadlineExceeded, deadline
+
+    model = fakes.FakeGenerativeModel()
+    # Stands in for Part.from_data, a tenth of a second of audio
+    contents = [SimpleNamespace(inline_data=SimpleNamespace(data=bytes(3200))), "prompt"]
+    backend = Backend('gemini', timeout=args.deadline, limit=AIMDLimit(args.concurrency))
+    outcomes = [] # (finished at, outcome, latency)
+    lock = threading.Lock()
+    stop = time.monotonic() + args.seconds
+
+    def call():
+        if args.direct:
+            return model.generate_content(contents)
+        with deadline(args.deadline):
+            return backend.call(lambda timeout: model.generate_content(contents))
+
+    def run():
+        while time.monotonic() < stop:
+            start = time.monotonic()
+            try:
+                call()
+                outcome = 'ok'
+            except DeadlineExceeded:
+                outcome = 'deadline'
+            except BackendUnavailable:
+                outcome = 'shed'
+            except Exception:
+                outcome = 'failed'
+            with lock:
+                outcomes.append((time.monotonic(), outcome, time.monotonic() - start))
+            time.sleep(args.think)
+
+    threads = [threading.Thread(target=run, daemon=True) for _ in range(args.threads)]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+
+    print(f"{args.threads} threads, {args.latency}s calls, brownout {args.brownout}, deadline {args.deadline}s"
+          f"{' (direct)' if args.direct else ''}")
+    print(f"{'t':>4} {'limit':>6} {'inflight':>8} {'circuit':>9} {'ok':>5} {'failed':>6} {'shed':>5} "
+          f"{'deadline':>8} {'p99':>7}")
+    second = 0
+    while any(t.is_alive() for t in threads):
+        second += 1
+        time.sleep(max(started + second - time.monotonic(), 0))
+        with lock:
+            window = [(outcome, latency) for at, outcome, latency in outcomes
+                      if started + second - 1 <= at < started + second]
+        counts = {name: sum(1 for outcome, latency in window if outcome == name)
+                  for name in ('ok', 'failed', 'shed', 'deadline')}
+        p99 = percentile([latency for outcome, latency in window], 0.99)
+        limit, inflight, circuit = ((f"{backend.limit.limit:.1f}", backend.limit.inflight, backend.breaker.state)
+                                    if not args.direct else ('-', '-', '-'))
+        print(f"{second:>4} {limit:>6} {inflight:>8} {circuit:>9} {counts['ok']:>5} {counts['failed']:>6} "
+              f"{counts['shed']:>5} {counts['deadline']:>8} {p99:>6.2f}s")
+
+    elapsed = time.monotonic() - started
+    totals = {name: sum(1 for at, outcome, latency in outcomes if outcome == name)
+              for name in ('ok', 'failed', 'shed', 'deadline')}
+    print(f"{len(outcomes)} calls in {elapsed:.1f}s, {totals['ok'] / elapsed:.1f} ok/s: {totals}")
+    print(f"p50 {percentile([l for a, o, l in outcomes], 0.5):.3f}s, "
+          f"p99 {percentile([l for a, o, l in outcomes], 0.99):.3f}s")
+    if not args.direct:
+        print(f"backend: {backend.stats()}")
+
+
+if __name__ == '__main__':
+    main()